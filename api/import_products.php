@@ -9,6 +9,13 @@
  * - Headers: '#', 'Descrição', 'Grupo', 'Custo', 'Venda', 'Ativo'
  * - Prices in Brazilian format: R$ 1.234,56
  * 
+ * Also accepts the pre-normalized payload sent by localapp/upload_products.py:
+ * POST application/json (optionally Content-Encoding: gzip) with
+ * {"format": "normalized-v1", "source", "columns", "rows": [[line, pdv_code, name, group, cost, price, active], ...]}.
+ * Rows are re-checked with the same rules as the client validator; any bad row
+ * rejects the whole import with 400 and the offending lines under "invalid_rows"
+ * ([{row, name, error}, ...]).
+ * 
  * Authentication: Optional API key via IMPORT_API_KEY header or parameter
  */
 
@@ -57,8 +64,11 @@ if ($configuredApiKey) {
     }
 }
 
+$isNormalized = stripos($_SERVER['CONTENT_TYPE'] ?? '', 'application/json') === 0;
+$maxPayloadBytes = 50 * 1024 * 1024;
+
 // Check if file was uploaded
-if (!isset($_FILES['file']) || $_FILES['file']['error'] !== UPLOAD_ERR_OK) {
+if (!$isNormalized && (!isset($_FILES['file']) || $_FILES['file']['error'] !== UPLOAD_ERR_OK)) {
     $error = $_FILES['file']['error'] ?? 'No file uploaded';
     logMessage("Upload error: $error");
     http_response_code(400);
@@ -66,38 +76,64 @@ if (!isset($_FILES['file']) || $_FILES['file']['error'] !== UPLOAD_ERR_OK) {
     exit;
 }
 
-$uploadedFile = $_FILES['file']['tmp_name'];
-$filename = $_FILES['file']['name'];
+$uploadedFile = $isNormalized ? null : $_FILES['file']['tmp_name'];
+$filename = $isNormalized ? 'normalized payload' : $_FILES['file']['name'];
 
 logMessage("Starting import from file: $filename");
 
 /**
- * Normalize Brazilian price format to decimal
- * Examples: "R$ 1.234,56" -> 1234.56, "45,00" -> 45.00
+ * Brazilian price text to a 2-decimal string, same rules as normalize_price() in
+ * localapp/upload_products.py: "R$ 1.234,56" -> "1234.56", "45,00" -> "45.00", "" -> "0.00".
+ * Returns null for text that is not a price, negatives, or more than two decimals
+ * (e.g. "1.234" with no comma, which would otherwise be read as 1.234).
  */
 function normalizePrice($value) {
-    if (empty($value)) {
-        return 0.00;
-    }
-    
     // Remove currency symbols and spaces
-    $value = preg_replace('/[^\d,.-]/', '', $value);
+    $value = preg_replace('/[^\d,.-]/', '', (string) $value);
+    if ($value === '') {
+        return '0.00';
+    }
     
     // Handle Brazilian format: 1.234,56 -> 1234.56
     if (strpos($value, ',') !== false && strpos($value, '.') !== false) {
-        // Has both . and , - assume Brazilian format
         $value = str_replace('.', '', $value); // Remove thousand separator
         $value = str_replace(',', '.', $value); // Convert decimal separator
     } elseif (strpos($value, ',') !== false) {
-        // Only comma - assume it's decimal separator
+        // Only comma - it's the decimal separator
         $value = str_replace(',', '.', $value);
     }
     
-    return floatval($value);
+    if (!preg_match('/^(\d*)(?:\.(\d{0,2}))?$/', $value, $m) || ($m[1] === '' && ($m[2] ?? '') === '')) {
+        return null;
+    }
+    $integer = ltrim($m[1], '0');
+    return ($integer === '' ? '0' : $integer) . '.' . str_pad($m[2] ?? '', 2, '0');
 }
 
 /**
- * Parse CSV file and return rows
+ * Errors for one row's PDV code, shared by both import paths (same rules as
+ * validate_csv() in localapp/upload_products.py). Remembers codes in $seenCodes.
+ */
+function codeErrors($pdvCode, $line, &$seenCodes) {
+    if ($pdvCode === '') {
+        return [];
+    }
+    if (!ctype_digit($pdvCode)) {
+        return ["Invalid code '$pdvCode'"];
+    }
+    if (isset($seenCodes[$pdvCode])) {
+        return ["Code $pdvCode repeated (first on line {$seenCodes[$pdvCode]})"];
+    }
+    $seenCodes[$pdvCode] = $line;
+    return [];
+}
+
+const ACTIVE_TRUE = ['sim', 'yes', 'true', '1', 'ativo'];
+const ACTIVE_FALSE = ['não', 'nao', 'no', 'false', '0', 'inativo'];
+
+/**
+ * Parse and validate a CSV file into rows with normalized prices.
+ * Bad rows are collected like validate_csv() does and reject the whole file.
  */
 function parseCSV($filePath) {
     $rows = [];
@@ -116,7 +152,7 @@ function parseCSV($filePath) {
     
     // Normalize header names (trim and lowercase for matching)
     $normalizedHeaders = array_map(function($h) {
-        return strtolower(trim($h));
+        return mb_strtolower(trim(preg_replace('/^\xEF\xBB\xBF/', '', $h)), 'UTF-8');
     }, $headers);
     
     // Map expected columns
@@ -153,33 +189,128 @@ function parseCSV($filePath) {
     
     // Read data rows
     $rowNum = 1;
+    $invalid = [];
+    $seenCodes = [];
     while (($data = fgetcsv($handle, 0, ',')) !== false) {
         $rowNum++;
         
         // Skip empty rows
-        if (empty(array_filter($data))) {
+        if (trim(implode('', $data)) === '') {
             continue;
         }
         
-        $row = [
-            'row_number' => $rowNum,
-            'pdv_code' => $columnMap['pdv_code'] >= 0 ? trim($data[$columnMap['pdv_code']] ?? '') : '',
-            'name' => $columnMap['name'] >= 0 ? trim($data[$columnMap['name']] ?? '') : '',
-            'group' => $columnMap['group'] >= 0 ? trim($data[$columnMap['group']] ?? '') : 'Geral',
-            'cost' => $columnMap['cost'] >= 0 ? trim($data[$columnMap['cost']] ?? '0') : '0',
-            'price' => $columnMap['price'] >= 0 ? trim($data[$columnMap['price']] ?? '0') : '0',
-            'active' => $columnMap['active'] >= 0 ? trim($data[$columnMap['active']] ?? 'Sim') : 'Sim',
-        ];
+        $cell = function ($field, $default = '') use ($columnMap, $data) {
+            return $columnMap[$field] >= 0 ? trim($data[$columnMap[$field]] ?? $default) : $default;
+        };
+        $name = $cell('name');
         
         // Skip rows without name
-        if (empty($row['name'])) {
+        if ($name === '') {
+            continue;
+        }
+        
+        $pdvCode = $cell('pdv_code');
+        $rowErrors = codeErrors($pdvCode, $rowNum, $seenCodes);
+        $prices = [];
+        foreach (['cost', 'price'] as $field) {
+            $raw = $cell($field, '0');
+            $prices[$field] = normalizePrice($raw);
+            if ($prices[$field] === null) {
+                $rowErrors[] = "Invalid $field '$raw'";
+            }
+        }
+        $active = mb_strtolower($cell('active', 'Sim'), 'UTF-8');
+        if (!in_array($active, ACTIVE_TRUE) && !in_array($active, ACTIVE_FALSE)) {
+            $rowErrors[] = "Invalid Ativo value '$active'";
+        }
+        
+        if ($rowErrors) {
+            $invalid[] = ['row' => $rowNum, 'name' => $name, 'error' => implode('; ', $rowErrors)];
             continue;
         }
         
-        $rows[] = $row;
+        $rows[] = [
+            'row_number' => $rowNum,
+            'pdv_code' => $pdvCode,
+            'name' => $name,
+            'group' => $cell('group') !== '' ? $cell('group') : 'Geral',
+            'cost' => $prices['cost'],
+            'price' => $prices['price'],
+            'active' => $active,
+        ];
     }
     
     fclose($handle);
+    if ($invalid) {
+        return ['error' => count($invalid) . ' invalid row(s) in CSV', 'invalid_rows' => $invalid];
+    }
+    return $rows;
+}
+
+/**
+ * Decode and validate a normalized-v1 payload into parseCSV()-shaped rows.
+ * Rules mirror validate_csv() in localapp/upload_products.py. Returns
+ * ['error' => ...] (plus 'invalid_rows') for anything the client has to fix.
+ */
+function parseNormalizedPayload($body, $maxBytes) {
+    $encoding = strtolower($_SERVER['HTTP_CONTENT_ENCODING'] ?? '');
+    if ($encoding === 'gzip') {
+        $body = @gzdecode($body, $maxBytes);
+        if ($body === false) {
+            return ['error' => "Invalid gzip payload (corrupt, or larger than $maxBytes bytes once decompressed)"];
+        }
+    }
+    
+    $payload = json_decode($body, true);
+    if (json_last_error() !== JSON_ERROR_NONE) {
+        return ['error' => 'Invalid JSON payload: ' . json_last_error_msg()];
+    }
+    if (!is_array($payload) || ($payload['format'] ?? '') !== 'normalized-v1' || !is_array($payload['rows'] ?? null)) {
+        return ['error' => 'Invalid payload: expected format normalized-v1 with rows'];
+    }
+    
+    $rows = [];
+    $invalid = [];
+    $seenCodes = [];
+    foreach ($payload['rows'] as $index => $data) {
+        if (!is_array($data) || count($data) !== 7) {
+            $invalid[] = ['row' => $index + 2, 'error' => 'Malformed row'];
+            continue;
+        }
+        [$line, $pdvCode, $name, $group, $cost, $price, $active] = $data;
+        $pdvCode = (string) $pdvCode;
+        $name = trim((string) $name);
+        $rowErrors = [];
+        
+        if ($name === '') {
+            $rowErrors[] = 'Missing name';
+        }
+        $rowErrors = array_merge($rowErrors, codeErrors($pdvCode, $line, $seenCodes));
+        foreach (['cost' => $cost, 'price' => $price] as $field => $value) {
+            if (!is_string($value) || !preg_match('/^\d+\.\d{2}$/', $value)) {
+                $rowErrors[] = "Invalid $field";
+            }
+        }
+        
+        if ($rowErrors) {
+            $invalid[] = ['row' => $line, 'name' => $name, 'error' => implode('; ', $rowErrors)];
+            continue;
+        }
+        
+        $rows[] = [
+            'row_number' => $line,
+            'pdv_code' => $pdvCode,
+            'name' => $name,
+            'group' => trim((string) $group) !== '' ? trim((string) $group) : 'Geral',
+            'cost' => $cost,
+            'price' => $price,
+            'active' => $active ? 'sim' : 'nao',
+        ];
+    }
+    
+    if ($invalid) {
+        return ['error' => count($invalid) . ' invalid row(s) in payload', 'invalid_rows' => $invalid];
+    }
     return $rows;
 }
 
@@ -214,9 +345,10 @@ function getOrCreateGroup($pdo, $groupName) {
 function upsertMenuItem($pdo, $row, $groupId) {
     $pdvCode = empty($row['pdv_code']) ? null : intval($row['pdv_code']);
     $name = $row['name'];
-    $cost = normalizePrice($row['cost']);
-    $price = normalizePrice($row['price']);
-    $isActive = in_array(strtolower(trim($row['active'])), ['sim', 'yes', 'true', '1', 'ativo']);
+    // Prices are already normalized 2-decimal strings on both import paths
+    $cost = $row['cost'];
+    $price = $row['price'];
+    $isActive = in_array($row['active'], ACTIVE_TRUE);
     
     // Try to find existing item by pdv_code or by name+group
     $existingItem = null;
@@ -256,20 +388,36 @@ function upsertMenuItem($pdo, $row, $groupId) {
     }
 }
 
+// Parse CSV, or the client's pre-validated rows, before touching the database:
+// anything rejected here (size, gzip, JSON, headers, rows) is a client error
+if ($isNormalized) {
+    $body = file_get_contents('php://input', false, null, 0, $maxPayloadBytes + 1);
+    if ($body === false || strlen($body) > $maxPayloadBytes) {
+        logMessage("Rejected normalized payload: too large");
+        http_response_code(413);
+        echo json_encode(['success' => false, 'error' => 'Payload too large']);
+        exit;
+    }
+    $rows = parseNormalizedPayload($body, $maxPayloadBytes);
+    unset($body);
+} else {
+    $rows = parseCSV($uploadedFile);
+}
+
+if (isset($rows['error'])) {
+    logMessage("Rejected import from $filename: " . $rows['error']);
+    http_response_code(400);
+    echo json_encode(['success' => false, 'error' => $rows['error'], 'invalid_rows' => $rows['invalid_rows'] ?? []]);
+    exit;
+}
+
+logMessage("Parsed " . count($rows) . " rows from CSV");
+
 // Main import logic
 try {
     $pdo = getDBConnection();
     $pdo->setAttribute(PDO::ATTR_ERRMODE, PDO::ERRMODE_EXCEPTION);
     
-    // Parse CSV
-    $rows = parseCSV($uploadedFile);
-    
-    if (isset($rows['error'])) {
-        throw new Exception($rows['error']);
-    }
-    
-    logMessage("Parsed " . count($rows) . " rows from CSV");
-    
     // Begin transaction
     $pdo->beginTransaction();
     
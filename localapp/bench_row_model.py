@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Row model benchmark
+
+Compares the old RealDictCursor-dict representation of orders/items with the
+slotted Order/OrderItem model from main.py, over a synthetic export backlog.
+Both sides start from the same tuple rows a cursor would return, build the
+rows, format the PEDIDO line and serialize the offline payload.
+
+Usage:
+    python bench_row_model.py [orders] [items_per_order]
+
+Defaults: 2000 orders with 4 items each.
+"""
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from main import (
+    DEFAULT_CUSTOMER,
+    ORDER_COLUMNS,
+    ORDER_ITEM_COLUMNS,
+    Order,
+    OrderItem,
+    format_order_line,
+)
+
+
+def make_rows(n_orders, items_per_order):
+    """Synthetic tuple rows shaped like fetch_orders / fetch_order_items."""
+    base = datetime(2024, 5, 10, 11, 30)
+    orders = []
+    items = {}
+    for i in range(1, n_orders + 1):
+        anonymous = i % 3 == 0
+        orders.append((
+            i, f"PED{i:06d}", (i % 20) or None, "sem cebola" if i % 4 == 0 else None,
+            base + timedelta(seconds=i), base + timedelta(minutes=30 + i % 90),
+            None if anonymous else f"Cliente {i}", None if anonymous else f"c{i}@example.com",
+            None if anonymous else "11 91234-5678", None if anonymous else "01001-000",
+            None if anonymous else "Rua Augusta", None if anonymous else str(i % 900),
+            None, None if anonymous else "Centro", None if anonymous else "São Paulo",
+            None if anonymous else "SP", False,
+        ))
+        items[i] = [
+            (1 + j % 3, Decimal("12.50"), None, f"Item {j}", "Pizzas", 100 + j, Decimal("12.50") * (1 + j % 3))
+            for j in range(items_per_order)
+        ]
+    return orders, items
+
+
+def legacy_format(order, items, order_index, now):
+    merged = {**DEFAULT_CUSTOMER, **{k: v for k, v in order.items() if v is not None}}
+    created_at = merged.get("created_at") or now.isoformat()
+    pickup_time = merged.get("pickup_time") or str(now)
+    line = (
+        f"PEDIDO|{merged.get('customer_name') or merged.get('full_name')}|CPF|123.456.789-10|{merged.get('phone_number')}|"
+        f"{merged.get('cep')}|{merged.get('address_street')}|{merged.get('address_number')}|{merged.get('address_complement')}|"
+        f"{merged.get('address_neighborhood')}|{merged.get('address_city')}|{merged.get('address_state')}|AUTO-ATENDIMENTO|Moto-boy|"
+        f"{merged.get('order_id', '404')}|{merged.get('notes', '')}|{merged.get('order_number', 0)}|{order_index}|"
+        f"{created_at}|{pickup_time}|CARDAPIO DIGITAL|"
+    )
+    for item in items:
+        line += (
+            f" ITEM|{item.get('item_pdv', 1000)}|89350031024|{item.get('notes', '')}|0|{item.get('subtotal', 10)}|{item.get('quantity', 1)}|UNID|99999999|88888888|cest|cfop|0|500|"
+            "cst_icms|icms|reducao_icms|cst_pis|pis|cst_cofins|cofins|imp_federal|imp_estadual|imp_municipal|GRUPO|"
+        )
+    return line.replace("None", "!!!!")
+
+
+def run_legacy(order_rows, item_rows, now):
+    built = []
+    lines = []
+    for idx, row in enumerate(order_rows, start=1):
+        order = dict(zip(ORDER_COLUMNS, row))
+        items = [dict(zip(ORDER_ITEM_COLUMNS, r)) for r in item_rows[row[0]]]
+        lines.append(legacy_format(order, items, idx, now))
+        json.dumps({**order, "items": items}, default=str)
+        built.append((order, items))
+    return built, lines
+
+
+def run_slotted(order_rows, item_rows, now):
+    built = []
+    lines = []
+    for idx, row in enumerate(order_rows, start=1):
+        order = Order.from_row(row)
+        order.items = [OrderItem.from_row(r) for r in item_rows[row[0]]]
+        lines.append(format_order_line(order, order.items, idx, now))
+        json.dumps(order.to_payload())
+        built.append(order)
+    return built, lines
+
+
+def measure(fn, *args):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    built, lines = fn(*args)
+    elapsed = time.perf_counter() - t0
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, retained, peak, lines
+
+
+def main():
+    n_orders = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_order = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    order_rows, item_rows = make_rows(n_orders, per_order)
+    now = datetime(2024, 5, 10, 12, 0)
+
+    results = {}
+    for name, fn in (("dict", run_legacy), ("slots", run_slotted)):
+        results[name] = measure(fn, order_rows, item_rows, now)
+
+    if results["dict"][3] != results["slots"][3]:
+        print("❌ Formatted lines differ between representations")
+        sys.exit(1)
+
+    print(f"{n_orders} orders x {per_order} items")
+    print(f"{'model':<8}{'time (s)':>12}{'orders/s':>12}{'retained KiB':>16}{'peak KiB':>12}")
+    for name, (elapsed, retained, peak, _lines) in results.items():
+        print(f"{name:<8}{elapsed:>12.3f}{n_orders / elapsed:>12.0f}{retained / 1024:>16.0f}{peak / 1024:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
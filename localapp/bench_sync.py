@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Sync engine load benchmark
+
+Generates synthetic orders/order_items/menu_items (the schema of
+database/setup.sql), loads them into a stand-in database and runs the real
+SyncEngine from main.py against a temporary PEDIDOS_DIR. Reports orders/s,
+per-order end-to-end latency (order inserted -> pedido file written) and,
+with --memory, the peak Python heap.
+
+Usage:
+    python bench_sync.py [--sizes 10,100,1000,10000] [--items 3] [--budget 20]
+    python bench_sync.py --replay logs/log2024_5_10.txt [--speed 60] [--interval 1]
+    python bench_sync.py --dsn postgresql://localhost/portuga_bench ...
+
+Backends:
+    default  SQLite stand-in in a temp directory (no server needed)
+    --dsn    a local Postgres that already has database/setup.sql applied;
+             bench rows are tagged (order_number BN...) and deleted afterwards
+
+Replay:
+    --replay reads the exporter's own daily log and re-inserts one order per
+    exported pedido at the same relative times (compressed by --speed) while
+    the engine polls every --interval seconds.
+"""
+
+import argparse
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import main
+
+SQLITE_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, full_name TEXT NOT NULL, email TEXT UNIQUE NOT NULL);
+CREATE TABLE menu_groups (id INTEGER PRIMARY KEY, name TEXT NOT NULL, updated_at TIMESTAMP);
+CREATE TABLE menu_items (
+    id INTEGER PRIMARY KEY, group_id INTEGER NOT NULL, name TEXT NOT NULL,
+    price NUMERIC NOT NULL, updated_at TIMESTAMP
+);
+CREATE TABLE orders (
+    id INTEGER PRIMARY KEY, user_id INTEGER, order_number TEXT UNIQUE NOT NULL, table_number INTEGER,
+    status TEXT DEFAULT 'recebido', order_type TEXT, payment_method TEXT, notes TEXT,
+    pickup_time TIMESTAMP, subtotal NUMERIC, total NUMERIC, created_at TIMESTAMP, updated_at TIMESTAMP,
+    customer_name TEXT, phone_number TEXT, cep TEXT, address_street TEXT, address_number TEXT,
+    address_complement TEXT, address_neighborhood TEXT, address_city TEXT, address_state TEXT,
+    exported BOOLEAN DEFAULT FALSE
+);
+CREATE INDEX idx_orders_status ON orders(status);
+CREATE TABLE order_items (
+    id INTEGER PRIMARY KEY, order_id INTEGER NOT NULL, menu_item_id INTEGER, item_name TEXT NOT NULL,
+    item_price NUMERIC NOT NULL, quantity INTEGER NOT NULL, subtotal NUMERIC NOT NULL, notes TEXT
+);
+CREATE INDEX idx_order_items_order ON order_items(order_id);
+CREATE TABLE maintenance_mode (id INTEGER PRIMARY KEY, is_active BOOLEAN DEFAULT FALSE, restrict_orders BOOLEAN DEFAULT FALSE);
+INSERT INTO maintenance_mode (id, is_active) VALUES (1, FALSE);
+"""
+
+_GREATEST = "GREATEST(mi.updated_at, mg.updated_at)"
+_GREATEST_SQLITE = "MAX(mi.updated_at, COALESCE(mg.updated_at, mi.updated_at))"
+
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("timestamp", lambda b: datetime.fromisoformat(b.decode()))
+
+
+class _SQLiteCursor:
+    """Just enough of a psycopg2 cursor for the queries main.py issues."""
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def execute(self, sql, params=None):
+        if "ADD COLUMN IF NOT EXISTS" in sql or sql.lstrip().upper().startswith("SET LOCAL"):
+            return
+        sql = sql.replace(_GREATEST + " AS changed_at", _GREATEST_SQLITE + ' AS "changed_at [timestamp]"')
+        sql = sql.replace(_GREATEST, _GREATEST_SQLITE)
+        pieces = sql.split("%s")
+        out = [pieces[0]]
+        flat = []
+        for piece, value in zip(pieces[1:], params or ()):
+            if isinstance(value, tuple):
+                out.append("(" + ",".join("?" * len(value)) + ")")
+                flat.extend(value)
+            else:
+                out.append("?")
+                flat.append(value)
+            out.append(piece)
+        self.cur.execute("".join(out), flat)
+
+    def fetchall(self):
+        return self.cur.fetchall()
+
+    def fetchone(self):
+        return self.cur.fetchone()
+
+    def close(self):
+        self.cur.close()
+
+
+class _SQLiteConn:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return _SQLiteCursor(self.conn.cursor())
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteStandIn:
+    def __init__(self, path):
+        self.path = path
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SQLITE_SCHEMA)
+        conn.commit()
+        conn.close()
+
+    def connect(self):
+        raw = sqlite3.connect(self.path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        conn = _SQLiteConn(raw)
+        return conn, conn.cursor()
+
+    def cleanup(self):
+        pass
+
+
+class PostgresTarget:
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.tag = f"BN{int(time.time()) % 100000:05d}"
+        self.user_ids = []
+        self.group_ids = []
+
+    def connect(self):
+        psycopg2 = main.psycopg2_backend()
+        conn = psycopg2.connect(self.dsn)
+        return conn, conn.cursor()
+
+    def cleanup(self):
+        conn, cur = self.connect()
+        cur.execute("DELETE FROM orders WHERE order_number LIKE %s", (self.tag + "%",))
+        if self.group_ids:
+            cur.execute("DELETE FROM menu_groups WHERE id IN %s", (tuple(self.group_ids),))
+        if self.user_ids:
+            cur.execute("DELETE FROM users WHERE id IN %s", (tuple(self.user_ids),))
+        conn.commit()
+        conn.close()
+
+
+class OrderGenerator:
+    """Synthetic data shaped like the site's orders: table, scheduled and as-soon-as-possible orders."""
+
+    def __init__(self, target, tag, items_per_order, seed=7):
+        self.target = target
+        self.tag = tag
+        self.items_per_order = items_per_order
+        self.rng = random.Random(seed)
+        self.menu = []
+        self.users = []
+        self.counter = 0
+
+    def _insert(self, cur, sql, params):
+        cur.execute(sql + " RETURNING id", params)
+        return cur.fetchone()[0]
+
+    def seed_catalog(self, n_groups=8, n_items=60, n_users=200):
+        conn, cur = self.target.connect()
+        now = datetime.now()
+        groups = []
+        for g in range(n_groups):
+            gid = self._insert(cur, "INSERT INTO menu_groups (name, updated_at) VALUES (%s, %s)", (f"{self.tag} Grupo {g}", now))
+            groups.append(gid)
+        for i in range(n_items):
+            price = round(self.rng.uniform(8, 90), 2)
+            mid = self._insert(
+                cur, "INSERT INTO menu_items (group_id, name, price, updated_at) VALUES (%s, %s, %s, %s)",
+                (groups[i % n_groups], f"Item {i}", price, now),
+            )
+            self.menu.append((mid, f"Item {i}", price))
+        for u in range(n_users):
+            uid = self._insert(cur, "INSERT INTO users (full_name, email) VALUES (%s, %s)",
+                               (f"Cliente {u}", f"{self.tag.lower()}_{u}@example.com"))
+            self.users.append(uid)
+        conn.commit()
+        conn.close()
+        if isinstance(self.target, PostgresTarget):
+            self.target.group_ids.extend(groups)
+            self.target.user_ids.extend(self.users)
+
+    def insert_orders(self, n, conn=None, cur=None):
+        """Insert n pending orders; returns {order_id: insert_time}."""
+        own = conn is None
+        if own:
+            conn, cur = self.target.connect()
+        inserted = {}
+        now = datetime.now()
+        for _ in range(n):
+            self.counter += 1
+            kind = self.rng.random()
+            table = self.rng.randint(1, 30) if kind < 0.3 else None
+            pickup = now + timedelta(minutes=self.rng.randint(10, 240)) if 0.3 <= kind < 0.8 else None
+            anonymous = self.rng.random() < 0.3
+            items = [self.rng.choice(self.menu) for _ in range(self.items_per_order)]
+            total = sum(p for _, _, p in items)
+            oid = self._insert(
+                cur,
+                "INSERT INTO orders (user_id, order_number, table_number, status, order_type, payment_method, notes, "
+                "pickup_time, subtotal, total, created_at, customer_name, phone_number, cep, address_street, "
+                "address_number, address_neighborhood, address_city, address_state) "
+                "VALUES (%s, %s, %s, 'recebido', %s, 'pix', %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (
+                    None if anonymous else self.rng.choice(self.users), f"{self.tag}{self.counter}", table,
+                    "local" if table else "viagem", "sem cebola" if self.rng.random() < 0.2 else None, pickup,
+                    total, total, now,
+                    None if anonymous else f"Cliente {self.counter}", None if anonymous else "11 91234-5678",
+                    None if anonymous else "01001-000", None if anonymous else "Rua Augusta",
+                    None if anonymous else str(self.counter % 900), None if anonymous else "Centro",
+                    None if anonymous else "São Paulo", None if anonymous else "SP",
+                ),
+            )
+            for mid, name, price in items:
+                qty = self.rng.randint(1, 3)
+                cur.execute(
+                    "INSERT INTO order_items (order_id, menu_item_id, item_name, item_price, quantity, subtotal) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    (oid, mid, name, price, qty, round(price * qty, 2)),
+                )
+            inserted[oid] = time.time()
+        conn.commit()
+        if own:
+            conn.close()
+        return inserted
+
+
+class ExportRecorder:
+    """Wraps main.write_order_file to timestamp every pedido file per order id."""
+
+    def __init__(self):
+        self.exported = {}
+        self.original = main.write_order_file
+
+    def __enter__(self):
+        def recording_write(content, month, day, order_index, tenant=None):
+            path = self.original(content, month, day, order_index, tenant)
+            self.exported[int(content.split("|")[14])] = time.time()
+            return path
+        main.write_order_file = recording_write
+        return self
+
+    def __exit__(self, *exc):
+        main.write_order_file = self.original
+
+
+def configure_paths(workdir):
+    main.LOGS_DIR = os.path.join(workdir, "logs")
+    main.PEDIDOS_DIR = os.path.join(workdir, "pedidos")
+    main.PROCESSED_FILE = os.path.join(workdir, "processed_orders.json")
+    main.OFFLINE_DB = os.path.join(workdir, "offline_queue.db")
+    main.SPOOL_DIR = os.path.join(workdir, "spool")
+    main.JOURNAL_DB = os.path.join(workdir, "export_journal.db")
+    main.ORDER_SNAPSHOT_DB = os.path.join(workdir, "order_snapshots.db")
+    os.makedirs(main.PEDIDOS_DIR, exist_ok=True)
+
+
+def make_target(args, workdir):
+    if args.dsn:
+        return PostgresTarget(args.dsn)
+    return SQLiteStandIn(os.path.join(workdir, "standin.db"))
+
+
+def make_engine(target, args):
+    settings = dict(main.DEFAULT_SETTINGS)
+    # Synthetic pickups are at most 240 minutes out; a lead that long makes every order due at once,
+    # so the run measures export throughput rather than the pickup schedule
+    settings.update({"export_budget": args.budget, "prep_lead_time": 240})
+    engine = main.SyncEngine(settings, connect=target.connect, notify=main._noop)
+    engine.load_state()
+    return engine
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def run_backlog(size, args):
+    workdir = tempfile.mkdtemp(prefix="portuga_bench_")
+    try:
+        configure_paths(workdir)
+        target = make_target(args, workdir)
+        gen = OrderGenerator(target, getattr(target, "tag", "BN"), args.items)
+        gen.seed_catalog()
+        inserted = gen.insert_orders(size)
+        engine = make_engine(target, args)
+
+        if args.memory:
+            tracemalloc.start()
+        with ExportRecorder() as rec:
+            t0 = time.perf_counter()
+            cycles = 0
+            while len(rec.exported) < size and cycles < size + 10:
+                if engine.sync_once() is None:
+                    raise RuntimeError("stand-in DB failed during sync")
+                cycles += 1
+            elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+        if args.memory:
+            tracemalloc.stop()
+
+        latencies = [rec.exported[o] - inserted[o] for o in rec.exported if o in inserted]
+        target.cleanup()
+        return {
+            "size": size, "exported": len(rec.exported), "cycles": cycles, "elapsed": elapsed,
+            "rate": len(rec.exported) / elapsed if elapsed else 0.0,
+            "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "max": max(latencies or [0.0]),
+            "peak": peak,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+_LOG_LINE = re.compile(r"^\[([^\]]+)\]\t(?:Pedido escrito|Pedido no spool): ")
+
+
+def parse_log_arrivals(path):
+    """Timestamps of every exported pedido in one of the app's daily logs."""
+    stamps = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            m = _LOG_LINE.match(line)
+            if m:
+                try:
+                    stamps.append(datetime.fromisoformat(m.group(1)).timestamp())
+                except ValueError:
+                    continue
+    return stamps
+
+
+def run_replay(args):
+    stamps = parse_log_arrivals(args.replay)
+    if not stamps:
+        print(f"No exported pedidos found in {args.replay}")
+        sys.exit(1)
+    offsets = [(s - stamps[0]) / args.speed for s in stamps]
+    workdir = tempfile.mkdtemp(prefix="portuga_replay_")
+    try:
+        configure_paths(workdir)
+        target = make_target(args, workdir)
+        gen = OrderGenerator(target, getattr(target, "tag", "BN"), args.items)
+        gen.seed_catalog()
+        engine = make_engine(target, args)
+        inserted = {}
+        done = threading.Event()
+
+        def producer():
+            start = time.time()
+            for off in offsets:
+                delay = start + off - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                inserted.update(gen.insert_orders(1))
+            done.set()
+
+        print(f"Replaying {len(stamps)} orders spanning {(stamps[-1] - stamps[0]) / 3600:.1f}h at {args.speed}x "
+              f"(~{offsets[-1]:.0f}s), polling every {args.interval}s")
+        with ExportRecorder() as rec:
+            t0 = time.perf_counter()
+            threading.Thread(target=producer, daemon=True).start()
+            while not done.is_set() or len(rec.exported) < len(stamps):
+                engine.sync_once()
+                time.sleep(args.interval)
+            elapsed = time.perf_counter() - t0
+        latencies = [rec.exported[o] - inserted[o] for o in rec.exported if o in inserted]
+        target.cleanup()
+        print(f"exported {len(rec.exported)} in {elapsed:.1f}s | latency p50 {percentile(latencies, 50):.2f}s "
+              f"p95 {percentile(latencies, 95):.2f}s max {max(latencies or [0.0]):.2f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load benchmark for the localapp sync engine")
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="comma separated backlog sizes")
+    parser.add_argument("--items", type=int, default=3, help="items per order")
+    parser.add_argument("--budget", type=int, default=main.DEFAULT_EXPORT_BUDGET, help="export budget per cycle")
+    parser.add_argument("--dsn", help="Postgres DSN instead of the SQLite stand-in")
+    parser.add_argument("--memory", action="store_true", help="trace peak Python heap (slower)")
+    parser.add_argument("--replay", help="replay a daily log file instead of synthetic backlogs")
+    parser.add_argument("--speed", type=float, default=60.0, help="replay time compression")
+    parser.add_argument("--interval", type=float, default=1.0, help="replay poll interval in seconds")
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_args()
+    if args.replay:
+        run_replay(args)
+        return
+
+    print(f"{'orders':>8}{'cycles':>8}{'time (s)':>10}{'orders/s':>10}{'p50 (s)':>9}{'p95 (s)':>9}{'max (s)':>9}{'peak MiB':>10}")
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        r = run_backlog(size, args)
+        peak = f"{r['peak'] / 1048576:.1f}" if r["peak"] is not None else "-"
+        print(f"{r['exported']:>8}{r['cycles']:>8}{r['elapsed']:>10.2f}{r['rate']:>10.0f}"
+              f"{r['p50']:>9.2f}{r['p95']:>9.2f}{r['max']:>9.2f}{peak:>10}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Fake PDV consumer
+
+Simulates Datacaixa picking up pedido_*.txt files, so the PDV watcher and its
+backpressure can be exercised locally without the real register.
+
+Usage:
+    python fake_pdv.py path/to/Pedidos [--delay 2] [--rate 1] [--stall-after N] [--stall-for S]
+
+Options:
+    --delay        seconds a file sits in the directory before it is consumed
+    --rate         max files consumed per second
+    --stall-after  stop consuming after N files (simulates a frozen PDV)
+    --stall-for    resume after S seconds of stall (0 = stay stalled)
+    --keep         move consumed files to <dir>/processados instead of deleting
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fake PDV consumer for pedido files")
+    parser.add_argument("directory")
+    parser.add_argument("--delay", type=float, default=2.0)
+    parser.add_argument("--rate", type=float, default=1.0)
+    parser.add_argument("--stall-after", type=int, default=0)
+    parser.add_argument("--stall-for", type=float, default=0.0)
+    parser.add_argument("--keep", action="store_true")
+    return parser.parse_args()
+
+
+def consume(path, keep):
+    if keep:
+        done_dir = os.path.join(os.path.dirname(path), "processados")
+        os.makedirs(done_dir, exist_ok=True)
+        shutil.move(path, os.path.join(done_dir, os.path.basename(path)))
+    else:
+        os.remove(path)
+
+
+def main():
+    args = parse_args()
+    if not os.path.isdir(args.directory):
+        print(f"Error: directory not found: {args.directory}")
+        sys.exit(1)
+
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    consumed = 0
+    stalled_since = None
+    print(f"Consuming pedido files from {args.directory} (delay {args.delay}s, rate {args.rate}/s)")
+
+    try:
+        while True:
+            if args.stall_after and consumed >= args.stall_after:
+                if stalled_since is None:
+                    stalled_since = time.time()
+                    print(f"⏸  Stalled after {consumed} files")
+                if not args.stall_for or time.time() - stalled_since < args.stall_for:
+                    time.sleep(0.5)
+                    continue
+                print("▶  Resuming")
+                consumed = 0
+                stalled_since = None
+
+            now = time.time()
+            ready = []
+            for name in sorted(os.listdir(args.directory)):
+                if not (name.startswith("pedido_") and name.endswith(".txt")):
+                    continue
+                path = os.path.join(args.directory, name)
+                try:
+                    if now - os.path.getmtime(path) >= args.delay:
+                        ready.append(path)
+                except OSError:
+                    continue
+
+            if not ready:
+                time.sleep(0.2)
+                continue
+
+            path = ready[0]
+            try:
+                consume(path, args.keep)
+                consumed += 1
+                print(f"✅ {os.path.basename(path)}")
+            except OSError as e:
+                print(f"⚠️  {os.path.basename(path)}: {e}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print(f"\nConsumed {consumed} files")
+
+
+if __name__ == '__main__':
+    main()
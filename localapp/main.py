@@ -1,37 +1,102 @@
+import time
+_PROCESS_START = time.perf_counter()
+
 import customtkinter as ctk
 import os
-import dotenv
-import psycopg2
 import traceback
 import json
 import threading
-import time
 import sqlite3
 import platform
+import heapq
+import hashlib
+import csv
+import gzip
+import re
+import shutil
 import sys
-from psycopg2.extras import RealDictCursor
+import tracemalloc
+import functools
+import queue
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from customtkinter import CTk as CTK
 from pathlib import Path
-from datetime import datetime, timedelta
-from dateutil import tz
-from typing import Tuple, List, Dict, Any
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Tuple, List, Dict, Any, Optional
+
+# -----------------------
+# Startup profile / lazy backends
+# -----------------------
+STARTUP_BUDGET_MS = 1500
+STARTUP_PROFILE: List[Tuple[str, float]] = []   # (phase, ms since process start)
+LAZY_IMPORT_TIMES: Dict[str, float] = {}        # backend -> ms spent importing it
+
+def startup_mark(phase: str):
+    STARTUP_PROFILE.append((phase, (time.perf_counter() - _PROCESS_START) * 1000))
+
+startup_mark("imports")
+
+def lazy_backend(loader):
+    """
+    Run `loader` (which does the actual import) on first call and cache the
+    result; None if the import fails. Imports stay as plain import statements
+    inside the loaders so PyInstaller still bundles them.
+    """
+    cache = []
+
+    def get():
+        if not cache:
+            t0 = time.perf_counter()
+            try:
+                cache.append(loader())
+            except Exception:
+                cache.append(None)
+            LAZY_IMPORT_TIMES[loader.__name__] = (time.perf_counter() - t0) * 1000
+        return cache[0]
+
+    get.__name__ = loader.__name__
+    return get
 
-# Optional notification libs
-try:
+@lazy_backend
+def psycopg2_backend():
+    import psycopg2
+    return psycopg2
+
+@lazy_backend
+def win10toast_backend():
     from win10toast import ToastNotifier
-except Exception:
-    ToastNotifier = None
+    return ToastNotifier
 
-try:
+@lazy_backend
+def plyer_backend():
     from plyer import notification as plyer_notification
-except Exception:
-    plyer_notification = None
+    return plyer_notification
 
-# Optional websocket client
-try:
+@lazy_backend
+def websocket_backend():
     import websocket
-except Exception:
-    websocket = None
+    return websocket
+
+@lazy_backend
+def inotify_backend():
+    from inotify_simple import INotify, flags as inotify_flags
+    return INotify, inotify_flags
+
+@lazy_backend
+def http_server_backend():
+    import http.server
+    return http.server
+
+@lazy_backend
+def asyncio_backend():
+    import asyncio
+    return asyncio
+
+def now_local() -> datetime:
+    """Timezone-aware local now (what dateutil's tz.gettz() gave us, without importing dateutil)."""
+    return datetime.now().astimezone()
 
 # -----------------------
 # Configuration / Globals
@@ -41,10 +106,26 @@ PEDIDOS_DIR = "C:/Datacaixa/Integracao/Pedidos"
 PROCESSED_FILE = "./processed_orders.json"
 OFFLINE_DB = "./offline_queue.db"
 SETTINGS_FILE = "./settings.json"
-dotenv.load_dotenv()
-ORDER_INDEX = 1
+SPOOL_DIR = "./spool"
+JOURNAL_DB = "./export_journal.db"
+ARCHIVE_DIR = "./archive"
+ORDER_SNAPSHOT_DB = "./order_snapshots.db"
+STARTUP_PROFILE_FILE = "startup_profile.txt"
 
 DEFAULT_POLL_INTERVAL = 5
+DEFAULT_POLL_MIN_INTERVAL = 2
+DEFAULT_POLL_MAX_INTERVAL = 60
+DEFAULT_EXPORT_BUDGET = 20     # max orders exported per sync cycle
+DEFAULT_PREP_LEAD_TIME = 30    # minutes before pickup_time an order must reach the PDV
+DEFAULT_CHANGE_CHECK_INTERVAL = 60  # seconds between scans for orders changed after export
+DEFAULT_CHANGE_WINDOW_HOURS = 48    # only orders exported this recently are scanned for changes
+DEFAULT_CHANGE_LOOKBACK = 120       # seconds re-scanned behind the updated_at watermark (late commits)
+CHANGE_ITEM_LOOKBACK = 200          # order_items ids re-scanned behind the id watermark, for the same reason
+DEFAULT_METRICS_PORT = 9187
+DEFAULT_TENANT_WORKERS = 2
+DEFAULT_ARCHIVE_AFTER_DAYS = 7
+DEFAULT_ARCHIVE_RETENTION_DAYS = 365
+ARCHIVE_INTERVAL = 6 * 3600    # seconds between archive runs (first one shortly after startup)
 DEFAULT_THEME = "light"
 
 THEME_PALETTE = {
@@ -93,10 +174,39 @@ DEFAULT_CUSTOMER = {
 DEFAULT_SETTINGS = {
     "theme": DEFAULT_THEME,
     "poll_interval": DEFAULT_POLL_INTERVAL,
+    "poll_min_interval": DEFAULT_POLL_MIN_INTERVAL,
+    "poll_max_interval": DEFAULT_POLL_MAX_INTERVAL,
     "auto_sync": False,
     "ws_url": "",              # WebSocket URL if used (ws:// or wss://)
     "notify_windows": True,
     "mark_exported_in_db": True,  # try to mark exported in DB
+    "export_budget": DEFAULT_EXPORT_BUDGET,
+    "prep_lead_time": DEFAULT_PREP_LEAD_TIME,
+    "snapshot_cache_mb": 20,      # local LRU copy of fetched orders for reprocess/retry; 0 = off
+    "snapshot_max_age_days": 30,  # snapshots older than this are dropped
+    "change_detection": True,     # re-export orders whose items/notes changed after export
+    "change_check_interval": DEFAULT_CHANGE_CHECK_INTERVAL,
+    "change_window_hours": DEFAULT_CHANGE_WINDOW_HOURS,
+    "change_lookback_seconds": DEFAULT_CHANGE_LOOKBACK,
+    "spool_enabled": True,        # write to SPOOL_DIR first, deliver to pedidos_dirs in background
+    "pedidos_dirs": [],           # delivery destinations; empty = [PEDIDOS_DIR]
+    "pdv_watch_dir": "",          # directory the PDV consumes from; empty = PEDIDOS_DIR
+    "pdv_backlog_slow": 20,       # unconsumed files before exports are throttled
+    "pdv_backlog_pause": 50,      # unconsumed files before exports are paused
+    "db_connect_timeout": 5,      # seconds
+    "db_statement_timeout": 15,   # seconds
+    "db_failure_threshold": 3,    # consecutive DB failures before the circuit breaker opens
+    "db_reset_timeout": 15,       # seconds the breaker stays open before a trial reconnect
+    "db_pool_size": 2,            # pooled DB connections per tenant
+    "tenant_workers": DEFAULT_TENANT_WORKERS,  # threads per tenant for blocking DB/file work (keep <= db_pool_size)
+    "archive_after_days": DEFAULT_ARCHIVE_AFTER_DAYS,          # compress logs/pedido files older than this; 0 = never
+    "archive_retention_days": DEFAULT_ARCHIVE_RETENTION_DAYS,  # delete archived days older than this; 0 = keep forever
+    "metrics_enabled": False,     # serve /metrics (Prometheus) and /metrics.json on 127.0.0.1
+    "metrics_port": DEFAULT_METRICS_PORT,
+    # Branches served by this process: [{"name", "database_url" | "database_url_env", "pedidos_dirs",
+    # "pdv_watch_dir", "data_dir", ...per-branch overrides}]. Empty = one branch (DATABASE_URL, PEDIDOS_DIR).
+    # Named branches need their own database URL and their own pedidos dir(s); others are skipped.
+    "tenants": [],
 }
 
 def load_settings() -> dict:
@@ -119,7 +229,23 @@ def get_path_mei(rel_path: str):
     path = os.path.join(abs_path, rel_path)
     return path
 
-dotenv.load_dotenv(get_path_mei('.env'), override=True)
+def load_env():
+    """
+    Load .env files once, without dotenv's find_dotenv() directory walk: the
+    app/bundle .env overrides the environment, a .env in the working
+    directory only fills in what is still missing.
+    """
+    try:
+        import dotenv
+    except Exception:
+        return
+    app_env = os.path.abspath(get_path_mei(".env"))
+    dotenv.load_dotenv(app_env, override=True)
+    cwd_env = os.path.abspath(".env")
+    if cwd_env != app_env and os.path.exists(cwd_env):
+        dotenv.load_dotenv(cwd_env)
+
+load_env()
 
 def save_settings(s: dict):
     try:
@@ -136,7 +262,7 @@ def get_log_file_path(now: datetime) -> str:
 
 def append_log(msg: str):
     ensure_dir(get_path_mei(LOGS_DIR))
-    now = datetime.now(tz=tz.gettz())
+    now = now_local()
     path = get_log_file_path(now)
     try:
         with open(path, "a", encoding="utf-8") as lf:
@@ -153,33 +279,285 @@ def log_error(exception: Exception, message: str):
     except Exception:
         pass
 
-def connect_db():
-    db_url = os.getenv("DATABASE_URL")
+def read_log(file_name: str, tail_lines: int = None) -> str:
+    """Contents of a log file, or only its last `tail_lines` lines (read from the end of the file)."""
+    path = os.path.join(get_path_mei(LOGS_DIR), file_name)
+    archived = os.path.join(archive_logs_dir(), file_name + ".gz")
+    if not os.path.exists(path) and os.path.exists(archived):
+        return read_archived_log(archived, tail_lines)
+    try:
+        if tail_lines is None:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            block = 256 * tail_lines
+            while True:
+                f.seek(max(0, size - block))
+                data = f.read()
+                if block >= size or data.count(b"\n") > tail_lines:
+                    break
+                block *= 4
+        lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+        return "".join(lines[-tail_lines:])
+    except Exception as e:
+        return f"Erro ao ler log: {e}"
+
+# -----------------------
+# DB access / circuit breaker
+# -----------------------
+class CircuitOpenError(Exception):
+    """Raised instead of touching the DB while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold consecutive failures) -> open
+    open -> (reset_timeout elapsed) -> half_open: one trial call is let through
+    half_open -> success: closed | failure: open again, with a doubled reset_timeout (up to max_reset_timeout)
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 15, max_reset_timeout: float = 300):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.last_error = ""
+        self.total_failures = 0
+        self.lock = threading.Lock()
+
+    def configure(self, failure_threshold: int, reset_timeout: float):
+        with self.lock:
+            self.failure_threshold = max(1, failure_threshold)
+            self.base_reset_timeout = self.reset_timeout = max(1, reset_timeout)
+
+    def retry_in(self) -> float:
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.time())
+
+    def before_call(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.time() < self.opened_at + self.reset_timeout:
+                    raise CircuitOpenError(f"Banco indisponível; nova tentativa em {self.retry_in():.0f}s")
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_flight:
+                    raise CircuitOpenError("Banco em teste de reconexão")
+                self.trial_in_flight = True
+
+    def allows_request(self) -> bool:
+        return self.state == self.CLOSED or (self.state == self.OPEN and self.retry_in() == 0.0)
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                append_log("Circuit breaker do banco fechado (conexão restabelecida)")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+            self.reset_timeout = self.base_reset_timeout
+            self.last_error = ""
+
+    def record_failure(self, error: Exception = None):
+        with self.lock:
+            self.failures += 1
+            self.total_failures += 1
+            self.last_error = str(error) if error else self.last_error
+            if self.state == self.HALF_OPEN:
+                self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+            elif self.failures < self.failure_threshold:
+                return
+            if self.state != self.OPEN:
+                append_log(f"Circuit breaker do banco aberto por {self.reset_timeout:.0f}s: {self.last_error}")
+            self.state = self.OPEN
+            self.opened_at = time.time()
+            self.trial_in_flight = False
+
+    def status_text(self) -> str:
+        if self.state == self.CLOSED:
+            return ""
+        if self.state == self.HALF_OPEN:
+            return "Banco: testando reconexão..."
+        return f"Banco: offline (circuit breaker aberto) — nova tentativa em {self.retry_in():.0f}s"
+
+DB_BREAKER = CircuitBreaker()
+DB_TIMEOUTS = {"connect": 5, "statement": 15}   # seconds
+
+def db_timeouts(settings: dict) -> Dict[str, float]:
+    return {
+        "connect": max(1, int(settings.get("db_connect_timeout", 5))),
+        "statement": max(1, float(settings.get("db_statement_timeout", 15))),
+    }
+
+def configure_db(settings: dict):
+    DB_TIMEOUTS.update(db_timeouts(settings))
+    DB_BREAKER.configure(int(settings.get("db_failure_threshold", 3)), float(settings.get("db_reset_timeout", 15)))
+
+def connect_db(db_url: str, breaker: CircuitBreaker = None, timeouts: Dict[str, float] = None):
+    """
+    Connect with bounded connect/statement timeouts, failing fast while the circuit breaker is open.
+    db_url is used as given: only the default tenant resolves DATABASE_URL (see Tenant).
+    """
+    breaker = breaker or DB_BREAKER
+    timeouts = timeouts or DB_TIMEOUTS
     if not db_url:
         raise Exception("URL do banco de dados não configurado no ambiente")
-    conn = psycopg2.connect(db_url)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    psycopg2 = psycopg2_backend()
+    if psycopg2 is None:
+        raise Exception("psycopg2 não instalado")
+    breaker.before_call()
+    try:
+        conn = psycopg2.connect(
+            db_url,
+            connect_timeout=int(timeouts["connect"]),
+            options=f"-c statement_timeout={int(timeouts['statement'] * 1000)}",
+            keepalives=1,
+            keepalives_idle=10,
+            keepalives_interval=5,
+            keepalives_count=3,
+        )
+    except Exception as e:
+        breaker.record_failure(e)
+        raise
+    breaker.record_success()
+    cur = conn.cursor()
     return conn, cur
 
-def load_processed() -> set:
+class PooledConnection:
+    """A pooled psycopg2 connection; close() hands it back to the pool instead of dropping it."""
+
+    def __init__(self, pool: "ConnectionPool", raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+class ConnectionPool:
+    """
+    Small per-tenant set of reusable DB connections.
+
+    Callers keep the usual `conn, cur = connect()` ... `conn.close()` shape.
+    At most `size` connections are out at once, so one branch can't starve
+    the others of sockets. Idle connections are dropped while the breaker
+    is not closed, so a trial reconnect always uses a fresh connection.
+    """
+
+    def __init__(self, db_url: str, breaker: CircuitBreaker, size: int = 2, timeouts: Dict[str, float] = None):
+        self.db_url = db_url
+        self.breaker = breaker
+        self.timeouts = timeouts or DB_TIMEOUTS
+        self.size = max(1, size)
+        self.idle = []
+        self.in_use = 0
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.size)
+
+    def connect(self):
+        if not self.slots.acquire(timeout=self.timeouts["connect"] + self.timeouts["statement"]):
+            raise Exception("Todas as conexões do banco estão em uso")
+        try:
+            raw = None
+            with self.lock:
+                if self.breaker.state != CircuitBreaker.CLOSED:
+                    self._drop_idle()
+                while self.idle and raw is None:
+                    candidate = self.idle.pop()
+                    if not candidate.closed:
+                        raw = candidate
+            if raw is None:
+                raw, cur = connect_db(self.db_url, self.breaker, self.timeouts)
+                cur.close()
+                self.opened += 1
+            with self.lock:
+                self.in_use += 1
+            return PooledConnection(self, raw), raw.cursor()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, raw):
+        try:
+            raw.rollback()
+            keep = not raw.closed
+        except Exception:
+            keep = False
+        with self.lock:
+            self.in_use -= 1
+            if keep and len(self.idle) < self.size:
+                self.idle.append(raw)
+                raw = None
+        if raw is not None:
+            try:
+                raw.close()
+            except Exception:
+                pass
+        self.slots.release()
+
+    def _drop_idle(self):
+        for raw in self.idle:
+            try:
+                raw.close()
+            except Exception:
+                pass
+        self.idle.clear()
+
+    def close(self):
+        with self.lock:
+            self._drop_idle()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "in_use": self.in_use, "idle": len(self.idle), "opened": self.opened}
+
+def startup_report() -> str:
+    lines = ["Perfil de startup (ms desde o início do processo)"]
+    prev = 0.0
+    for phase, ms in STARTUP_PROFILE:
+        lines.append(f"  {phase:<12}{ms:>9.1f}  (+{ms - prev:.1f})")
+        prev = ms
+    if LAZY_IMPORT_TIMES:
+        lines.append("Backends carregados sob demanda (ms)")
+        for name, ms in sorted(LAZY_IMPORT_TIMES.items(), key=lambda kv: -kv[1]):
+            lines.append(f"  {name:<22}{ms:>9.1f}")
+    return "\n".join(lines) + "\n"
+
+def load_processed(path: str = None) -> set:
+    path = path or get_path_mei(PROCESSED_FILE)
     try:
-        if os.path.exists(get_path_mei(PROCESSED_FILE)):
-            with open(get_path_mei(PROCESSED_FILE), "r", encoding="utf-8") as f:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f)
                 return set(data.get("processed", []))
     except Exception:
         pass
     return set()
 
-def save_processed(processed_set: set):
+def save_processed(processed_set: set, path: str = None):
     try:
-        with open(get_path_mei(PROCESSED_FILE), "w", encoding="utf-8") as f:
+        with open(path or get_path_mei(PROCESSED_FILE), "w", encoding="utf-8") as f:
             json.dump({"processed": list(processed_set)}, f)
     except Exception as e:
         log_error(e, "Falha ao salvar processed_orders.json")
 
-def init_offline_db():
-    conn = sqlite3.connect(get_path_mei(OFFLINE_DB), check_same_thread=False)
+def init_offline_db(path: str = None):
+    conn = sqlite3.connect(path or get_path_mei(OFFLINE_DB), check_same_thread=False)
     cur = conn.cursor()
     cur.execute("""
         CREATE TABLE IF NOT EXISTS queued_orders (
@@ -194,49 +572,6 @@ def init_offline_db():
     conn.commit()
     return conn
 
-OFFLINE_CONN = None
-
-def enqueue_offline(order_id: int, payload: dict):
-    global OFFLINE_CONN
-    try:
-        if OFFLINE_CONN is None:
-            OFFLINE_CONN = init_offline_db()
-        cur = OFFLINE_CONN.cursor()
-        cur.execute("INSERT INTO queued_orders (order_id, payload) VALUES (?, ?)", (order_id, json.dumps(payload)))
-        OFFLINE_CONN.commit()
-    except Exception as e:
-        log_error(e, "Falha ao enfileirar pedido offline")
-
-def retry_offline_queue(process_function):
-    """Background thread trying to reprocess queued orders"""
-    global OFFLINE_CONN
-    if OFFLINE_CONN is None:
-        OFFLINE_CONN = init_offline_db()
-    cur = OFFLINE_CONN.cursor()
-    while True:
-        try:
-            cur.execute("SELECT id, order_id, payload, attempts FROM queued_orders WHERE status='pending' ORDER BY created_at LIMIT 10")
-            rows = cur.fetchall()
-            if not rows:
-                time.sleep(10)
-                continue
-            for row in rows:
-                qid, oid, payload_json, attempts = row
-                payload = json.loads(payload_json)
-                try:
-                    ok = process_function(payload, offline_retry=True)
-                    if ok:
-                        cur.execute("DELETE FROM queued_orders WHERE id=?", (qid,))
-                    else:
-                        cur.execute("UPDATE queued_orders SET attempts=attempts+1 WHERE id=?", (qid,))
-                    OFFLINE_CONN.commit()
-                except Exception as e:
-                    cur.execute("UPDATE queued_orders SET attempts=attempts+1 WHERE id=?", (qid,))
-                    OFFLINE_CONN.commit()
-        except Exception as e:
-            log_error(e, "Erro no worker de retry offline")
-            time.sleep(10)
-
 def ensure_exported_column(cur, conn):
     """Try to add exported column to orders if not exists (best-effort)."""
     try:
@@ -248,9 +583,15 @@ def ensure_exported_column(cur, conn):
         except Exception:
             pass
 
-def mark_order_exported_in_db(cur, conn, order_id: int):
+def mark_order_exported_in_db(cur, conn, order_id: int, order: "Order" = None):
+    """
+    Set orders.exported. The UPDATE fires orders_updated_at, so when `order`
+    carries a snapshot version its updated_at part is moved to the value the
+    mark itself wrote (otherwise every freshly exported snapshot is stale).
+    """
     try:
-        cur.execute("UPDATE orders SET exported = TRUE WHERE id = %s", (order_id,))
+        cur.execute("UPDATE orders SET exported = TRUE WHERE id = %s RETURNING updated_at", (order_id,))
+        row = cur.fetchone()
         conn.commit()
     except Exception as e:
         try:
@@ -259,12 +600,137 @@ def mark_order_exported_in_db(cur, conn, order_id: int):
             pass
         log_error(e, f"Não foi possível marcar order {order_id} como exported no DB")
         return False
+    if order is not None and order.version is not None and row is not None:
+        _updated_at, last_item, count = order.version.rsplit("|", 2)
+        order.version = order_version(row[0], last_item, count)
     return True
 
-def fetch_orders(cur, statuses: Tuple[str, ...] = ("recebido", "em_andamento")) -> List[Dict[str, Any]]:
-    cur.execute(
-        """
-        SELECT
+# -----------------------
+# Row model
+# -----------------------
+# Column order of the tuple cursor rows; fetch_orders / fetch_order_items
+# must select exactly these columns in this order.
+ORDER_COLUMNS = (
+    "order_id",
+    "order_number",
+    "table_number",
+    "notes",
+    "created_at",
+    "pickup_time",
+    "customer_name",
+    "email",
+    "phone_number",
+    "cep",
+    "address_street",
+    "address_number",
+    "address_complement",
+    "address_neighborhood",
+    "address_city",
+    "address_state",
+    "exported",
+    "total",
+)
+
+ORDER_ITEM_COLUMNS = ("quantity", "item_price", "notes", "name", "group_name", "item_pdv", "subtotal")
+
+_DEFAULT_NAME = DEFAULT_CUSTOMER["full_name"]
+_DEFAULT_PHONE = DEFAULT_CUSTOMER["phone_number"]
+_DEFAULT_CEP = DEFAULT_CUSTOMER["cep"]
+_DEFAULT_STREET = DEFAULT_CUSTOMER["address_street"]
+_DEFAULT_NUMBER = DEFAULT_CUSTOMER["address_number"]
+_DEFAULT_COMPLEMENT = DEFAULT_CUSTOMER["address_complement"]
+_DEFAULT_NEIGHBORHOOD = DEFAULT_CUSTOMER["address_neighborhood"]
+_DEFAULT_CITY = DEFAULT_CUSTOMER["address_city"]
+_DEFAULT_STATE = DEFAULT_CUSTOMER["address_state"]
+
+def _json_safe(value):
+    """Keep JSON natives, stringify the rest (datetime, Decimal) exactly as the f-strings would."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+class Order:
+    """
+    One row of fetch_orders. Missing customer fields fall back to DEFAULT_CUSTOMER on construction.
+    version is order_version() of the DB rows it was built from (None for WS/offline payloads).
+    """
+    __slots__ = ORDER_COLUMNS + ("items", "version")
+
+    def __init__(self, order_id, order_number, table_number, notes, created_at, pickup_time,
+                 customer_name, email, phone_number, cep, address_street, address_number,
+                 address_complement, address_neighborhood, address_city, address_state, exported=False, total=None):
+        self.order_id = order_id
+        self.order_number = order_number
+        self.table_number = table_number
+        self.notes = notes
+        self.created_at = created_at
+        self.pickup_time = pickup_time
+        self.customer_name = customer_name or _DEFAULT_NAME
+        self.email = email
+        self.phone_number = _DEFAULT_PHONE if phone_number is None else phone_number
+        self.cep = _DEFAULT_CEP if cep is None else cep
+        self.address_street = _DEFAULT_STREET if address_street is None else address_street
+        self.address_number = _DEFAULT_NUMBER if address_number is None else address_number
+        self.address_complement = _DEFAULT_COMPLEMENT if address_complement is None else address_complement
+        self.address_neighborhood = _DEFAULT_NEIGHBORHOOD if address_neighborhood is None else address_neighborhood
+        self.address_city = _DEFAULT_CITY if address_city is None else address_city
+        self.address_state = _DEFAULT_STATE if address_state is None else address_state
+        self.exported = bool(exported)
+        self.total = total
+        self.items = []
+        self.version = None
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Order":
+        return cls(*row)
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "Order":
+        """Build from an offline-queue / WS payload dict (see to_payload)."""
+        order = cls(*(payload.get(c) for c in ORDER_COLUMNS))
+        if not payload.get("customer_name") and payload.get("full_name"):
+            order.customer_name = payload["full_name"]
+        order.items = [OrderItem.from_payload(i) for i in payload.get("items") or []]
+        return order
+
+    def to_payload(self) -> Dict[str, Any]:
+        payload = {c: _json_safe(getattr(self, c)) for c in ORDER_COLUMNS}
+        payload["items"] = [i.to_payload() for i in self.items]
+        return payload
+
+class OrderItem:
+    """One row of fetch_order_items."""
+    __slots__ = ORDER_ITEM_COLUMNS
+
+    def __init__(self, quantity, item_price, notes, name, group_name, item_pdv, subtotal):
+        self.quantity = quantity
+        self.item_price = item_price
+        self.notes = notes
+        self.name = name
+        self.group_name = group_name
+        self.item_pdv = item_pdv
+        self.subtotal = subtotal
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "OrderItem":
+        return cls(*row)
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "OrderItem":
+        return cls(
+            payload.get("quantity", 1),
+            payload.get("item_price"),
+            payload.get("notes", ""),
+            payload.get("name"),
+            payload.get("group_name"),
+            payload.get("item_pdv", 1000),
+            payload.get("subtotal", 10),
+        )
+
+    def to_payload(self) -> Dict[str, Any]:
+        return {c: _json_safe(getattr(self, c)) for c in ORDER_ITEM_COLUMNS}
+
+_ORDER_FIELDS = """
             o.id AS order_id,
             o.order_number,
             o.table_number,
@@ -281,153 +747,2569 @@ def fetch_orders(cur, statuses: Tuple[str, ...] = ("recebido", "em_andamento"))
             o.address_neighborhood,
             o.address_city,
             o.address_state,
-            COALESCE(o.exported, FALSE) as exported
+            COALESCE(o.exported, FALSE) as exported,
+            o.total"""
+
+_ORDER_FROM = """
         FROM orders o
         LEFT JOIN users u ON u.id = o.user_id
+"""
+
+_ORDER_SELECT = "\n        SELECT" + _ORDER_FIELDS + _ORDER_FROM
+
+def fetch_orders(cur, statuses: Tuple[str, ...] = ("recebido", "em_andamento")) -> List[Order]:
+    cur.execute(
+        _ORDER_SELECT + """
         WHERE o.status IN %s
         ORDER BY o.created_at ASC
         """,
         (tuple(statuses),),
     )
-    return cur.fetchall()
-
-def fetch_order_items(cur, order_id: int) -> List[Dict[str, Any]]:
+    return [Order.from_row(r) for r in cur.fetchall()]
+
+def fetch_order(cur, order_id: int):
+    cur.execute(_ORDER_SELECT + " WHERE o.id = %s", (order_id,))
+    row = cur.fetchone()
+    return Order.from_row(row) if row else None
+
+def fetch_order_items(cur, order_id: int) -> List[OrderItem]:
+    """
+    Items of one order, in oi.id order like fetch_orders_with_items (order_content_hash
+    depends on it). No menu JOINs: the PDV code is oi.menu_item_id and the name is the one
+    stored with the item; the group is not part of the pedido line.
+    """
     cur.execute(
         """
-        SELECT
-            oi.quantity,
-            oi.item_price,
-            oi.notes,
-            mi.name,
-            mg.name as group_name,
-            mi.id as item_pdv,
-            (oi.quantity * oi.item_price) as subtotal
+        SELECT oi.quantity, oi.item_price, oi.notes, oi.item_name, NULL, oi.menu_item_id,
+            (oi.quantity * oi.item_price) AS subtotal
         FROM order_items oi
-        LEFT JOIN menu_items mi ON mi.id = oi.menu_item_id
-        LEFT JOIN menu_groups mg ON mg.id = mi.group_id
         WHERE oi.order_id = %s
+        ORDER BY oi.id
         """,
         (order_id,),
     )
-    return cur.fetchall()
-
-def format_order_line(order: Dict[str, Any], items: List[Dict[str, Any]], order_index: int, now: datetime) -> str:
-    merged = {**DEFAULT_CUSTOMER, **{k: v for k, v in order.items() if v is not None}}
-    created_at = merged.get("created_at") or now.isoformat()
-    pickup_time = merged.get("pickup_time") or str(now)
-
-    line = (
-        f"PEDIDO|{merged.get('customer_name') or merged.get('full_name')}|CPF|123.456.789-10|{merged.get('phone_number')}|"
-        f"{merged.get('cep')}|{merged.get('address_street')}|{merged.get('address_number')}|{merged.get('address_complement')}|"
-        f"{merged.get('address_neighborhood')}|{merged.get('address_city')}|{merged.get('address_state')}|AUTO-ATENDIMENTO|Moto-boy|"
-        f"{merged.get('order_id', '404')}|{merged.get('notes', '')}|{merged.get('order_number', 0)}|{order_index}|"
-        f"{created_at}|{pickup_time}|CARDAPIO DIGITAL|"
+    return [OrderItem.from_row(r) for r in cur.fetchall()]
+
+def order_version(updated_at, last_item_id, item_count) -> str:
+    """What a cached order must match to still be current: orders.updated_at, newest item id, item count."""
+    return f"{_json_safe(updated_at)}|{last_item_id or 0}|{item_count or 0}"
+
+def fetch_order_versions(cur, order_ids: List[int]) -> Dict[int, str]:
+    """order_version() of each order in order_ids, in one grouped query (no item rows transferred)."""
+    cur.execute(
+        """
+        SELECT o.id, o.updated_at, MAX(oi.id), COUNT(oi.id)
+        FROM orders o
+        LEFT JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.id IN %s
+        GROUP BY o.id, o.updated_at
+        """,
+        (tuple(order_ids),),
     )
+    return {order_id: order_version(updated_at, last_item, count) for order_id, updated_at, last_item, count in cur.fetchall()}
+
+def fetch_orders_with_items(cur, where: str, params: tuple = ()):
+    """
+    Orders matching `where` together with their items, in a single query.
+
+    Returns (orders, watermark) where watermark is the highest
+    (orders.updated_at, order_items.id) seen, for change detection.
+    """
+    item_fields = "oi.quantity, oi.item_price, oi.notes, oi.item_name, NULL, oi.menu_item_id, (oi.quantity * oi.item_price) AS subtotal"
+    cur.execute(
+        "\n        SELECT" + _ORDER_FIELDS + ",\n            o.updated_at, oi.id, " + item_fields + _ORDER_FROM
+        + "        LEFT JOIN order_items oi ON oi.order_id = o.id"
+        + "\n        WHERE " + where + "\n        ORDER BY o.created_at ASC, o.id, oi.id",
+        params,
+    )
+    n = len(ORDER_COLUMNS)
+    orders = []
+    order = None
+    max_updated = max_item = None
+    for row in cur.fetchall():
+        updated_at, item_id = row[n], row[n + 1]
+        if order is None or order.order_id != row[0]:
+            order = Order.from_row(row[:n])
+            order.version = order_version(updated_at, None, 0)
+            orders.append(order)
+        if updated_at is not None and (max_updated is None or updated_at > max_updated):
+            max_updated = updated_at
+        if item_id is None:
+            continue
+        if max_item is None or item_id > max_item:
+            max_item = item_id
+        item_row = row[n + 2:]
+        order.items.append(OrderItem.from_row(item_row))
+        order.version = order_version(updated_at, item_id, len(order.items))
+    return orders, (max_updated, max_item)
+
+def _look_back(watermark, seconds: float):
+    """An updated_at watermark (as stored by _json_safe) moved back by seconds."""
+    try:
+        value = datetime.fromisoformat(watermark) if isinstance(watermark, str) else watermark
+        return value - timedelta(seconds=seconds)
+    except (TypeError, ValueError):
+        return watermark
+
+_HASHED_ORDER_FIELDS = (
+    "order_number", "table_number", "notes", "pickup_time", "customer_name", "phone_number", "cep",
+    "address_street", "address_number", "address_complement", "address_neighborhood", "address_city", "address_state",
+)
+
+def order_content_hash(order: Order) -> str:
+    """Digest of what the PDV sees of an order (customer, address, notes, items); status and export flags excluded."""
+    h = hashlib.sha1()
+    h.update(repr([_json_safe(getattr(order, c)) for c in _HASHED_ORDER_FIELDS]).encode("utf-8"))
+    for item in order.items:
+        h.update(repr([_json_safe(item.item_pdv), _json_safe(item.quantity), _json_safe(item.subtotal), _json_safe(item.notes)]).encode("utf-8"))
+    return h.hexdigest()
+
+def amendment_note(order: Order, sequence: int) -> str:
+    """Marker put in front of the notes of an amendment file (see SyncEngine.detect_changes)."""
+    return f"*** ALTERACAO {sequence} DO PEDIDO {order.order_number} - SUBSTITUI O ENVIO ANTERIOR ***"
+
+def format_order_line(order: Order, items: List[OrderItem], order_index: int, now: datetime, notes_prefix: str = "") -> str:
+    created_at = order.created_at or now.isoformat()
+    pickup_time = order.pickup_time or str(now)
+    notes = order.notes if order.notes is not None else ""
+    if notes_prefix:
+        notes = f"{notes_prefix} {notes}" if notes else notes_prefix
+    order_id = order.order_id if order.order_id is not None else "404"
+    order_number = order.order_number if order.order_number is not None else 0
+
+    parts = [
+        f"PEDIDO|{order.customer_name}|CPF|123.456.789-10|{order.phone_number}|"
+        f"{order.cep}|{order.address_street}|{order.address_number}|{order.address_complement}|"
+        f"{order.address_neighborhood}|{order.address_city}|{order.address_state}|AUTO-ATENDIMENTO|Moto-boy|"
+        f"{order_id}|{notes}|{order_number}|{order_index}|"
+        f"{created_at}|{pickup_time}|CARDAPIO DIGITAL|"
+    ]
 
     for item in items:
-        item_pdv = item.get("item_pdv", 1000)
-        notes = item.get("notes", "")
-        subtotal = item.get("subtotal", 10)
-        quantity = item.get("quantity", 1)
-        line += (
-            f" ITEM|{item_pdv}|89350031024|{notes}|0|{subtotal}|{quantity}|UNID|99999999|88888888|cest|cfop|0|500|"
+        parts.append(
+            f" ITEM|{item.item_pdv}|89350031024|{item.notes}|0|{item.subtotal}|{item.quantity}|UNID|99999999|88888888|cest|cfop|0|500|"
             "cst_icms|icms|reducao_icms|cst_pis|pis|cst_cofins|cofins|imp_federal|imp_estadual|imp_municipal|GRUPO|"
         )
 
-    return line.replace("None", "!!!!")
+    return "".join(parts).replace("None", "!!!!")
+
+# -----------------------
+# Export scheduling
+# -----------------------
+PRIORITY_TABLE = "mesa"
+PRIORITY_SCHEDULED = "agendado"
+PRIORITY_ASAP = "sem_horario"
+PRIORITY_CLASSES = (PRIORITY_TABLE, PRIORITY_SCHEDULED, PRIORITY_ASAP)
+
+def _to_epoch(value, default: float) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return default
+
+class ExportScheduler:
+    """
+    Priority queue of pending exports.
+
+    Orders are keyed on the moment they must reach the PDV: table orders and
+    orders without pickup_time are due immediately (since created_at), scheduled
+    orders are due prep_lead_time minutes before pickup_time. pop_batch hands
+    out at most `budget` orders per sync cycle, and only orders already due:
+    a scheduled order stays queued until its lead window opens.
+    """
+
+    def __init__(self, prep_lead_time: int = DEFAULT_PREP_LEAD_TIME):
+        self.prep_lead_time = prep_lead_time * 60
+        self.heap = []
+        self.entries = {}       # order_id -> [due, rank, seq, order, klass, first_seen]
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.waits = {k: {"count": 0, "total": 0.0, "max": 0.0} for k in PRIORITY_CLASSES}
+
+    def classify(self, order: Order) -> Tuple[str, float]:
+        now = time.time()
+        # Never later than now: a DB clock ahead of ours must not hold back an order meant to go at once
+        created = min(_to_epoch(order.created_at, now), now)
+        if order.table_number:
+            return PRIORITY_TABLE, created
+        if order.pickup_time:
+            return PRIORITY_SCHEDULED, _to_epoch(order.pickup_time, created) - self.prep_lead_time
+        return PRIORITY_ASAP, created
+
+    def push(self, order: Order, first_seen: float = None):
+        with self.lock:
+            self._push(order, first_seen)
+
+    def _push(self, order: Order, first_seen: float = None):
+        klass, due = self.classify(order)
+        old = self.entries.get(order.order_id)
+        if old is not None:
+            if old[0] == due and old[4] == klass:
+                old[3] = order
+                return
+            old[3] = None   # lazily dropped from the heap
+            first_seen = old[5]
+        self.seq += 1
+        entry = [due, PRIORITY_CLASSES.index(klass), self.seq, order, klass, first_seen or time.time()]
+        self.entries[order.order_id] = entry
+        heapq.heappush(self.heap, entry)
+
+    def sync(self, pending: List[Order]) -> int:
+        """Make the queue mirror the pending orders of this cycle. Returns how many orders are new."""
+        with self.lock:
+            ids = set()
+            arrivals = 0
+            for order in pending:
+                ids.add(order.order_id)
+                if order.order_id not in self.entries:
+                    arrivals += 1
+                self._push(order)
+            for oid in [oid for oid in self.entries if oid not in ids]:
+                self.entries.pop(oid)[3] = None
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                self.heap = [e for e in self.heap if e[3] is not None]
+                heapq.heapify(self.heap)
+            return arrivals
+
+    def pop_batch(self, budget: int, now: float = None) -> List[Order]:
+        """Up to `budget` orders already due at `now`, earliest due first."""
+        batch = []
+        now = now or time.time()
+        with self.lock:
+            while self.heap and len(batch) < budget:
+                if self.heap[0][3] is not None and self.heap[0][0] > now:
+                    break   # everything behind it in the heap is due later still
+                entry = heapq.heappop(self.heap)
+                order = entry[3]
+                if order is None:
+                    continue
+                del self.entries[order.order_id]
+                waited = now - entry[5]
+                w = self.waits[entry[4]]
+                w["count"] += 1
+                w["total"] += waited
+                w["max"] = max(w["max"], waited)
+                batch.append(order)
+        return batch
+
+    def depth(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            depth = {k: 0 for k in PRIORITY_CLASSES}
+            for entry in self.entries.values():
+                depth[entry[4]] += 1
+            return {
+                k: {
+                    "depth": depth[k],
+                    "exported": w["count"],
+                    "avg_wait": (w["total"] / w["count"]) if w["count"] else 0.0,
+                    "max_wait": w["max"],
+                }
+                for k, w in self.waits.items()
+            }
+
+# -----------------------
+# Metrics
+# -----------------------
+class Histogram:
+    """Cumulative, Prometheus-style histogram with one series per tenant label."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[str, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, label: str = ""):
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {
+                label: {"buckets": list(zip(self.buckets, counts)), "sum": total, "count": count}
+                for label, (counts, total, count) in self.series.items()
+            }
+
+SYNC_DURATION = Histogram((0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+WRITE_LATENCY = Histogram((0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+def _prom_labels(**labels) -> str:
+    parts = [f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels.items()]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render_prometheus(snapshot: Dict[str, Any]) -> str:
+    """Prometheus text exposition (0.0.4) of a metrics snapshot (see main.metrics_snapshot)."""
+    out = []
+
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            out.append(f"{name}{_prom_labels(**labels)} {float(value):g}")
+
+    def histogram(name, help_text, series):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} histogram")
+        for tenant, h in series.items():
+            for bound, count in h["buckets"]:
+                out.append(f"{name}_bucket{_prom_labels(tenant=tenant, le=f'{bound:g}')} {count}")
+            out.append(f"{name}_bucket{_prom_labels(tenant=tenant, le='+Inf')} {h['count']}")
+            out.append(f"{name}_sum{_prom_labels(tenant=tenant)} {h['sum']:g}")
+            out.append(f"{name}_count{_prom_labels(tenant=tenant)} {h['count']}")
+
+    tenants = snapshot["tenants"]
+    metric("portuga_uptime_seconds", "gauge", "Seconds since the process started.", [({}, snapshot["uptime_seconds"])])
+    histogram("portuga_sync_cycle_seconds", "Duration of sync cycles.", snapshot["sync_cycle_seconds"])
+    histogram("portuga_order_file_write_seconds", "Time spent in write_order_file.", snapshot["order_file_write_seconds"])
+    metric("portuga_orders_exported_total", "counter", "Pedido files written, by kind.",
+           [({"tenant": t, "kind": k}, n) for t, m in tenants.items() for k, n in m["exported"].items()])
+    metric("portuga_export_queue_depth", "gauge", "Orders waiting in the export scheduler.",
+           [({"tenant": t}, m["queue_depth"]) for t, m in tenants.items()])
+    metric("portuga_offline_queue_depth", "gauge", "Orders waiting in the offline retry queue.",
+           [({"tenant": t}, m["offline_depth"]) for t, m in tenants.items()])
+    metric("portuga_offline_queue_oldest_seconds", "gauge", "Age of the oldest offline queue entry.",
+           [({"tenant": t}, m["offline_oldest_age"]) for t, m in tenants.items()])
+    metric("portuga_db_errors_total", "counter", "DB connection/query failures seen by the circuit breaker.",
+           [({"tenant": t}, m["db_errors"]) for t, m in tenants.items()])
+    metric("portuga_db_breaker_open", "gauge", "1 while the DB circuit breaker is open or half-open.",
+           [({"tenant": t}, m["db_breaker_state"] != CircuitBreaker.CLOSED) for t, m in tenants.items()])
+    metric("portuga_db_pool_in_use", "gauge", "Pooled DB connections checked out.",
+           [({"tenant": t}, m["db_pool_in_use"]) for t, m in tenants.items()])
+    metric("portuga_pdv_unconsumed_files", "gauge", "Pedido files not yet picked up by the PDV.",
+           [({"tenant": t}, m["pdv_unconsumed"]) for t, m in tenants.items()])
+    cached = {t: m["snapshot_cache"] for t, m in tenants.items() if "snapshot_cache" in m}
+    metric("portuga_snapshot_cache_bytes", "gauge", "Compressed size of the local order snapshot cache.",
+           [({"tenant": t}, c["bytes"]) for t, c in cached.items()])
+    metric("portuga_snapshot_cache_lookups_total", "counter", "Snapshot cache lookups, by result.",
+           [({"tenant": t, "result": r}, c[r + "s"]) for t, c in cached.items() for r in ("hit", "miss")])
+    metric("portuga_ws_connected", "gauge", "1 while the WebSocket client is connected.", [({}, snapshot["ws_connected"])])
+    metric("portuga_thread_alive", "gauge", "1 if the background thread is running.",
+           [({"thread": name}, alive) for name, alive in snapshot["threads"].items()])
+    return "\n".join(out) + "\n"
+
+class MetricsServer:
+    """
+    Local-only HTTP endpoint: GET /metrics (Prometheus text) and /metrics.json.
+
+    Runs on its own thread and only reads in-memory counters. Snapshots are
+    reused for `cache_ttl` seconds, so frequent scrapes don't add work to the
+    export path.
+    """
+
+    def __init__(self, collect, port: int = DEFAULT_METRICS_PORT, cache_ttl: float = 1.0):
+        self.collect = collect
+        self.port = port
+        self.cache_ttl = cache_ttl
+        self.cached = None
+        self.cached_at = 0.0
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            if self.cached is None or time.time() - self.cached_at >= self.cache_ttl:
+                self.cached = self.collect()
+                self.cached_at = time.time()
+            return self.cached
+
+    def start(self):
+        server = self
+        http_server = http_server_backend()
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                try:
+                    if path == "/metrics":
+                        body = render_prometheus(server.snapshot()).encode("utf-8")
+                        ctype = "text/plain; version=0.0.4; charset=utf-8"
+                    elif path == "/metrics.json":
+                        body = json.dumps(server.snapshot(), ensure_ascii=False, default=str).encode("utf-8")
+                        ctype = "application/json"
+                    else:
+                        self.send_error(404)
+                        return
+                except Exception as e:
+                    log_error(e, "Falha ao gerar métricas")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args):
+                pass
+
+        self.httpd = http_server.ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
 
-def write_order_file(content: str, month: int, day: int, order_index: int):
-    ensure_dir(get_path_mei(PEDIDOS_DIR))
-    file_name = os.path.join(get_path_mei(PEDIDOS_DIR), f"pedido_{month}_{day}_{order_index}.txt")
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+# -----------------------
+# Profiling
+# -----------------------
+class SamplingProfiler:
+    """
+    On-demand wall-clock stack sampler plus tracemalloc.
+
+    While running, a daemon thread reads sys._current_frames() every
+    `interval` seconds and counts one sample per (thread, stack), so waits
+    (DB sockets, file I/O, Tk's mainloop) show up as well as CPU work.
+    tracemalloc traces allocations from start(). stop() writes a timestamped
+    report (and a .folded file for flamegraph tools) to LOGS_DIR. Nothing is
+    hooked or traced while it is off.
+    """
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 48, top: int = 25):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.top = top
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.samples: Dict[Tuple[str, tuple], int] = {}
+        self.ticks = 0
+        self.started_at = 0.0
+        self.mem_start = None
+        self.mem_peak = 0
+        self.owns_tracemalloc = False
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, trace_memory: bool = True):
+        if self.is_running():
+            return
+        self.samples = {}
+        self.ticks = 0
+        self.started_at = time.time()
+        self.mem_start = None
+        self.owns_tracemalloc = False
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(16)
+                self.owns_tracemalloc = True
+            self.mem_start = tracemalloc.take_snapshot()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(self.stop_event,), name="profiler", daemon=True)
+        self.thread.start()
+
+    def _run(self, stop_event: threading.Event):
+        own = threading.get_ident()
+        while not stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.ticks += 1
+
+    def stop(self) -> str:
+        """Stop sampling and write the report; returns its path."""
+        if self.thread is None:
+            return ""
+        self.stop_event.set()
+        self.thread.join(timeout=5)
+        self.thread = None
+        mem_end = tracemalloc.take_snapshot() if self.mem_start is not None else None
+        self.mem_peak = tracemalloc.get_traced_memory()[1] if mem_end is not None else 0
+        if self.owns_tracemalloc:
+            tracemalloc.stop()
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        logs_dir = get_path_mei(LOGS_DIR)
+        ensure_dir(logs_dir)
+        path = os.path.join(logs_dir, f"profile_{stamp}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report(mem_end))
+        with open(os.path.join(logs_dir, f"profile_{stamp}.folded"), "w", encoding="utf-8") as f:
+            for (thread_name, stack), count in sorted(self.samples.items(), key=lambda kv: -kv[1]):
+                frames = ";".join(f"{name} ({os.path.basename(fn)}:{line})" for fn, name, line in stack)
+                f.write(f"{thread_name};{frames} {count}\n")
+        self.mem_start = None
+        return path
+
+    @staticmethod
+    def _fmt(frame: tuple) -> str:
+        filename, name, line = frame
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def report(self, mem_end=None) -> str:
+        elapsed = time.time() - self.started_at
+        lines = [
+            f"Perfil de {datetime.fromtimestamp(self.started_at):%Y-%m-%d %H:%M:%S} — {elapsed:.1f}s, "
+            f"{self.ticks} amostras a cada {self.interval * 1000:.0f} ms",
+            "",
+        ]
+        per_thread: Dict[str, Dict[tuple, int]] = {}
+        self_counts: Dict[tuple, int] = {}
+        total_counts: Dict[tuple, int] = {}
+        for (thread_name, stack), count in self.samples.items():
+            per_thread.setdefault(thread_name, {})[stack] = count
+            if stack:
+                self_counts[stack[-1]] = self_counts.get(stack[-1], 0) + count
+            for frame in set(stack):
+                total_counts[frame] = total_counts.get(frame, 0) + count
+
+        ticks = max(self.ticks, 1)
+        lines.append("Funções (amostras próprias / acumuladas, todas as threads)")
+        for frame, count in sorted(self_counts.items(), key=lambda kv: -kv[1])[:self.top]:
+            lines.append(f"  {count:>7} {total_counts.get(frame, 0):>7}  {self._fmt(frame)}")
+        lines.append("")
+
+        for thread_name in sorted(per_thread, key=lambda n: -sum(per_thread[n].values())):
+            stacks = per_thread[thread_name]
+            thread_total = sum(stacks.values())
+            lines.append(f"Thread {thread_name}: {thread_total} amostras ({thread_total * 100 / ticks:.0f}% do tempo)")
+            for stack, count in sorted(stacks.items(), key=lambda kv: -kv[1])[:3]:
+                lines.append(f"  {count} amostras ({count * 100 / thread_total:.0f}%):")
+                for frame in stack[-12:]:
+                    lines.append(f"      {self._fmt(frame)}")
+            lines.append("")
+
+        if mem_end is not None:
+            lines.append("Alocações (tracemalloc) — maiores origens ao final")
+            for stat in mem_end.statistics("lineno")[:self.top]:
+                frame = stat.traceback[0]
+                lines.append(f"  {stat.size / 1024:>9.1f} KiB {stat.count:>8}  {frame.filename}:{frame.lineno}")
+            lines.append("")
+            lines.append("Crescimento desde o início do perfil")
+            for stat in mem_end.compare_to(self.mem_start, "lineno")[:self.top]:
+                if stat.size_diff <= 0:
+                    continue
+                frame = stat.traceback[0]
+                lines.append(f"  {stat.size_diff / 1024:>+9.1f} KiB {stat.count_diff:>+8}  {frame.filename}:{frame.lineno}")
+            if self.mem_peak:
+                lines.append(f"Pico rastreado: {self.mem_peak / 1024 / 1024:.1f} MiB")
+        return "\n".join(lines) + "\n"
+
+# -----------------------
+# Order file output
+# -----------------------
+class SpoolDestination:
+    """
+    Background mover for one output directory.
+
+    Files waiting for this destination live in their own spool subdirectory
+    and are delivered strictly in spool order: if the head file fails, later
+    files wait behind it and the head is retried with exponential backoff.
+    Delivery writes a temp file and renames it, so the PDV never sees a
+    partial pedido file.
+    """
+
+    def __init__(self, target_dir: str, spool_root: str, on_delivered=None):
+        self.target_dir = target_dir
+        self.on_delivered = on_delivered
+        key = hashlib.sha1(target_dir.encode("utf-8")).hexdigest()[:10]
+        self.spool_dir = os.path.join(spool_root, key)
+        Path(self.spool_dir).mkdir(parents=True, exist_ok=True)
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+        self.delivered = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_error = ""
+        self.last_delivery_latency = 0.0
+
+    def pending_files(self) -> List[str]:
+        try:
+            return sorted(f for f in os.listdir(self.spool_dir) if f.endswith(".txt"))
+        except OSError:
+            return []
+
+    def lag(self) -> float:
+        """Age in seconds of the oldest file not yet delivered."""
+        files = self.pending_files()
+        if not files:
+            return 0.0
+        try:
+            return max(0.0, time.time() - os.path.getmtime(os.path.join(self.spool_dir, files[0])))
+        except OSError:
+            return 0.0
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"spool:{os.path.basename(self.target_dir)}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def has_pending(self, file_name: str) -> bool:
+        return any(f.endswith("__" + file_name) for f in self.pending_files())
+
+    def deliver(self, spool_name: str):
+        src = os.path.join(self.spool_dir, spool_name)
+        final_name = spool_name.split("__", 1)[-1]
+        Path(self.target_dir).mkdir(parents=True, exist_ok=True)
+        dest = free_pedido_path(os.path.join(self.target_dir, final_name))
+        tmp = dest + ".tmp"
+        with open(src, "rb") as f:
+            data = f.read()
+        with open(tmp, "wb") as out:
+            out.write(data)
+        os.replace(tmp, dest)
+        os.remove(src)
+        return dest
+
+    def _run(self):
+        while self.running:
+            files = self.pending_files()
+            if not files:
+                self.wake.wait(5)
+                self.wake.clear()
+                continue
+            for name in files:
+                if not self.running:
+                    return
+                start = time.time()
+                try:
+                    dest = self.deliver(name)
+                except Exception as e:
+                    self.failures += 1
+                    self.consecutive_failures += 1
+                    self.last_error = str(e)
+                    if self.consecutive_failures in (1, 10) or self.consecutive_failures % 100 == 0:
+                        append_log(f"Falha ao entregar {name} em {self.target_dir} (tentativa {self.consecutive_failures}): {e}")
+                    self.wake.wait(min(60, 2 ** min(self.consecutive_failures, 6)))
+                    self.wake.clear()
+                    break
+                self.consecutive_failures = 0
+                self.last_error = ""
+                self.delivered += 1
+                self.last_delivery_latency = time.time() - start
+                if self.on_delivered is not None:
+                    self.on_delivered(dest)
+                append_log(f"Pedido entregue: {dest}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "target": self.target_dir,
+            "pending": len(self.pending_files()),
+            "lag": self.lag(),
+            "delivered": self.delivered,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+class OrderSpool:
+    """Fast local write of pedido files, fanned out to every destination's spool."""
+
+    def __init__(self, spool_root: str, targets: List[str], on_delivered=None):
+        self.spool_root = spool_root
+        self.destinations = [SpoolDestination(t, spool_root, on_delivered) for t in targets]
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        for d in self.destinations:
+            d.start()
+
+    def stop(self):
+        for d in self.destinations:
+            d.stop()
+
+    def has_pending(self, file_name: str) -> bool:
+        """A file of that name is still waiting in some destination's spool."""
+        return any(d.has_pending(file_name) for d in self.destinations)
+
+    def write(self, file_name: str, content: str) -> str:
+        with self.lock:
+            self.seq += 1
+            spool_name = f"{time.time_ns():020d}_{self.seq:06d}__{file_name}"
+        data = (content + "\n").encode("utf-8")
+        for d in self.destinations:
+            tmp = os.path.join(d.spool_dir, spool_name + ".part")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(d.spool_dir, spool_name))
+            d.wake.set()
+        return os.path.join(self.destinations[0].target_dir, file_name)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [d.stats() for d in self.destinations]
+
+def pedido_file_name(month: int, day: int, order_index: int) -> str:
+    return f"pedido_{month}_{day}_{order_index}.txt"
+
+_PEDIDO_INDEX = re.compile(r"pedido_\d+_\d+_(\d+)(?:_\d+)?\.txt$")
+
+def free_pedido_path(path: str) -> str:
+    """path, or path with a _2, _3... suffix when a pedido the PDV has not consumed already has that name."""
+    if not os.path.exists(path):
+        return path
+    root, ext = os.path.splitext(path)
+    n = 2
+    while os.path.exists(f"{root}_{n}{ext}"):
+        n += 1
+    append_log(f"{os.path.basename(path)} ainda não consumido pelo PDV; gravando como {os.path.basename(root)}_{n}{ext}")
+    return f"{root}_{n}{ext}"
+
+def write_order_file(content: str, month: int, day: int, order_index: int, tenant: "Tenant" = None):
+    """
+    Write a pedido file: into the tenant's spool when enabled (delivered asynchronously), else straight
+    to its pedidos dir. An existing file is never overwritten (see free_pedido_path).
+    """
+    started = time.perf_counter()
+    name = pedido_file_name(month, day, order_index)
+    spool = tenant.spool if tenant is not None else None
+    if spool is not None:
+        file_name = spool.write(name, content)
+        WRITE_LATENCY.observe(time.perf_counter() - started, tenant.label)
+        append_log(f"Pedido no spool: {name}")
+        return file_name
+    target = tenant.targets()[0] if tenant is not None else get_path_mei(PEDIDOS_DIR)
+    ensure_dir(target)
+    file_name = free_pedido_path(os.path.join(target, name))
     with open(file_name, "w", encoding="utf-8") as order_file:
         order_file.write(content + "\n")
+    if tenant is not None and tenant.watcher is not None:
+        tenant.watcher.track(file_name)
+    WRITE_LATENCY.observe(time.perf_counter() - started, tenant.label if tenant is not None else "principal")
     append_log(f"Pedido escrito: {file_name}")
     return file_name
 
-def notify_native(title: str, message: str):
-    try:
-        if platform.system() == "Windows" and ToastNotifier:
-            toaster = ToastNotifier()
-            toaster.show_toast(title, message, threaded=True, icon_path=None, duration=6)
-            return
-        if plyer_notification:
-            plyer_notification.notify(title=title, message=message, app_name="Portuga")
-            return
-    except Exception:
-        pass
+# -----------------------
+# PDV consumption watcher
+# -----------------------
+class PdvWatcher:
+    """
+    Tracks pedido files from the moment they land in the PDV directory until
+    Datacaixa picks them up (the file is removed or moved away).
+
+    Uses inotify when inotify_simple is available, otherwise polls the
+    directory once a second. budget_for() turns the number of unconsumed
+    files into backpressure on the export budget.
+    """
+
+    def __init__(self, watch_dir: str, slow_threshold: int = 20, pause_threshold: int = 50):
+        self.watch_dir = os.path.normcase(os.path.abspath(watch_dir))
+        self.slow_threshold = slow_threshold
+        self.pause_threshold = pause_threshold
+        self.pending: Dict[str, float] = {}   # file name -> time it was written
+        self.written: set = set()             # names tracked this session (not startup leftovers)
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.backend = "inotify" if platform.system() == "Linux" and inotify_backend() is not None else "polling"
+        self.consumed = 0
+        self.last_latency = 0.0
+        self.avg_latency = 0.0
+        self.last_consumed_at = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self._scan_existing()
+        self.running = True
+        target = self._run_inotify if self.backend == "inotify" else self._run_polling
+        self.thread = threading.Thread(target=target, name="pdv-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _is_pedido(self, name: str) -> bool:
+        return name.startswith("pedido_") and name.endswith(".txt")
+
+    def _scan_existing(self):
+        try:
+            names = os.listdir(self.watch_dir)
+        except OSError:
+            return
+        with self.lock:
+            for name in names:
+                if self._is_pedido(name) and name not in self.pending:
+                    try:
+                        self.pending[name] = os.path.getmtime(os.path.join(self.watch_dir, name))
+                    except OSError:
+                        pass
+
+    def track(self, path: str):
+        directory, name = os.path.split(os.path.abspath(path))
+        if os.path.normcase(directory) != self.watch_dir:
+            return
+        with self.lock:
+            self.pending[name] = time.time()
+            self.written.add(name)
+
+    def awaiting(self) -> set:
+        """Files written this session that the PDV has not picked up yet."""
+        with self.lock:
+            return self.written.intersection(self.pending)
+
+    def forget(self, path: str) -> bool:
+        """Stop tracking a file removed by the archiver. True if the PDV had not consumed it."""
+        name = os.path.basename(path)
+        with self.lock:
+            self.written.discard(name)
+            return self.pending.pop(name, None) is not None
+
+    def _mark_consumed(self, name: str):
+        with self.lock:
+            written = self.pending.pop(name, None)
+            self.written.discard(name)
+        if written is None:
+            return
+        now = time.time()
+        latency = max(0.0, now - written)
+        self.consumed += 1
+        self.last_latency = latency
+        self.avg_latency = latency if self.consumed == 1 else 0.2 * latency + 0.8 * self.avg_latency
+        self.last_consumed_at = now
+
+    def _reconcile(self):
+        try:
+            present = set(os.listdir(self.watch_dir))
+        except OSError:
+            return
+        with self.lock:
+            gone = [n for n in self.pending if n not in present]
+        for name in gone:
+            self._mark_consumed(name)
+
+    def _run_polling(self):
+        while self.running:
+            self._reconcile()
+            time.sleep(1)
+
+    def _run_inotify(self):
+        try:
+            INotify, inotify_flags = inotify_backend()
+            ino = INotify()
+            ino.add_watch(self.watch_dir, inotify_flags.DELETE | inotify_flags.MOVED_FROM)
+        except Exception as e:
+            append_log(f"inotify indisponível ({e}); watcher do PDV em modo polling")
+            self.backend = "polling"
+            self._run_polling()
+            return
+        last_reconcile = time.time()
+        while self.running:
+            try:
+                for event in ino.read(timeout=1000):
+                    if self._is_pedido(event.name):
+                        self._mark_consumed(event.name)
+            except Exception as e:
+                log_error(e, "Erro lendo eventos inotify do PDV")
+                time.sleep(1)
+            # Safety net for overflowed/missed events
+            if time.time() - last_reconcile > 30:
+                self._reconcile()
+                last_reconcile = time.time()
+
+    def unconsumed(self) -> int:
+        with self.lock:
+            return len(self.pending)
+
+    def oldest_age(self) -> float:
+        with self.lock:
+            oldest = min(self.pending.values()) if self.pending else None
+        return max(0.0, time.time() - oldest) if oldest else 0.0
+
+    def budget_for(self, budget: int) -> int:
+        """Export budget after backpressure: full, throttled to a quarter, or 0 (paused)."""
+        n = self.unconsumed()
+        if n >= self.pause_threshold:
+            return 0
+        if n >= self.slow_threshold:
+            return max(1, budget // 4)
+        return budget
+
+    def state(self) -> str:
+        n = self.unconsumed()
+        if n >= self.pause_threshold:
+            return "pausado"
+        if n >= self.slow_threshold:
+            return "lento"
+        return "ok"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state(),
+            "backend": self.backend,
+            "unconsumed": self.unconsumed(),
+            "oldest_age": self.oldest_age(),
+            "consumed": self.consumed,
+            "last_latency": self.last_latency,
+            "avg_latency": self.avg_latency,
+        }
+
+# -----------------------
+# Archive (old logs and pedido files)
+# -----------------------
+LOG_NAME_RE = re.compile(r"^log(\d{4})_(\d{1,2})_(\d{1,2})\.txt$")
+
+def log_day(file_name: str) -> Optional[date]:
+    """Day of a daily log file name (log2024_5_10.txt), None for anything else."""
+    m = LOG_NAME_RE.match(file_name)
+    if not m:
+        return None
+    try:
+        return date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        return None
+
+def _log_sort_key(file_name: str):
+    # Daily logs newest first (by date, not by name: log2024_5_9 < log2024_5_10), then reports
+    day = log_day(file_name)
+    return (1, day.toordinal(), file_name) if day else (0, 0, file_name)
+
+def archive_logs_dir() -> str:
+    return os.path.join(get_path_mei(ARCHIVE_DIR), "logs")
+
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _load_json(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_json(path: str, data: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def _gzip_into(src: str, dest: str):
+    """Compress src into dest; appends another gzip member if dest already exists."""
+    if os.path.exists(dest):
+        with open(src, "rb") as f, gzip.open(dest, "ab") as g:
+            shutil.copyfileobj(f, g, 1 << 16)
+        return
+    tmp = dest + ".tmp"
+    with open(src, "rb") as f, gzip.open(tmp, "wb", compresslevel=6) as g:
+        shutil.copyfileobj(f, g, 1 << 16)
+    os.replace(tmp, dest)
+
+def read_archived_log(path: str, tail_lines: int = None) -> str:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8", errors="replace") as f:
+            if tail_lines is None:
+                return f.read()
+            return "".join(deque(f, maxlen=tail_lines))
+    except Exception as e:
+        return f"Erro ao ler log arquivado: {e}"
+
+def archive_logs(keep_days: int, retention_days: int = 0, today: date = None) -> int:
+    """
+    Move daily logs older than keep_days into ARCHIVE_DIR/logs as <name>.gz and
+    record them in its manifest.json; drop archived days past retention_days.
+    """
+    today = today or now_local().date()
+    logs_dir = get_path_mei(LOGS_DIR)
+    dest_dir = archive_logs_dir()
+    manifest_path = os.path.join(dest_dir, "manifest.json")
+    manifest = _load_json(manifest_path)
+    archived = 0
+    changed = False
+    if os.path.isdir(logs_dir):
+        for entry in os.scandir(logs_dir):
+            day = log_day(entry.name)
+            if day is None or (today - day).days < keep_days or not entry.is_file():
+                continue
+            if retention_days and (today - day).days > retention_days:
+                os.remove(entry.path)
+                continue
+            ensure_dir(dest_dir)
+            dest = os.path.join(dest_dir, entry.name + ".gz")
+            size = entry.stat().st_size
+            _gzip_into(entry.path, dest)
+            os.remove(entry.path)
+            prev = manifest.get(entry.name, {})
+            manifest[entry.name] = {"day": day.isoformat(), "size": prev.get("size", 0) + size, "packed": os.path.getsize(dest)}
+            archived += 1
+            changed = True
+    if retention_days:
+        for name, meta in list(manifest.items()):
+            if (today - date.fromisoformat(meta["day"])).days > retention_days:
+                try:
+                    os.remove(os.path.join(dest_dir, name + ".gz"))
+                except FileNotFoundError:
+                    pass
+                del manifest[name]
+                changed = True
+    if changed:
+        ensure_dir(dest_dir)
+        _save_json(manifest_path, manifest)
+    return archived
+
+class LogManifest:
+    """
+    Cached listing for the log viewer: the live LOGS_DIR files plus archived days.
+
+    LOGS_DIR is rescanned only when its mtime changes (a new day's log or a
+    report file appears); archived days come from the archive's manifest.json,
+    re-read only when archive_logs() rewrites it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.live_key = None
+        self.live: List[str] = []
+        self.archived_key = None
+        self.archived: Dict[str, dict] = {}
+        self.names: List[str] = []
+
+    def files(self) -> List[str]:
+        logs_dir = get_path_mei(LOGS_DIR)
+        manifest_path = os.path.join(archive_logs_dir(), "manifest.json")
+        with self.lock:
+            live_key = (logs_dir, _mtime_ns(logs_dir))
+            archived_key = (manifest_path, _mtime_ns(manifest_path))
+            if live_key == self.live_key and archived_key == self.archived_key:
+                return list(self.names)
+            if live_key != self.live_key:
+                self.live = [e.name for e in os.scandir(logs_dir) if e.is_file()] if live_key[1] is not None else []
+                self.live_key = live_key
+            if archived_key != self.archived_key:
+                self.archived = _load_json(manifest_path)
+                self.archived_key = archived_key
+            self.names = sorted(set(self.live) | set(self.archived), key=_log_sort_key, reverse=True)
+            return list(self.names)
+
+class PedidoArchive:
+    """
+    Per-day archives of old pedido files for one tenant.
+
+    Each day is <YYYY-MM-DD>.gz holding one gzip member per pedido, appended in
+    order, plus <YYYY-MM-DD>.idx.json: order id -> [[file name, offset, length], ...]
+    (amendments add more files for the same order). Order ids come from the export
+    journal, not the file content; files it does not know are kept under "".
+    orders.json maps each order id to the days holding it, so find() loads one day
+    index, seeks and decompresses a single member.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.orders_path = os.path.join(root, "orders.json")
+
+    def _paths(self, day: str) -> Tuple[str, str]:
+        return os.path.join(self.root, f"{day}.gz"), os.path.join(self.root, f"{day}.idx.json")
+
+    def archive(self, source_dirs: List[str], keep_days: int, retention_days: int = 0, skip=(), now: float = None,
+                on_archived=None, order_ids=None) -> int:
+        """
+        Move pedido_*.txt files older than keep_days out of source_dirs into the
+        day archives. Files still awaiting the PDV (names in skip) are left alone;
+        on_archived is called with the path of every file removed.
+        order_ids(names, since_ts) maps file names to order ids (ExportJournal.order_ids_for_files).
+        """
+        now = now or time.time()
+        cutoff = now - keep_days * 86400
+        by_day: Dict[str, List[Tuple[str, str]]] = {}
+        for source in source_dirs:
+            if not os.path.isdir(source):
+                continue
+            for entry in os.scandir(source):
+                if not (entry.name.startswith("pedido_") and entry.name.endswith(".txt")) or entry.name in skip:
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                if mtime < cutoff:
+                    day = datetime.fromtimestamp(mtime).date().isoformat()
+                    by_day.setdefault(day, []).append((entry.name, entry.path))
+        archived = 0
+        orders = _load_json(self.orders_path) if by_day else {}
+        ids = {}
+        if by_day and order_ids is not None:
+            names = [name for files in by_day.values() for name, _ in files]
+            ids = order_ids(names, datetime.fromisoformat(min(by_day)).timestamp() - 86400)
+        for day, files in sorted(by_day.items()):
+            ensure_dir(self.root)
+            gz_path, idx_path = self._paths(day)
+            index = _load_json(idx_path)
+            done = []
+            with open(gz_path, "ab") as out:
+                for name, path in sorted(files):
+                    try:
+                        with open(path, "rb") as f:
+                            raw = f.read()
+                    except OSError:
+                        continue
+                    member = gzip.compress(raw, compresslevel=6)
+                    offset = out.tell()
+                    out.write(member)
+                    key = str(ids[name]) if ids.get(name) is not None else ""
+                    index.setdefault(key, []).append([name, offset, len(member)])
+                    days = orders.setdefault(key, [])
+                    if day not in days:
+                        days.append(day)
+                        days.sort()
+                    done.append(path)
+                out.flush()
+                os.fsync(out.fileno())
+            # Indexes first, originals last: a crash in between only leaves duplicates behind
+            _save_json(idx_path, index)
+            _save_json(self.orders_path, orders)
+            for path in done:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                if on_archived is not None:
+                    on_archived(path)
+            archived += len(done)
+        if retention_days:
+            self.prune(retention_days, now)
+        return archived
+
+    def prune(self, retention_days: int, now: float = None):
+        oldest = datetime.fromtimestamp((now or time.time()) - retention_days * 86400).date().isoformat()
+        if not os.path.isdir(self.root):
+            return
+        removed = False
+        for entry in os.scandir(self.root):
+            day = entry.name.split(".", 1)[0]
+            if len(day) == 10 and day < oldest:
+                try:
+                    os.remove(entry.path)
+                    removed = True
+                except OSError:
+                    pass
+        if removed:
+            orders = _load_json(self.orders_path)
+            kept = {key: [d for d in days if d >= oldest] for key, days in orders.items()}
+            _save_json(self.orders_path, {key: days for key, days in kept.items() if days})
+
+    def find(self, order_id: int) -> Optional[Tuple[str, str, str]]:
+        """(day, file name, content) of the newest archived pedido for order_id."""
+        days = _load_json(self.orders_path).get(str(order_id))
+        if not days:
+            return None
+        day = days[-1]
+        gz_path, idx_path = self._paths(day)
+        entries = _load_json(idx_path).get(str(order_id))
+        if not entries:
+            return None
+        name, offset, length = entries[-1]
+        try:
+            with open(gz_path, "rb") as f:
+                f.seek(offset)
+                content = gzip.decompress(f.read(length)).decode("utf-8", errors="replace")
+        except (OSError, EOFError, zlib.error) as e:
+            log_error(e, f"Falha ao ler pedido arquivado {name}")
+            return None
+        return day, name, content
+
+# -----------------------
+# Tenants (branches)
+# -----------------------
+class Tenant:
+    """
+    One branch: its database, pedido output, processed store, offline queue,
+    circuit breaker, connection pool, spool and PDV watcher.
+
+    The unnamed default tenant is the single-branch setup (DATABASE_URL,
+    PEDIDOS_DIR, state files next to the app). Named tenants keep their state
+    under data_dir (default tenants/<name>) so branches never share files.
+    """
+
+    def __init__(self, name: str = "", settings: dict = None, database_url: str = None,
+                 pedidos_dirs: List[str] = None, pdv_watch_dir: str = "", data_dir: str = ""):
+        self.name = name
+        self.settings = settings if settings is not None else DEFAULT_SETTINGS
+        # Only the default branch reads DATABASE_URL; a named branch without a URL must never reach it
+        self.database_url = database_url if name else (database_url or os.getenv("DATABASE_URL"))
+        self.pedidos_dirs = list(pedidos_dirs or [])
+        self.pdv_watch_dir = pdv_watch_dir
+        self.data_dir = data_dir
+        if name:
+            self.breaker = CircuitBreaker(
+                int(self.settings.get("db_failure_threshold", 3)), float(self.settings.get("db_reset_timeout", 15))
+            )
+            self.timeouts = db_timeouts(self.settings)
+        else:
+            # The default branch shares the globals configure_db() sets
+            self.breaker = DB_BREAKER
+            self.timeouts = DB_TIMEOUTS
+        self.pool = ConnectionPool(
+            self.database_url, self.breaker, int(self.settings.get("db_pool_size", 2)), self.timeouts
+        )
+        self.spool = None
+        self.watcher = None
+        self.offline_conn = None
+        self.offline_lock = threading.Lock()
+        self.archive = PedidoArchive(os.path.join(self.path(ARCHIVE_DIR), "pedidos"))
+
+    @property
+    def label(self) -> str:
+        return self.name or "principal"
+
+    def path(self, rel_path: str) -> str:
+        """Where this tenant keeps one of the local state files (PROCESSED_FILE, OFFLINE_DB, ...)."""
+        if not self.data_dir:
+            return get_path_mei(rel_path)
+        return os.path.join(get_path_mei(self.data_dir), os.path.basename(os.path.normpath(rel_path)))
+
+    def targets(self) -> List[str]:
+        if self.name and not self.pedidos_dirs:
+            raise ValueError(f"Filial {self.name} sem diretório de pedidos")
+        return [get_path_mei(d) for d in (self.pedidos_dirs or [PEDIDOS_DIR])]
+
+    def connect(self):
+        return self.pool.connect()
+
+    def pedido_exists(self, file_name: str) -> bool:
+        """A pedido of that name is waiting in the spool or in one of the pedidos dirs."""
+        if self.spool is not None and self.spool.has_pending(file_name):
+            return True
+        return any(os.path.exists(os.path.join(d, file_name)) for d in self.targets())
+
+    def archive_pedidos(self, keep_days: int, retention_days: int = 0, order_ids=None) -> int:
+        """
+        Archive old pedido files left in this tenant's pedido dirs. Only files
+        written this session and still awaiting the PDV are skipped; leftovers
+        found at startup go by age like everything else, and the ones the PDV
+        never picked up are logged by name.
+        """
+        if self.watcher is None:
+            return self.archive.archive(self.targets(), keep_days, retention_days, order_ids=order_ids)
+        unconsumed = []
+
+        def archived(path):
+            if self.watcher.forget(path):
+                unconsumed.append(os.path.basename(path))
+
+        count = self.archive.archive(self.targets(), keep_days, retention_days, self.watcher.awaiting(),
+                                     on_archived=archived, order_ids=order_ids)
+        if unconsumed:
+            shown = ", ".join(sorted(unconsumed)[:10]) + (" ..." if len(unconsumed) > 10 else "")
+            append_log(f"[{self.label}] {len(unconsumed)} pedidos arquivados sem terem sido lidos pelo PDV: {shown}")
+        return count
+
+    def read_pedido(self, order_id: int, file_path: str = None) -> Optional[str]:
+        """The pedido file as last written: still in the pedidos dir, or from the archive."""
+        if file_path and os.path.exists(file_path):
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    return f.read()
+            except OSError:
+                pass
+        found = self.archive.find(order_id)
+        return found[2] if found else None
+
+    def start_spool(self):
+        if self.data_dir:
+            ensure_dir(get_path_mei(self.data_dir))
+        if not self.settings.get("spool_enabled", True):
+            return
+        try:
+            self.spool = OrderSpool(self.path(SPOOL_DIR), self.targets(), self._on_delivered)
+            self.spool.start()
+        except Exception as e:
+            self.spool = None
+            log_error(e, f"Falha ao iniciar spool de {self.label}; gravando direto no diretório de pedidos")
+
+    def start_watcher(self):
+        self.watcher = PdvWatcher(
+            get_path_mei(self.pdv_watch_dir) if self.pdv_watch_dir else self.targets()[0],
+            int(self.settings.get("pdv_backlog_slow", 20)),
+            int(self.settings.get("pdv_backlog_pause", 50)),
+        )
+        self.watcher.start()
+
+    def _on_delivered(self, path: str):
+        if self.watcher is not None:
+            self.watcher.track(path)
+
+    def _offline_db(self):
+        if self.offline_conn is None:
+            self.offline_conn = init_offline_db(self.path(OFFLINE_DB))
+        return self.offline_conn
+
+    def enqueue_offline(self, order_id: int, payload: dict):
+        try:
+            with self.offline_lock:
+                conn = self._offline_db()
+                conn.execute("INSERT INTO queued_orders (order_id, payload) VALUES (?, ?)", (order_id, json.dumps(payload)))
+                conn.commit()
+        except Exception as e:
+            log_error(e, "Falha ao enfileirar pedido offline")
+
+    def offline_stats(self) -> Tuple[int, float]:
+        """(pending entries, age in seconds of the oldest one)."""
+        try:
+            with self.offline_lock:
+                depth, oldest = self._offline_db().execute(
+                    "SELECT COUNT(*), MIN(strftime('%s', created_at)) FROM queued_orders WHERE status='pending'"
+                ).fetchone()
+        except Exception:
+            return 0, 0.0
+        return depth or 0, max(0.0, time.time() - float(oldest)) if oldest else 0.0
+
+    def offline_pending(self, limit: int = 10) -> list:
+        with self.offline_lock:
+            return self._offline_db().execute(
+                "SELECT id, order_id, payload, attempts FROM queued_orders WHERE status='pending' ORDER BY created_at LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def offline_done(self, qid: int, ok: bool):
+        with self.offline_lock:
+            if ok:
+                self.offline_conn.execute("DELETE FROM queued_orders WHERE id=?", (qid,))
+            else:
+                self.offline_conn.execute("UPDATE queued_orders SET attempts=attempts+1 WHERE id=?", (qid,))
+            self.offline_conn.commit()
+
+    def _retry_one(self, payload_json: str, process_function) -> bool:
+        try:
+            return bool(process_function(json.loads(payload_json), offline_retry=True))
+        except Exception:
+            return False
+
+    async def retry_offline_queue(self, runtime: "Runtime", process_function):
+        """Runtime task reprocessing this tenant's queued orders; DB/SQLite work runs on the tenant executor."""
+        asyncio = asyncio_backend()
+        breaker = self.breaker
+        while True:
+            if not breaker.allows_request():
+                await asyncio.sleep(min(10, max(1, breaker.retry_in())))
+                continue
+            try:
+                rows = await runtime.run_blocking(self.name, self.offline_pending)
+                if not rows:
+                    await asyncio.sleep(10)
+                    continue
+                delivered = 0
+                for qid, _oid, payload_json, _attempts in rows:
+                    ok = await runtime.run_blocking(self.name, self._retry_one, payload_json, process_function)
+                    await runtime.run_blocking(self.name, self.offline_done, qid, ok)
+                    delivered += ok
+                if not delivered:
+                    # Whole batch failed; don't spin on it before the breaker notices
+                    await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(e, "Erro no worker de retry offline")
+                await asyncio.sleep(10)
+
+    def stop(self):
+        if self.spool is not None:
+            self.spool.stop()
+        self.pool.close()
+
+def load_tenants(settings: dict) -> List[Tenant]:
+    """Tenants from settings["tenants"]; without any, the single default branch."""
+    configs = settings.get("tenants") or []
+    if not configs:
+        return [Tenant("", settings, None, settings.get("pedidos_dirs"), settings.get("pdv_watch_dir", ""))]
+    tenants = []
+    for cfg in configs:
+        name = str(cfg.get("name") or "").strip()
+        if not name or any(t.name == name for t in tenants):
+            append_log(f"Filial ignorada (nome vazio ou repetido): {cfg}")
+            continue
+        tenant_settings = dict(settings)
+        tenant_settings.update({k: v for k, v in cfg.items() if k in DEFAULT_SETTINGS and k != "tenants"})
+        database_url = cfg.get("database_url") or (os.getenv(cfg["database_url_env"]) if cfg.get("database_url_env") else None)
+        if not database_url:
+            append_log(f"Filial {name} ignorada: database_url ausente (ou variável {cfg.get('database_url_env')} não definida)")
+            continue
+        pedidos_dirs = cfg.get("pedidos_dirs") or ([cfg["pedidos_dir"]] if cfg.get("pedidos_dir") else [])
+        if not pedidos_dirs:
+            # Every engine numbers pedido files from 1; a shared directory means overwritten orders
+            append_log(f"Filial {name} ignorada: pedidos_dir(s) obrigatório para filiais nomeadas")
+            continue
+        shared = {_dir_key(d) for d in pedidos_dirs} & {_dir_key(d) for t in tenants for d in t.pedidos_dirs}
+        if shared:
+            append_log(f"Filial {name} ignorada: diretório de pedidos já usado por outra filial ({', '.join(sorted(shared))})")
+            continue
+        tenants.append(Tenant(
+            name, tenant_settings, database_url, pedidos_dirs,
+            cfg.get("pdv_watch_dir", ""), cfg.get("data_dir") or os.path.join("tenants", name),
+        ))
+    if not tenants:
+        raise ValueError("Nenhuma filial válida em settings['tenants'] (veja o log)")
+    return tenants
+
+def _dir_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(get_path_mei(path)))
+
+def notify_native(title: str, message: str):
+    try:
+        ToastNotifier = win10toast_backend() if platform.system() == "Windows" else None
+        if ToastNotifier:
+            toaster = ToastNotifier()
+            toaster.show_toast(title, message, threaded=True, icon_path=None, duration=6)
+            return
+        plyer_notification = plyer_backend()
+        if plyer_notification:
+            plyer_notification.notify(title=title, message=message, app_name="Portuga")
+            return
+    except Exception:
+        pass
+
+    try:
+        def _popup():
+            p = ctk.CTkToplevel()
+            p.title(title)
+            p.geometry("380x120")
+            lbl = ctk.CTkLabel(p, text=message, wraplength=360)
+            lbl.pack(padx=12, pady=12)
+            btn = ctk.CTkButton(p, text="Fechar", command=p.destroy)
+            btn.pack(pady=(6, 12))
+        app.runtime.call_ui(_popup)
+    except Exception:
+        print("Notification fallback:", title, message)
+
+# -----------------------
+# Async runtime
+# -----------------------
+class Runtime:
+    """
+    One asyncio loop on a background thread hosting every scheduler: auto-sync
+    pollers, offline retry and the WS reconnect loop.
+
+    Blocking psycopg2/file work never runs on the loop; it goes to bounded
+    executors: one per tenant (a slow branch only ties up its own workers),
+    one shared "io" pool for UI-initiated reads/exports, and the WS client's
+    own single thread. Anything that touches Tk is queued on ui_queue and run
+    by the Tk thread (see main._drain_ui).
+    """
+
+    def __init__(self, tenant_workers: int = 2, io_workers: int = 2):
+        self.tenant_workers = max(1, tenant_workers)
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.executors: Dict[str, ThreadPoolExecutor] = {}
+        self.io_executor = ThreadPoolExecutor(max(1, io_workers), thread_name_prefix="io")
+        self.ui_queue = queue.SimpleQueue()
+        self.tasks = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name="runtime", daemon=True)
+        self.thread.start()
+        self.ready.wait(5)
+
+    def _run(self):
+        asyncio = asyncio_backend()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def is_alive(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def executor(self, key: str) -> ThreadPoolExecutor:
+        with self.lock:
+            ex = self.executors.get(key)
+            if ex is None:
+                ex = self.executors[key] = ThreadPoolExecutor(
+                    self.tenant_workers, thread_name_prefix=f"tenant:{key or 'principal'}"
+                )
+            return ex
+
+    async def run_blocking(self, key: str, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) on tenant `key`'s executor."""
+        return await self.loop.run_in_executor(self.executor(key), functools.partial(fn, *args, **kwargs))
+
+    async def _tracked(self, coro):
+        asyncio = asyncio_backend()
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            return await coro
+        finally:
+            self.tasks.discard(task)
+
+    def spawn(self, coro):
+        """Schedule a coroutine on the loop from any thread; returns a concurrent Future."""
+        asyncio = asyncio_backend()
+        return asyncio.run_coroutine_threadsafe(self._tracked(coro), self.loop)
+
+    def submit(self, key: str, fn, *args, **kwargs):
+        """Run blocking fn on tenant `key`'s executor from any thread."""
+        return self.spawn(self.run_blocking(key, fn, *args, **kwargs))
+
+    async def run_io(self, fn, *args):
+        """Await blocking fn(*args) on the shared io executor."""
+        return await self.loop.run_in_executor(self.io_executor, fn, *args)
+
+    def background(self, fn, *args, **kwargs):
+        """Run blocking fn on the shared io executor (log reads, exports, reports)."""
+        return self.io_executor.submit(fn, *args, **kwargs)
+
+    def call_ui(self, fn, *args):
+        self.ui_queue.put((fn, args))
+
+    def drain_ui(self, limit: int = 200):
+        """Run queued UI callbacks; call from the Tk thread only."""
+        for _ in range(limit):
+            try:
+                fn, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                fn(*args)
+            except Exception as e:
+                append_log(f"Falha em callback de UI: {e}")
+
+    async def _cancel_all(self):
+        asyncio = asyncio_backend()
+        tasks = [t for t in self.tasks if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self, timeout: float = 5.0):
+        """Cancel every scheduler, stop the loop and release the executors' idle threads."""
+        asyncio = asyncio_backend()
+        if self.loop is not None and self.is_alive():
+            try:
+                asyncio.run_coroutine_threadsafe(self._cancel_all(), self.loop).result(timeout)
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+        # Work already inside a DB/file call is bounded by the DB timeouts; queued work is dropped
+        for ex in list(self.executors.values()) + [self.io_executor]:
+            ex.shutdown(wait=False, cancel_futures=True)
+
+class PollScheduler:
+    """
+    Auto-sync loop with an adaptive interval, run as a task on the Runtime.
+
+    The wait between cycles follows the recent order arrival rate (an EWMA of
+    orders/min): about a third of the mean gap between orders, never less than
+    twice the last cycle's duration, clamped to [min_interval, max_interval].
+    When the DB is unreachable it backs off exponentially from base_interval.
+    run_cycle is a coroutine function returning the arrivals of one cycle.
+    start()/stop() can be called any number of times; only one loop runs.
+    """
+
+    def __init__(self, runtime: Runtime, run_cycle, base_interval: int = DEFAULT_POLL_INTERVAL,
+                 min_interval: int = DEFAULT_POLL_MIN_INTERVAL, max_interval: int = DEFAULT_POLL_MAX_INTERVAL,
+                 name: str = "poll"):
+        self.runtime = runtime
+        self.run_cycle = run_cycle
+        self.name = name
+        self.future = None
+        self.wake = None
+        self.rate = 0.0
+        self.failures = 0
+        self.last_cycle_start = None
+        self.configure(base_interval, min_interval, max_interval)
+
+    def configure(self, base_interval: int, min_interval: int, max_interval: int):
+        self.min_interval = max(1, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.base_interval = min(max(base_interval, self.min_interval), self.max_interval)
+        self.current_interval = self.base_interval
+
+    def is_running(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    def start(self):
+        if self.is_running():
+            return
+        self.failures = 0
+        self.last_cycle_start = None
+        self.future = self.runtime.spawn(self._run())
+
+    def stop(self):
+        """Cancel the loop. A cycle already inside the executor finishes in the background."""
+        if self.future is not None:
+            self.future.cancel()
+        self.future = None
+
+    def poke(self):
+        """Run the next cycle now (e.g. on a WS new_order event)."""
+        if self.wake is not None and self.runtime.loop is not None:
+            self.runtime.loop.call_soon_threadsafe(self.wake.set)
+
+    def next_interval(self, arrivals, duration: float, now: float) -> float:
+        if arrivals is None:
+            self.failures += 1
+            return min(self.max_interval, self.base_interval * (2 ** self.failures))
+        self.failures = 0
+        if self.last_cycle_start is None:
+            return self.base_interval
+        elapsed = max(now - self.last_cycle_start, 1e-3)
+        self.rate = 0.3 * (arrivals * 60.0 / elapsed) + 0.7 * self.rate
+        if self.rate > 0.01:
+            interval = 20.0 / self.rate
+        else:
+            interval = self.max_interval
+        interval = max(interval, 2 * duration)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    async def _run(self):
+        asyncio = asyncio_backend()
+        self.wake = asyncio.Event()
+        while True:
+            start = time.time()
+            try:
+                arrivals = await self.run_cycle()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(e, "Erro no ciclo de auto sync")
+                arrivals = None
+            self.current_interval = self.next_interval(arrivals, time.time() - start, start)
+            self.last_cycle_start = start
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.current_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+class WSClient:
+    """
+    WebSocket listener. The reconnect loop is a Runtime task; the blocking
+    websocket-client connection runs on the client's own single thread, and
+    messages are handed back to the loop before on_message_callable sees them.
+    """
+
+    def __init__(self, url: str, on_message_callable, runtime: Runtime):
+        self.url = url
+        self.on_message_callable = on_message_callable
+        self.runtime = runtime
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="ws")
+        self.future = None
+        self.ws = None
+        self.running = False
+        self.connected = False
+
+    def start(self):
+        self.running = True
+        self.future = self.runtime.spawn(self._run())
+
+    def is_alive(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    def _dispatch(self, message: str):
+        try:
+            data = json.loads(message)
+        except Exception:
+            append_log(f"WS mensagem inválida: {message}")
+            return
+        try:
+            self.on_message_callable(data)
+        except Exception as e:
+            append_log(f"WS on_message error: {e}")
+
+    async def _run(self):
+        asyncio = asyncio_backend()
+        websocket = websocket_backend()
+        if websocket is None:
+            append_log("websocket-client não instalado; WS desativado")
+            return
+        loop = asyncio.get_running_loop()
+
+        def _on_message(ws, message):
+            loop.call_soon_threadsafe(self._dispatch, message)
+        def _on_error(ws, err):
+            append_log(f"WS erro: {err}")
+        def _on_close(ws, *_args):
+            self.connected = False
+            append_log("WS fechado")
+        def _on_open(ws):
+            self.connected = True
+            append_log("WS conectado")
+
+        while self.running:
+            self.ws = websocket.WebSocketApp(self.url, on_message=_on_message, on_error=_on_error, on_close=_on_close, on_open=_on_open)
+            try:
+                await loop.run_in_executor(self.executor, self.ws.run_forever)
+            except asyncio.CancelledError:
+                self.ws.close()
+                raise
+            except Exception as e:
+                append_log(f"WS run_forever falhou: {e}")
+            self.connected = False
+            await asyncio.sleep(5)
+
+    def stop(self):
+        self.running = False
+        try:
+            if self.ws:
+                self.ws.close()
+        except Exception:
+            pass
+        if self.future is not None:
+            self.future.cancel()
+        self.executor.shutdown(wait=False)
+
+# -----------------------
+# Export journal
+# -----------------------
+JOURNAL_COLUMNS = ("order_id", "order_number", "file_path", "created_at", "exported_at", "latency", "item_count", "total", "kind")
+
+class ExportJournal:
+    """
+    Local, indexed record of every pedido file written (one row per export).
+
+    History, metrics and the CSV/JSON export read from here instead of the
+    production DB. exported_ts (epoch) is what ranges are filtered on;
+    exported_at keeps the human readable local timestamp.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS export_journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER,
+                order_number TEXT,
+                file_path TEXT,
+                created_at TEXT,
+                exported_at TEXT,
+                exported_ts REAL,
+                latency REAL,
+                item_count INTEGER,
+                total REAL,
+                kind TEXT DEFAULT 'export'
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_exported_ts ON export_journal(exported_ts)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_order ON export_journal(order_id)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS export_hashes (
+                order_id INTEGER PRIMARY KEY,
+                content_hash TEXT,
+                exported_ts REAL
+            )
+        """)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS journal_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def record(self, order: Order, file_path: str, exported: datetime, kind: str = "export"):
+        exported_ts = exported.timestamp()
+        created_ts = _to_epoch(order.created_at, exported_ts)
+        total = order.total
+        if total is None and order.items:
+            try:
+                total = sum(float(i.subtotal or 0) for i in order.items)
+            except (TypeError, ValueError):
+                total = None
+        row = (
+            order.order_id, _json_safe(order.order_number), file_path, _json_safe(order.created_at),
+            exported.isoformat(), exported_ts, max(0.0, exported_ts - created_ts), len(order.items),
+            float(total) if total is not None else None, kind,
+        )
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT INTO export_journal (order_id, order_number, file_path, created_at, exported_at, exported_ts, "
+                    "latency, item_count, total, kind) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                if order.order_id is not None:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO export_hashes (order_id, content_hash, exported_ts) VALUES (?, ?, ?)",
+                        (order.order_id, order_content_hash(order), exported_ts),
+                    )
+                self.conn.commit()
+        except Exception as e:
+            log_error(e, f"Falha ao gravar journal do pedido {order.order_id}")
+
+    def max_order_index(self, since_ts: float) -> int:
+        """Highest pedido file index journaled since since_ts (0 when none)."""
+        with self.lock:
+            paths = self.conn.execute(
+                "SELECT file_path FROM export_journal WHERE exported_ts >= ?", (since_ts,)
+            ).fetchall()
+        found = [_PEDIDO_INDEX.search(p or "") for (p,) in paths]
+        return max((int(m.group(1)) for m in found if m), default=0)
+
+    def hashes(self, order_ids: List[int]) -> Dict[int, str]:
+        """Content hash of the last export of each order (orders never exported are absent)."""
+        found = {}
+        ids = list(order_ids)
+        with self.lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                found.update(self.conn.execute(
+                    f"SELECT order_id, content_hash FROM export_hashes WHERE order_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall())
+        return found
+
+    def store_hashes(self, hashes: Dict[int, str], exported_ts: float = None):
+        """Baseline hashes for orders exported before hashes were recorded."""
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO export_hashes (order_id, content_hash, exported_ts) VALUES (?, ?, ?)",
+                [(oid, h, exported_ts) for oid, h in hashes.items()],
+            )
+            self.conn.commit()
+
+    def exported_since(self, since_ts: float) -> List[int]:
+        """Ids of orders with any export at or after since_ts."""
+        with self.lock:
+            return [r[0] for r in self.conn.execute(
+                "SELECT DISTINCT order_id FROM export_journal WHERE exported_ts >= ? AND order_id IS NOT NULL", (since_ts,)
+            )]
+
+    def count_exports(self, order_id: int, kind: str) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM export_journal WHERE order_id = ? AND kind = ?", (order_id, kind)
+            ).fetchone()[0]
+
+    def get_meta(self, key: str, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM journal_meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key: str, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO journal_meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self.conn.commit()
+
+    def recent(self, limit: int = 30) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT order_id, order_number, exported_at, latency, item_count, total, kind "
+                "FROM export_journal ORDER BY exported_ts DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def order_ids_for_files(self, names: List[str], since_ts: float) -> Dict[str, int]:
+        """Order id of each pedido file name journaled since since_ts (the newest export wins)."""
+        wanted = set(names)
+        found = {}
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT order_id, file_path FROM export_journal WHERE exported_ts >= ? ORDER BY exported_ts",
+                (since_ts,),
+            ).fetchall()
+        for order_id, file_path in rows:
+            name = os.path.basename(file_path or "")
+            if name in wanted:
+                found[name] = order_id
+        return found
+
+    def last_file(self, order_id: int) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT file_path FROM export_journal WHERE order_id = ? ORDER BY exported_ts DESC LIMIT 1",
+                (order_id,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def summary(self, since_ts: float) -> Dict[str, float]:
+        with self.lock:
+            count, avg_latency, max_latency = self.conn.execute(
+                "SELECT COUNT(*), AVG(latency), MAX(latency) FROM export_journal WHERE exported_ts >= ?",
+                (since_ts,),
+            ).fetchone()
+        return {"count": count or 0, "avg_latency": avg_latency or 0.0, "max_latency": max_latency or 0.0}
+
+    def iter_range(self, start_ts: float = None, end_ts: float = None, batch: int = 500):
+        """Yield journal rows (JOURNAL_COLUMNS order) in export order, a batch at a time."""
+        query = f"SELECT {', '.join(JOURNAL_COLUMNS)} FROM export_journal WHERE exported_ts >= ? AND exported_ts < ? ORDER BY exported_ts"
+        conn = sqlite3.connect(self.path)
+        try:
+            cur = conn.execute(query, (start_ts or 0.0, end_ts or float("inf")))
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def export(self, fpath: str, fmt: str = "csv", start_ts: float = None, end_ts: float = None) -> int:
+        """Stream a date range to CSV or JSON without loading it in memory. Returns rows written."""
+        count = 0
+        with open(fpath, "w", encoding="utf-8", newline="") as f:
+            if fmt == "json":
+                f.write("[")
+                for row in self.iter_range(start_ts, end_ts):
+                    f.write(("\n" if count == 0 else ",\n") + json.dumps(dict(zip(JOURNAL_COLUMNS, row)), ensure_ascii=False))
+                    count += 1
+                f.write("\n]\n")
+            else:
+                writer = csv.writer(f)
+                writer.writerow(JOURNAL_COLUMNS)
+                for row in self.iter_range(start_ts, end_ts):
+                    writer.writerow(row)
+                    count += 1
+        return count
+
+# -----------------------
+# Sync engine
+# -----------------------
+def _noop(*_args, **_kwargs):
+    pass
+
+class OrderSnapshotCache:
+    """
+    Bounded local copy of recently fetched orders with their items.
+
+    Each order is one row: zlib'd positional JSON of the Order/OrderItem
+    fields, so a snapshot rebuilds exactly the pedido line the DB rows would.
+    Reprocessing by id reads from here first: while the DB is down the
+    snapshot is used as is, otherwise only when its version still matches
+    fetch_order_versions() (one cheap query instead of the order + items
+    rows). Least recently used rows are evicted past max_bytes, and rows older
+    than max_age are dropped, except pinned ones whose exported mark is still
+    queued for retry.
+    """
+
+    def __init__(self, path: str, max_bytes: int, max_age: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS order_snapshots (
+                order_id INTEGER PRIMARY KEY,
+                data BLOB,
+                size INTEGER,
+                fetched_ts REAL,
+                used_ts REAL,
+                pinned INTEGER DEFAULT 0,
+                version TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_used ON order_snapshots(used_ts)")
+        self.conn.commit()
+        self.total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM order_snapshots").fetchone()[0]
+
+    @staticmethod
+    def encode(order: Order) -> bytes:
+        values = [_json_safe(getattr(order, c)) for c in ORDER_COLUMNS]
+        items = [[_json_safe(getattr(i, c)) for c in ORDER_ITEM_COLUMNS] for i in order.items]
+        return zlib.compress(json.dumps([values, items], separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def decode(data: bytes) -> Order:
+        values, items = json.loads(zlib.decompress(data))
+        order = Order(*values)
+        order.items = [OrderItem(*i) for i in items]
+        return order
+
+    def put_many(self, orders: List[Order], pinned: bool = False):
+        if not orders:
+            return
+        now = time.time()
+        rows = []
+        for order in orders:
+            data = self.encode(order)
+            rows.append((order.order_id, data, len(data), now, now, order.version, int(pinned), order.order_id))
+        try:
+            with self.lock:
+                ids = [r[0] for r in rows]
+                old = 0
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    old += self.conn.execute(
+                        f"SELECT COALESCE(SUM(size), 0) FROM order_snapshots WHERE order_id IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchone()[0]
+                # A refresh keeps the pin of a row still referenced by the offline queue
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO order_snapshots (order_id, data, size, fetched_ts, used_ts, version, pinned) "
+                    "VALUES (?, ?, ?, ?, ?, ?, MAX(?, COALESCE((SELECT pinned FROM order_snapshots WHERE order_id = ?), 0)))",
+                    rows,
+                )
+                self.total += sum(r[2] for r in rows) - old
+                self._evict(now)
+                self.conn.commit()
+        except Exception as e:
+            log_error(e, "Falha ao gravar snapshots de pedidos")
+
+    def _evict(self, now: float):
+        expired = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM order_snapshots WHERE pinned = 0 AND fetched_ts < ?", (now - self.max_age,)
+        ).fetchone()[0]
+        if expired:
+            self.conn.execute("DELETE FROM order_snapshots WHERE pinned = 0 AND fetched_ts < ?", (now - self.max_age,))
+            self.total -= expired
+        if self.total <= self.max_bytes:
+            return
+        victims = []
+        excess = self.total - self.max_bytes
+        for order_id, size in self.conn.execute(
+            "SELECT order_id, size FROM order_snapshots WHERE pinned = 0 ORDER BY used_ts"
+        ):
+            victims.append((order_id,))
+            excess -= size
+            self.total -= size
+            if excess <= 0:
+                break
+        self.conn.executemany("DELETE FROM order_snapshots WHERE order_id = ?", victims)
+
+    def get_many(self, order_ids: List[int]) -> Dict[int, Order]:
+        if not order_ids:
+            return {}
+        ids = list(order_ids)
+        try:
+            with self.lock:
+                rows = []
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    rows += self.conn.execute(
+                        f"SELECT order_id, data, version FROM order_snapshots WHERE order_id IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                self.conn.executemany(
+                    "UPDATE order_snapshots SET used_ts = ? WHERE order_id = ?", [(time.time(), r[0]) for r in rows]
+                )
+                self.conn.commit()
+        except Exception as e:
+            log_error(e, "Falha ao ler snapshots de pedidos")
+            return {}
+        self.hits += len(rows)
+        self.misses += len(ids) - len(rows)
+        orders = {}
+        for order_id, data, version in rows:
+            order = orders[order_id] = self.decode(data)
+            order.version = version
+        return orders
+
+    def unpin(self, order_id: int):
+        try:
+            with self.lock:
+                self.conn.execute("UPDATE order_snapshots SET pinned = 0 WHERE order_id = ?", (order_id,))
+                self.conn.commit()
+        except Exception as e:
+            log_error(e, "Falha ao liberar snapshot de pedido")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM order_snapshots").fetchone()[0]
+        return {"count": count, "bytes": self.total, "hits": self.hits, "misses": self.misses}
+
+class SyncEngine:
+    """
+    Headless export engine: pending orders in the DB -> scheduler -> pedido files.
+
+    Holds everything a sync cycle needs (processed set, scheduler, snapshot cache,
+    stats) but no Tk state; the app wires the callbacks to the UI and
+    bench_sync.py drives it directly against a stand-in database. One engine
+    serves one tenant; its files, DB pool and breaker come from the tenant.
+    """
+
+    def __init__(self, settings: dict, connect=None, notify=None,
+                 on_status=None, on_progress=None, on_preview=None, on_exported=None, tenant: Tenant = None):
+        self.settings = settings
+        self.tenant = tenant or Tenant("", settings, None, settings.get("pedidos_dirs"), settings.get("pdv_watch_dir", ""))
+        self.connect = connect or self.tenant.connect
+        self.notify = notify or notify_native
+        self.on_status = on_status or _noop
+        self.on_progress = on_progress or _noop
+        self.on_preview = on_preview or _noop
+        self.on_exported = on_exported or _noop
+        self.processed = set()
+        self.state_ready = threading.Event()
+        self.scheduler = ExportScheduler(int(settings.get("prep_lead_time", DEFAULT_PREP_LEAD_TIME)))
+        if self.tenant.data_dir:
+            ensure_dir(get_path_mei(self.tenant.data_dir))
+        self.journal = ExportJournal(self.tenant.path(JOURNAL_DB))
+        self.snapshots = None
+        snapshot_mb = float(settings.get("snapshot_cache_mb", 20))
+        if snapshot_mb > 0:
+            self.snapshots = OrderSnapshotCache(
+                self.tenant.path(ORDER_SNAPSHOT_DB), int(snapshot_mb * 1024 * 1024),
+                float(settings.get("snapshot_max_age_days", 30)) * 86400,
+            )
+        self.order_index = 1
+        self.index_day = None
+        self.index_lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.running_sync = False
+        self.last_change_check = 0.0
+        self.stats = {"processed_today": 0, "total_processed": 0, "total_time": 0.0, "amended": 0}
+        self.exported_counts: Dict[str, int] = {}
+
+    def load_state(self):
+        try:
+            self.processed.update(load_processed(self.tenant.path(PROCESSED_FILE)))
+            self.stats["total_processed"] = len(self.processed)
+        finally:
+            self.state_ready.set()
+
+    def next_order_index(self, now: datetime) -> int:
+        """
+        Next free index for today's pedido files. Seeded from the journal on the
+        first call of each day (a restart must not reuse today's names) and
+        skipping names still waiting in the spool or the pedidos dir.
+        """
+        with self.index_lock:
+            if self.index_day != now.date():
+                midnight = datetime.combine(now.date(), datetime.min.time(), now.tzinfo)
+                self.order_index = self.journal.max_order_index(midnight.timestamp()) + 1
+                self.index_day = now.date()
+            while self.tenant.pedido_exists(pedido_file_name(now.month, now.day, self.order_index)):
+                self.order_index += 1
+            order_index = self.order_index
+            self.order_index += 1
+        return order_index
+
+    def save_processed(self):
+        save_processed(self.processed, self.tenant.path(PROCESSED_FILE))
+
+    def process_payload(self, payload: dict, offline_retry: bool = False) -> bool:
+        """
+        Process a single order payload (websocket push or offline retry). Returns True if ok.
+        References queued by enqueue_retry ({"order_id", "snapshot": true}) are orders whose
+        pedido file is already written: only marking them exported is retried.
+        """
+        if payload.get("snapshot"):
+            return self.retry_mark_exported(payload["order_id"])
+        try:
+            now = now_local()
+            order = Order.from_payload(payload)
+            order_index = self.next_order_index(now)
+            line = format_order_line(order, order.items, order_index, now)
+            file_written = write_order_file(line, now.month, now.day, order_index, self.tenant)
+            kind = "retry" if offline_retry else "payload"
+            self.exported_counts[kind] = self.exported_counts.get(kind, 0) + 1
+            self.journal.record(order, file_written, now, kind)
+            if self.settings.get("mark_exported_in_db", True) and order.order_id:
+                if not self.mark_exported(order.order_id):
+                    self.enqueue_retry(order)
+            self.notify("Novo Pedido", f"Pedido {order.order_number} processado")
+            self.on_preview(f"Processed payload -> {file_written}")
+            return True
+        except Exception as e:
+            log_error(e, "Falha ao processar payload")
+            return False
+
+    def mark_exported(self, order_id: int) -> bool:
+        """Mark one order exported on a fresh connection; False when the DB is unreachable or the update failed."""
+        conn = cur = None
+        try:
+            conn, cur = self.connect()
+            ensure_exported_column(cur, conn)
+            return mark_order_exported_in_db(cur, conn, order_id)
+        except Exception:
+            return False
+        finally:
+            for c in (cur, conn):
+                try:
+                    if c: c.close()
+                except Exception:
+                    pass
+
+    def retry_mark_exported(self, order_id: int) -> bool:
+        """Offline retry of a written-but-unmarked order; the snapshot stays pinned until the mark succeeds."""
+        if self.settings.get("mark_exported_in_db", True) and not self.mark_exported(order_id):
+            return False
+        if self.snapshots is not None:
+            self.snapshots.unpin(order_id)
+        return True
+
+    def export_order(self, cur, conn, order: Order, kind: str = "export") -> str:
+        """
+        Write one order (items already loaded) as the next pedido file, journal it and mark it exported.
+        Amendment files carry amendment_note() in front of the notes.
+        """
+        now = now_local()
+        order_index = self.next_order_index(now)
+        prefix = ""
+        if kind == "amendment":
+            prefix = amendment_note(order, self.journal.count_exports(order.order_id, "amendment") + 1)
+        line = format_order_line(order, order.items, order_index, now, prefix)
+        file_written = write_order_file(line, now.month, now.day, order_index, self.tenant)
+        self.exported_counts[kind] = self.exported_counts.get(kind, 0) + 1
+        self.journal.record(order, file_written, now, kind)
+        if self.settings.get("mark_exported_in_db", True) and not order.exported and cur is not None:
+            if mark_order_exported_in_db(cur, conn, order.order_id, order):
+                order.exported = True
+            else:
+                self.enqueue_retry(order)
+        return file_written
+
+    def enqueue_retry(self, order: Order):
+        """
+        Queue marking a written order exported for the offline retry worker. The
+        queue holds just a reference; the order stays pinned in the snapshot cache
+        until the mark succeeds, so reprocessing works while the DB is down.
+        """
+        if self.snapshots is not None:
+            self.snapshots.put_many([order], pinned=True)
+        self.tenant.enqueue_offline(order.order_id, {"order_id": order.order_id, "snapshot": True})
+
+    def reprocess_orders(self, order_ids: List[int] = None, start: datetime = None, end: datetime = None) -> int:
+        """
+        Re-export a selection of orders, or every non-cancelled order created in
+        [start, end). Selected orders come from the snapshot cache when the DB
+        is down or fetch_order_versions() shows the snapshot is still current;
+        the rest (and ranges) come back from the DB in one query. Returns files written.
+        """
+        cached = {}
+        if order_ids:
+            requested = list(order_ids)
+            if self.snapshots is not None:
+                cached = self.snapshots.get_many(requested)
+        elif start is not None and end is not None:
+            requested = None
+            where, params = "o.created_at >= %s AND o.created_at < %s AND o.status <> 'cancelado'", (start, end)
+        else:
+            return 0
+        written = 0
+        with self.sync_lock:
+            conn = cur = None
+            try:
+                try:
+                    conn, cur = self.connect()
+                except Exception as e:
+                    if not cached:
+                        raise
+                    self.on_preview(f"Banco indisponível ({e}); reprocessando {len(cached)} pedido(s) do cache local")
+                if cur is None:
+                    orders = [cached[i] for i in requested if i in cached]
+                else:
+                    ensure_exported_column(cur, conn)
+                    fresh = {}
+                    if cached:
+                        versions = fetch_order_versions(cur, list(cached))
+                        fresh = {i: o for i, o in cached.items() if o.version is not None and versions.get(i) == o.version}
+                    if requested:
+                        where, params = "o.id IN %s", (tuple(i for i in requested if i not in fresh),)
+                    fetched = []
+                    if requested is None or len(fresh) < len(requested):
+                        fetched, _ = fetch_orders_with_items(cur, where, params)
+                        if self.snapshots is not None:
+                            self.snapshots.put_many(fetched)
+                    if requested:
+                        by_id = dict(fresh)
+                        by_id.update((o.order_id, o) for o in fetched)
+                        orders = [by_id[i] for i in requested if i in by_id]
+                    else:
+                        orders = fetched
+                if requested:
+                    found = {o.order_id for o in orders}
+                    missing = [i for i in requested if i not in found]
+                    if missing:
+                        self.on_preview(f"Pedido(s) {', '.join(map(str, missing))} não encontrado(s)")
+                for idx, order in enumerate(orders, start=1):
+                    try:
+                        fpath = self.export_order(cur, conn, order, "reprocess")
+                        written += 1
+                        self.on_preview(f"Pedido {order.order_number} reprocessado -> {fpath}")
+                    except Exception as e:
+                        log_error(e, f"Falha ao reprocessar pedido {order.order_id}")
+                    self.on_progress(idx / len(orders))
+            except Exception as e:
+                log_error(e, "Falha ao reprocessar pedidos")
+            finally:
+                for c in (cur, conn):
+                    try:
+                        if c: c.close()
+                    except Exception:
+                        pass
+        self.on_exported([])
+        return written
+
+    def process_order_by_id(self, order_id: int):
+        self.reprocess_orders([order_id])
 
-    try:
-        def _popup():
-            p = ctk.CTkToplevel()
-            p.title(title)
-            p.geometry("380x120")
-            lbl = ctk.CTkLabel(p, text=message, wraplength=360)
-            lbl.pack(padx=12, pady=12)
-            btn = ctk.CTkButton(p, text="Fechar", command=p.destroy)
-            btn.pack(pady=(6, 12))
-        app.after(0, _popup)
-    except Exception:
-        print("Notification fallback:", title, message)
+    def detect_changes(self, cur, conn, budget: int) -> int:
+        """
+        Re-export active, already exported orders whose content changed.
+
+        Candidates are the orders in the export journal from the last
+        change_window_hours (so this works with mark_exported_in_db off).
+        Only those touched since the last scan (orders.updated_at, or new
+        order_items rows) are fetched; of those, only the ones whose content
+        hash differs from the last export are written again, as amendment
+        files with a fresh order index.
+
+        updated_at is set at transaction start by the orders_updated_at
+        trigger, and serial ids are handed out before commit, so an edit can
+        commit behind a watermark an earlier scan already moved past. Every
+        scan therefore looks change_lookback_seconds (and CHANGE_ITEM_LOOKBACK
+        item ids) behind the watermark; orders seen again are deduped by
+        order_content_hash against the last export.
+
+        The PDV has no amendment record, so an amendment is a complete pedido
+        with the same order number and order id as the original, and its notes
+        start with "*** ALTERACAO n DO PEDIDO <number> - SUBSTITUI O ENVIO
+        ANTERIOR ***" (n counts amendments of that order). Staff cancel the
+        earlier pedido with that number in Datacaixa and keep the newest one.
+        Returns amendments written.
+        """
+        if not self.settings.get("change_detection", True) or budget <= 0:
+            return 0
+        interval = float(self.settings.get("change_check_interval", DEFAULT_CHANGE_CHECK_INTERVAL))
+        if time.time() - self.last_change_check < interval:
+            return 0
+        self.last_change_check = time.time()
+
+        mark = self.journal.get_meta("change_watermark")
+        if mark is None:
+            cur.execute("SELECT MAX(updated_at) FROM orders")
+            max_updated = cur.fetchone()[0]
+            cur.execute("SELECT MAX(id) FROM order_items")
+            max_item = cur.fetchone()[0]
+            self.journal.set_meta("change_watermark", [_json_safe(max_updated), max_item or 0])
+            return 0
+        since_updated, since_item = mark
+        lookback = float(self.settings.get("change_lookback_seconds", DEFAULT_CHANGE_LOOKBACK))
+
+        window = float(self.settings.get("change_window_hours", DEFAULT_CHANGE_WINDOW_HOURS)) * 3600
+        exported_ids = self.journal.exported_since(time.time() - window)
+        if not exported_ids:
+            return 0
+        where = (
+            "o.id IN %s AND o.status IN %s AND "
+            "(o.updated_at > %s OR o.id IN (SELECT c.order_id FROM order_items c WHERE c.id > %s))"
+        )
+        orders, (max_updated, max_item) = fetch_orders_with_items(
+            cur, where,
+            (tuple(exported_ids), ("recebido", "em_andamento"),
+             _look_back(since_updated, lookback) if since_updated else "1970-01-01",
+             max(0, (since_item or 0) - CHANGE_ITEM_LOOKBACK)),
+        )
+        if not orders:
+            return 0
+        if self.snapshots is not None:
+            # Change detection always reads the DB (a snapshot cannot tell what
+            # changed); it only refreshes the cached copies reprocessing uses
+            self.snapshots.put_many(orders)
+
+        known = self.journal.hashes([o.order_id for o in orders])
+        changed = []
+        baseline = {}
+        for order in orders:
+            digest = order_content_hash(order)
+            previous = known.get(order.order_id)
+            if previous is None:
+                baseline[order.order_id] = digest
+            elif previous != digest:
+                changed.append(order)
+        if baseline:
+            self.journal.store_hashes(baseline)
+
+        amended = 0
+        for order in changed[:budget]:
+            try:
+                fpath = self.export_order(cur, conn, order, "amendment")
+                amended += 1
+                self.notify("Pedido alterado", f"Pedido {order.order_number} alterado após exportação")
+                self.on_preview(f"Pedido {order.order_number} alterado -> {fpath}")
+            except Exception as e:
+                log_error(e, f"Erro ao reexportar pedido alterado {order.order_id}")
+        if len(changed) > amended:
+            # leave the watermark where it was so the rest is picked up next scan
+            self.last_change_check = 0.0
+        else:
+            self.journal.set_meta("change_watermark", [
+                _json_safe(max_updated) if max_updated is not None else since_updated,
+                max(max_item or 0, since_item or 0),
+            ])
+        self.stats["amended"] += amended
+        return amended
+
+    def sync_once(self):
+        """One sync cycle. Returns the number of newly seen orders, or None if the DB failed."""
+        if not self.state_ready.wait(timeout=30):
+            return 0
+        if not self.sync_lock.acquire(blocking=False):
+            return 0
+        self.running_sync = True
+        start_time = time.time()
+        conn = cur = None
+        try:
+            try:
+                conn, cur = self.connect()
+            except CircuitOpenError as e:
+                self.on_status(f"Modo offline: {e}", False)
+                return None
+            except Exception as e:
+                log_error(e, "Falha ao conectar DB")
+                self.on_status("Erro de conexão ao banco", False)
+                return None
 
-class WSClient(threading.Thread):
-    def __init__(self, url: str, on_message_callable):
-        super().__init__(daemon=True)
-        self.url = url
-        self.on_message_callable = on_message_callable
-        self.ws = None
-        self.running = False
+            try:
+                cur.execute("SELECT is_active, restrict_orders FROM maintenance_mode WHERE id = 1")
+                mm = cur.fetchone()
+                if mm and mm[0] and mm[1]:
+                    self.on_status("Sistema em manutenção (pedidos restritos)", False)
+                    return 0
+            except Exception:
+                pass
 
-    def run(self):
-        if websocket is None:
-            append_log("websocket-client não instalado; WS desativado")
-            return
-        self.running = True
-        def _on_message(ws, message):
             try:
-                data = json.loads(message)
-                self.on_message_callable(data)
+                ensure_exported_column(cur, conn)
+                orders = fetch_orders(cur)
             except Exception as e:
-                append_log(f"WS mensagem inválida: {message}")
-        def _on_error(ws, err):
-            append_log(f"WS erro: {err}")
-            time.sleep(5)
-        def _on_close(ws):
-            append_log("WS fechado")
-            time.sleep(5)
-        def _on_open(ws):
-            append_log("WS conectado")
-        while self.running:
+                self.tenant.breaker.record_failure(e)
+                log_error(e, "Erro ao buscar pedidos")
+                self.on_status("Erro ao buscar pedidos", False)
+                return None
+
+            processed = self.processed
+            arrivals = self.scheduler.sync([o for o in orders if not o.exported and o.order_id not in processed])
+            budget = int(self.settings.get("export_budget", DEFAULT_EXPORT_BUDGET)) or DEFAULT_EXPORT_BUDGET
+            watcher = self.tenant.watcher
+            if watcher is not None:
+                budget = watcher.budget_for(budget)
+                if budget == 0:
+                    waiting = watcher.unconsumed()
+                    self.on_status(f"PDV não está consumindo pedidos ({waiting} arquivos pendentes)\nExportação pausada", False)
+                    return arrivals
+            new_orders = self.scheduler.pop_batch(budget)
+            total = len(new_orders)
             try:
-                self.ws = websocket.WebSocketApp(self.url, on_message=_on_message, on_error=_on_error, on_close=_on_close, on_open=_on_open)
-                self.ws.run_forever()
+                amended = self.detect_changes(cur, conn, budget - total)
             except Exception as e:
-                append_log(f"WS run_forever falhou: {e}")
-            time.sleep(5)
+                amended = 0
+                log_error(e, "Erro ao verificar pedidos alterados")
+            if total == 0:
+                msg = "Tudo em ordem!\nTotal de 0 pedidos sincronizados"
+                if amended:
+                    msg = f"Sincronizado com sucesso\n{amended} pedidos alterados reexportados"
+                    self.on_exported([])
+                self.on_status(msg, True)
+                return arrivals
 
-    def stop(self):
-        self.running = False
-        try:
-            if self.ws:
-                self.ws.close()
-        except Exception:
-            pass
+            processed_local = []
+            exported_orders = []
+            # Probed before the items are read, so a concurrent edit leaves the snapshot stale rather than
+            # trusted; export_order then moves it past the exported mark's own updated_at bump. An edit
+            # committing between the item read and the mark is re-read by detect_changes' look-back.
+            versions = fetch_order_versions(cur, [o.order_id for o in new_orders]) if self.snapshots is not None else {}
+            for idx, order in enumerate(new_orders, start=1):
+                try:
+                    order.version = versions.get(order.order_id)
+                    order.items = fetch_order_items(cur, order.order_id)
+                    file_written = self.export_order(cur, conn, order)
+                    processed_local.append(order.order_id)
+                    exported_orders.append(order)
+                    self.notify("Novo Pedido", f"Pedido {order.order_number} processado.")
+                    self.on_preview(f"Pedido {order.order_number} -> {file_written}")
+                except Exception as e:
+                    log_error(e, f"Erro ao processar pedido {order.order_id}")
+                self.on_progress(idx / max(total, 1))
+
+            self.processed.update(processed_local)
+            self.save_processed()
+            if self.snapshots is not None:
+                self.snapshots.put_many(exported_orders)
+            elapsed = time.time() - start_time
+            self.stats["processed_today"] += len(processed_local)
+            self.stats["total_processed"] = len(self.processed)
+            self.stats["total_time"] += elapsed
+            pending = self.scheduler.depth()
+            msg = f"Sincronizado com sucesso\nTotal de {len(processed_local)} pedidos"
+            if amended:
+                msg += f", {amended} alterados reexportados"
+            if pending:
+                msg += f" ({pending} aguardando próximo ciclo)"
+            self.on_status(msg, True)
+            self.on_exported(processed_local)
+            return arrivals
+        finally:
+            SYNC_DURATION.observe(time.time() - start_time, self.tenant.label)
+            self.running_sync = False
+            try:
+                self.sync_lock.release()
+            except Exception:
+                pass
+            try:
+                if cur: cur.close()
+            except Exception:
+                pass
+            try:
+                if conn: conn.close()
+            except Exception:
+                pass
 
 class main(CTK):
     def __init__(self):
         super().__init__()
         self.settings = load_settings()
+        configure_db(self.settings)
+        self.status_message = ""
+        self.status_success = True
         self.theme_mode = self.settings.get("theme", DEFAULT_THEME)
         self.poll_interval = int(self.settings.get("poll_interval", DEFAULT_POLL_INTERVAL))
         self.polling = self.settings.get("auto_sync", False)
         self.ws_client = None
-        self.ws_thread = None
-        self.processed = load_processed()
-        self.offline_retry_thread = threading.Thread(target=retry_offline_queue, args=(self._process_payload,), daemon=True)
-        self.offline_retry_thread.start()
-        self.running_sync = False
-        self.sync_lock = threading.Lock()
-        self.sync_thread = None
-        self.stats = {"processed_today": 0, "total_processed": len(self.processed), "total_time": 0.0}
+        # Schedulers live on one asyncio loop; background results reach Tk through runtime.call_ui
+        self.runtime = Runtime(int(self.settings.get("tenant_workers", DEFAULT_TENANT_WORKERS)))
+        self.runtime.start()
+        # One engine, poller and retry task per tenant, so a slow branch only delays itself
+        self.tenants = load_tenants(self.settings)
+        self.engines: Dict[str, SyncEngine] = {}
+        self.pollers: Dict[str, PollScheduler] = {}
+        self.offline_retry_tasks = {}
+        for tenant in self.tenants:
+            engine = SyncEngine(
+                tenant.settings,
+                tenant=tenant,
+                on_status=lambda msg, ok, t=tenant: self.runtime.call_ui(self.return_status, self._tagged(t, msg), ok),
+                on_progress=lambda v: self.runtime.call_ui(self.progress.set, v),
+                on_preview=lambda msg, t=tenant: self.append_log_preview(self._tagged(t, msg)),
+                on_exported=lambda _ids, t=tenant: self.runtime.call_ui(self._on_tenant_exported, t),
+            )
+            self.engines[tenant.name] = engine
+            self.pollers[tenant.name] = PollScheduler(
+                self.runtime, lambda e=engine: self._sync_async(e), name=f"poll:{tenant.label}"
+            )
+            self.offline_retry_tasks[tenant.name] = self.runtime.spawn(
+                tenant.retry_offline_queue(self.runtime, engine.process_payload)
+            )
+            tenant.start_spool()
+        self.engine = self.engines[self.tenants[0].name]
+        self.poller = self.pollers[self.tenants[0].name]
+        self.sync_futures = {}
+        self.log_manifest = LogManifest()
+        self.profiler = SamplingProfiler()
 
         ctk.set_appearance_mode(THEME_PALETTE[self.theme_mode]["appearance"])
         ctk.set_default_color_theme("blue")
@@ -438,13 +3320,19 @@ class main(CTK):
         self.resizable(True, True)
 
         self._is_maximized = False
+        self._breaker_shown = False
 
         self.build_ui()
         self.apply_theme()
+        self.after(5000, self._metrics_tick)
+        self.after(1000, self._status_tick)
+        self.after(50, self._drain_ui)
+        self.protocol("WM_DELETE_WINDOW", self.shutdown)
 
         self.bind_all("<F5>", lambda e: self.start_sync_background())
         self.bind_all("<F11>", lambda e: self.toggle_maximize())
         self.bind_all("<Control-r>", lambda e: self.start_sync_background())
+        self.bind_all("<F9>", lambda e: self.toggle_profiler())
 
         if self.settings.get("auto_sync"):
             self.toggle_polling(True)
@@ -453,6 +3341,70 @@ class main(CTK):
         if ws_url:
             self.start_ws(ws_url)
 
+        self.metrics_server = None
+        if self.settings.get("metrics_enabled"):
+            self.start_metrics_server(int(self.settings.get("metrics_port", DEFAULT_METRICS_PORT)))
+
+        # State, PDV watcher and logs load after the first frame is drawn
+        self.after(0, self.on_window_shown)
+
+    def on_window_shown(self):
+        startup_mark("window")
+        self.runtime.background(self._load_state)
+        self.runtime.spawn(self._archive_loop())
+
+    def _load_state(self):
+        """Background part of startup: processed set and PDV watcher of each branch, today's log."""
+        for engine in self.engines.values():
+            # One branch with a broken state file or pedidos dir must not keep the others from starting
+            try:
+                engine.load_state()
+                engine.tenant.start_watcher()
+            except Exception as e:
+                log_error(e, f"[{engine.tenant.label}] Falha ao carregar estado local")
+        startup_mark("state")
+        self.runtime.call_ui(self.update_metrics)
+        self.reload_logs(tail_lines=200)
+        self.runtime.call_ui(self.report_startup)
+
+    async def _archive_loop(self):
+        """Compress old logs/pedido files shortly after startup, then every ARCHIVE_INTERVAL."""
+        asyncio = asyncio_backend()
+        await asyncio.sleep(60)
+        while True:
+            await self.runtime.run_io(self.run_archive)
+            await asyncio.sleep(ARCHIVE_INTERVAL)
+
+    def run_archive(self):
+        keep_days = int(self.settings.get("archive_after_days", DEFAULT_ARCHIVE_AFTER_DAYS))
+        retention_days = int(self.settings.get("archive_retention_days", DEFAULT_ARCHIVE_RETENTION_DAYS))
+        if keep_days <= 0:
+            return
+        try:
+            logs = archive_logs(keep_days, retention_days)
+            pedidos = sum(e.tenant.archive_pedidos(keep_days, retention_days, e.journal.order_ids_for_files)
+                          for e in self.engines.values())
+            if logs or pedidos:
+                append_log(f"Arquivamento: {logs} logs e {pedidos} pedidos compactados")
+        except Exception as e:
+            log_error(e, "Falha no arquivamento de logs/pedidos")
+
+    def report_startup(self):
+        startup_mark("ready")
+        report = startup_report()
+        try:
+            with open(os.path.join(get_path_mei(LOGS_DIR), STARTUP_PROFILE_FILE), "w", encoding="utf-8") as f:
+                f.write(report)
+        except Exception as e:
+            append_log(f"Falha ao salvar perfil de startup: {e}")
+        total = STARTUP_PROFILE[-1][1]
+        summary = f"Startup em {total:.0f} ms (orçamento {STARTUP_BUDGET_MS} ms)"
+        if total > STARTUP_BUDGET_MS:
+            append_log(f"[WARN] {summary}\n{report}")
+        else:
+            append_log(summary)
+        self.append_log_preview(summary)
+
     def build_ui(self):
         self.main_frame = ctk.CTkFrame(self, corner_radius=0)
         self.main_frame.pack(fill="both", expand=True)
@@ -508,31 +3460,46 @@ class main(CTK):
         history_frame = ctk.CTkFrame(self.left, corner_radius=6)
         history_frame.pack(padx=8, pady=6, fill="both", expand=True)
 
-        h_title = ctk.CTkLabel(history_frame, text="Pedidos (últimos sincronizados / do DB)", font=("Inter", 13, "bold"))
-        h_title.pack(pady=(8,6), padx=8, anchor="w")
+        h_header = ctk.CTkFrame(history_frame, fg_color="transparent")
+        h_header.pack(fill="x", pady=(8,6), padx=8)
+        h_title = ctk.CTkLabel(h_header, text="Pedidos (últimos exportados)", font=("Inter", 13, "bold"))
+        h_title.pack(side="left")
+        if len(self.tenants) > 1:
+            self.tenant_combo = ctk.CTkComboBox(
+                h_header, values=[t.label for t in self.tenants], width=160, command=self.on_tenant_selected
+            )
+            self.tenant_combo.set(self.tenants[0].label)
+            self.tenant_combo.pack(side="right")
+            ctk.CTkLabel(h_header, text="Filial:").pack(side="right", padx=(0,6))
 
         self.orders_list = ctk.CTkScrollableFrame(history_frame, corner_radius=6)
         self.orders_list.pack(fill="both", expand=True, padx=8, pady=(6,8))
 
         self.orders_items = []
+        self.selected_orders: Dict[int, Any] = {}
+        self.selected_engine = None   # tenant the history rows (and their checkboxes) were built for
         refresh_btns = ctk.CTkFrame(history_frame)
         refresh_btns.pack(fill="x", padx=8, pady=(6,8))
-        self.btn_refresh_history = ctk.CTkButton(refresh_btns, text="Atualizar lista do DB", command=self.refresh_orders_list)
+        self.btn_refresh_history = ctk.CTkButton(refresh_btns, text="Atualizar histórico", command=self.refresh_orders_list)
         self.btn_refresh_history.pack(side="left", padx=6)
         self.btn_clear_processed = ctk.CTkButton(refresh_btns, text="Limpar processed", command=self.clear_processed)
         self.btn_clear_processed.pack(side="left", padx=6)
+        self.btn_reprocess_selected = ctk.CTkButton(refresh_btns, text="Reprocessar selecionados", command=self.reprocess_selected)
+        self.btn_reprocess_selected.pack(side="left", padx=6)
 
         metrics_frame = ctk.CTkFrame(self.left, corner_radius=6)
         metrics_frame.pack(padx=8, pady=6, fill="x")
-        self.metrics_label = ctk.CTkLabel(metrics_frame, text="Métricas: ---", font=("Inter", 11), anchor="w")
-        self.metrics_label.pack(padx=8, pady=8, fill="x")
+        self.metrics_label = ctk.CTkLabel(metrics_frame, text="Métricas: ---", font=("Inter", 11), anchor="w", justify="left")
+        self.metrics_label.pack(side="left", padx=8, pady=8, fill="x", expand=True)
+        self.pdv_label = ctk.CTkLabel(metrics_frame, text="PDV: ---", font=("Inter", 11, "bold"), anchor="e", justify="right")
+        self.pdv_label.pack(side="right", padx=8, pady=8)
 
         title_r = ctk.CTkLabel(self.right, text="Logs & Ferramentas", font=("Inter", 16, "bold"))
         title_r.pack(pady=(8,6), padx=8, anchor="w")
 
         list_frame = ctk.CTkFrame(self.right, corner_radius=6)
         list_frame.pack(padx=8, pady=(6,8), fill="x")
-        self.log_combo = ctk.CTkComboBox(list_frame, values=self.get_log_files(), command=self.on_log_selected)
+        self.log_combo = ctk.CTkComboBox(list_frame, values=[], command=self.on_log_selected)
         self.log_combo.set("Selecione arquivo de log")
         self.log_combo.pack(side="left", padx=(6,8), fill="x", expand=True)
         self.btn_reload_logs = ctk.CTkButton(list_frame, text="Recarregar", command=self.reload_logs)
@@ -546,8 +3513,24 @@ class main(CTK):
         export_frame.pack(fill="x", padx=8, pady=(6,12))
         self.btn_tail = ctk.CTkButton(export_frame, text="Mostrar últimas linhas", command=lambda: self.show_tail_of_selected(200))
         self.btn_tail.pack(side="left", padx=6)
-        self.btn_export_csv = ctk.CTkButton(export_frame, text="Exportar processed CSV", command=self.export_processed_csv)
+        self.btn_export_csv = ctk.CTkButton(export_frame, text="Exportar histórico", command=self.export_processed_csv)
         self.btn_export_csv.pack(side="left", padx=6)
+        self.btn_profiler = ctk.CTkButton(export_frame, text="Iniciar perfil (F9)", command=self.toggle_profiler)
+        self.btn_profiler.pack(side="left", padx=6)
+
+        range_frame = ctk.CTkFrame(self.right, corner_radius=6)
+        range_frame.pack(fill="x", padx=8, pady=(0,12))
+        ctk.CTkLabel(range_frame, text="De:").pack(side="left", padx=(8,4))
+        self.export_from_entry = ctk.CTkEntry(range_frame, width=100, placeholder_text="AAAA-MM-DD")
+        self.export_from_entry.pack(side="left", padx=(0,6))
+        ctk.CTkLabel(range_frame, text="Até:").pack(side="left", padx=(6,4))
+        self.export_to_entry = ctk.CTkEntry(range_frame, width=100, placeholder_text="AAAA-MM-DD")
+        self.export_to_entry.pack(side="left", padx=(0,6))
+        self.export_format = ctk.CTkComboBox(range_frame, values=["csv", "json"], width=80)
+        self.export_format.set("csv")
+        self.export_format.pack(side="left", padx=6)
+        self.btn_reprocess_range = ctk.CTkButton(range_frame, text="Reprocessar período", width=140, command=self.reprocess_range)
+        self.btn_reprocess_range.pack(side="left", padx=6)
 
     def apply_theme(self):
         p = THEME_PALETTE[self.theme_mode]
@@ -613,47 +3596,49 @@ class main(CTK):
             append_log(f"toggle_maximize failed: {e}")
 
     def get_log_files(self):
-        ensure_dir(get_path_mei(LOGS_DIR))
-        files = [f for f in os.listdir(get_path_mei(LOGS_DIR)) if os.path.isfile(os.path.join(get_path_mei(LOGS_DIR), f))]
-        files_sorted = sorted(files, reverse=True)
-        return files_sorted
+        return self.log_manifest.files()
 
-    def reload_logs(self):
-        files = self.get_log_files()
-        try:
-            self.log_combo.configure(values=files)
-        except Exception:
-            pass
-        if files:
+    def reload_logs(self, tail_lines: int = None):
+        """Refresh the log list and show the newest file; file I/O runs off the Tk thread."""
+        def _load():
             try:
-                self.log_combo.set(files[0])
-                self.on_log_selected(files[0])
-            except Exception:
-                pass
-        else:
+                files = self.get_log_files()
+            except Exception as e:
+                files = []
+                append_log(f"Falha ao listar logs: {e}")
+            content = read_log(files[0], tail_lines) if files else "Nenhum arquivo de log encontrado."
+            self.runtime.call_ui(_apply, files, content)
+
+        def _apply(files, content):
             try:
-                self.log_combo.set("Nenhum log")
+                self.log_combo.configure(values=files)
+                self.log_combo.set(files[0] if files else "Nenhum log")
             except Exception:
                 pass
-            self.log_text.configure(state="normal")
-            self.log_text.delete("1.0", "end")
-            self.log_text.insert("end", "Nenhum arquivo de log encontrado.")
-            self.log_text.configure(state="disabled")
+            self.set_log_text(content)
 
-    def on_log_selected(self, file_name):
-        if not file_name or str(file_name).startswith("Nenhum"):
-            return
-        path = os.path.join(get_path_mei(LOGS_DIR), file_name)
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                content = f.read()
-        except Exception as e:
-            content = f"Erro ao ler log: {e}"
+        if threading.current_thread() is threading.main_thread():
+            self.runtime.background(_load)
+        else:
+            _load()
+
+    def set_log_text(self, content: str):
         self.log_text.configure(state="normal")
         self.log_text.delete("1.0", "end")
         self.log_text.insert("end", content)
         self.log_text.configure(state="disabled")
 
+    def _show_log_async(self, file_name: str, tail_lines: int = None):
+        def _load():
+            content = read_log(file_name, tail_lines)
+            self.runtime.call_ui(self.set_log_text, content)
+        self.runtime.background(_load)
+
+    def on_log_selected(self, file_name):
+        if not file_name or str(file_name).startswith("Nenhum"):
+            return
+        self._show_log_async(file_name)
+
     def show_tail_of_selected(self, lines: int = 200):
         try:
             sel = self.log_combo.get()
@@ -661,20 +3646,10 @@ class main(CTK):
             sel = None
         if not sel or str(sel).startswith("Nenhum"):
             return
-        path = os.path.join(get_path_mei(LOGS_DIR), sel)
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                content = f.readlines()
-                tail = "".join(content[-lines:])
-        except Exception as e:
-            tail = f"Erro ao ler log: {e}"
-        self.log_text.configure(state="normal")
-        self.log_text.delete("1.0", "end")
-        self.log_text.insert("end", tail)
-        self.log_text.configure(state="disabled")
+        self._show_log_async(sel, lines)
 
     def append_log_preview(self, message: str):
-        ts = datetime.now(tz=tz.gettz()).isoformat()
+        ts = now_local().isoformat()
         preview = f"[{ts}] {message}\n"
         def _append():
             try:
@@ -685,10 +3660,10 @@ class main(CTK):
                 self.log_text.configure(state="disabled")
             except Exception:
                 pass
-        self.after(0, _append)
+        self.runtime.call_ui(_append)
 
     def refresh_orders_list(self):
-        """Recarrega a lista de pedidos do banco e atualiza o painel de histórico."""
+        """Recarrega o painel de histórico a partir do journal local de exportações."""
         inner = None
         for attr in ("_frame", "inner_frame", "frame", "_scrollable_frame"):
             inner = getattr(self.orders_list, attr, None)
@@ -702,36 +3677,62 @@ class main(CTK):
             except Exception:
                 pass
         self.orders_items.clear()
+        self.selected_orders.clear()
 
+        engine = self.engine
+        self.selected_engine = engine
         try:
-            conn, cur = connect_db()
-            cur.execute("""
-                SELECT id, order_number, created_at, status, total
-                FROM orders
-                ORDER BY created_at DESC
-                LIMIT 30
-            """)
-            rows = cur.fetchall()
-            for r in rows:
-                oid = r["id"]
-                created = r.get("created_at")
-                created_str = created if isinstance(created, str) else (created.isoformat() if created else "")
-                txt = f"#{r.get('order_number')} - {created_str} - {r.get('status')}"
+            rows = engine.journal.recent(30)
+            for oid, order_number, exported_at, latency, item_count, total, kind in rows:
+                total_str = f"R$ {total:.2f}" if total is not None else "-"
+                txt = f"#{order_number} - {exported_at[:19]} - {item_count} itens - {total_str} - {latency:.0f}s"
+                if kind != "export":
+                    txt += f" ({kind})"
                 frame = ctk.CTkFrame(container, corner_radius=6)
                 frame.pack(fill="x", padx=6, pady=4)
+                if oid not in self.selected_orders:
+                    var = ctk.BooleanVar(value=False)
+                    self.selected_orders[oid] = var
+                    ctk.CTkCheckBox(frame, text="", width=24, variable=var).pack(side="left", padx=(8,0))
                 lbl = ctk.CTkLabel(frame, text=txt, anchor="w")
                 lbl.pack(side="left", padx=8)
-                btn_reprocess = ctk.CTkButton(frame, text="Reprocessar", width=110, command=lambda o=oid: self.reprocess_order(o))
+                btn_reprocess = ctk.CTkButton(frame, text="Reprocessar", width=110, command=lambda o=oid, e=engine: self.reprocess_order(o, e))
                 btn_reprocess.pack(side="right", padx=8)
+                btn_file = ctk.CTkButton(frame, text="Arquivo", width=80, command=lambda o=oid, n=order_number, e=engine: self.show_pedido(o, n, e))
+                btn_file.pack(side="right")
                 self.orders_items.append((frame, lbl, btn_reprocess))
-            cur.close()
-            conn.close()
         except Exception as e:
             self.append_log_preview("Falha ao buscar histórico: " + str(e))
 
-    def reprocess_order(self, order_id: int):
-        t = threading.Thread(target=self._process_single_order_by_id, args=(order_id,), daemon=True)
-        t.start()
+    def show_pedido(self, order_id: int, order_number: str, engine: SyncEngine):
+        """Mostra no painel de log o arquivo do pedido (no diretório de pedidos ou já arquivado)."""
+        def _load():
+            content = engine.tenant.read_pedido(order_id, engine.journal.last_file(order_id))
+            self.runtime.call_ui(self.set_log_text, content or f"Arquivo do pedido #{order_number} não encontrado")
+        self.runtime.background(_load)
+
+    def reprocess_order(self, order_id: int, engine: SyncEngine):
+        self.runtime.submit(engine.tenant.name, engine.process_order_by_id, order_id)
+
+    def reprocess_selected(self):
+        ids = [oid for oid, var in self.selected_orders.items() if var.get()]
+        if not ids:
+            self.return_status("Nenhum pedido selecionado", False)
+            return
+        engine = self.selected_engine
+        self.runtime.submit(engine.tenant.name, self._reprocess_orders, engine, order_ids=ids)
+
+    def reprocess_range(self):
+        """Reprocessa todos os pedidos criados entre De/Até (dias inclusivos, horário local)."""
+        try:
+            start = datetime.strptime(self.export_from_entry.get().strip(), "%Y-%m-%d")
+            end_txt = self.export_to_entry.get().strip()
+            end = datetime.strptime(end_txt, "%Y-%m-%d") if end_txt else start
+        except ValueError:
+            self.return_status("Datas inválidas (use AAAA-MM-DD)", False)
+            return
+        engine = self.engine
+        self.runtime.submit(engine.tenant.name, self._reprocess_orders, engine, start=start, end=end + timedelta(days=1))
 
     def toggle_polling(self, _event=None):
         try:
@@ -741,220 +3742,300 @@ class main(CTK):
         self.settings["poll_interval"] = self.poll_interval
         self.settings["auto_sync"] = bool(self.auto_var.get())
         save_settings(self.settings)
+        for poller in self.pollers.values():
+            poller.stop()
         if self.auto_var.get():
             self.polling = True
-            t = threading.Thread(target=self._poll_loop, daemon=True)
-            t.start()
+            for poller in self.pollers.values():
+                poller.configure(
+                    self.poll_interval,
+                    int(self.settings.get("poll_min_interval", DEFAULT_POLL_MIN_INTERVAL)),
+                    int(self.settings.get("poll_max_interval", DEFAULT_POLL_MAX_INTERVAL)),
+                )
+                poller.start()
             self.append_log_preview("Auto Sync ligado")
         else:
             self.polling = False
             self.append_log_preview("Auto Sync desligado")
 
-    def _poll_loop(self):
-        while self.polling:
-            if not self.running_sync:
-                self.start_sync_background(auto=True)
-            time.sleep(self.poll_interval)
+    def _tagged(self, tenant: Tenant, msg: str) -> str:
+        return f"[{tenant.label}] {msg}" if len(self.tenants) > 1 else msg
+
+    def _on_tenant_exported(self, tenant: Tenant):
+        if self.engine.tenant is tenant:
+            self.btn_refresh_history.invoke()
+
+    def on_tenant_selected(self, label: str):
+        """Troca a filial mostrada no histórico, métricas e ações de reprocessamento."""
+        for tenant in self.tenants:
+            if tenant.label == label:
+                self.engine = self.engines[tenant.name]
+                self.poller = self.pollers[tenant.name]
+                break
+        self.refresh_orders_list()
+        self.update_metrics()
+
+    def start_metrics_server(self, port: int):
+        try:
+            self.metrics_server = MetricsServer(self.metrics_snapshot, port)
+            self.metrics_server.start()
+            append_log(f"Métricas em http://127.0.0.1:{port}/metrics")
+        except Exception as e:
+            self.metrics_server = None
+            log_error(e, f"Falha ao iniciar endpoint de métricas na porta {port}")
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        """Plain-data view of counters for the metrics endpoint; runs off the Tk thread, touches no widgets."""
+        tenants = {}
+        threads = {}
+        for t in self.tenants:
+            engine = self.engines[t.name]
+            depth, oldest = t.offline_stats()
+            tenants[t.label] = {
+                "exported": dict(engine.exported_counts),
+                "amended": engine.stats["amended"],
+                "queue_depth": engine.scheduler.depth(),
+                "offline_depth": depth,
+                "offline_oldest_age": oldest,
+                "db_errors": t.breaker.total_failures,
+                "db_breaker_state": t.breaker.state,
+                "db_pool_in_use": t.pool.stats()["in_use"],
+                "pdv_unconsumed": t.watcher.unconsumed() if t.watcher is not None else 0,
+            }
+            if engine.snapshots is not None:
+                tenants[t.label]["snapshot_cache"] = engine.snapshots.stats()
+            threads[f"poll:{t.label}"] = self.pollers[t.name].is_running()
+            threads[f"retry:{t.label}"] = not self.offline_retry_tasks[t.name].done()
+        if self.ws_client is not None:
+            threads["ws"] = self.ws_client.is_alive()
+        threads["runtime"] = self.runtime.is_alive()
+        return {
+            "uptime_seconds": time.perf_counter() - _PROCESS_START,
+            "tenants": tenants,
+            "sync_cycle_seconds": SYNC_DURATION.snapshot(),
+            "order_file_write_seconds": WRITE_LATENCY.snapshot(),
+            "ws_connected": bool(self.ws_client is not None and self.ws_client.connected),
+            "threads": threads,
+        }
 
     def start_ws(self, ws_url: str):
-        if websocket is None:
+        if websocket_backend() is None:
             append_log("websocket-client não instalado; WS desativado")
             return
         if self.ws_client:
             self.ws_client.stop()
-        self.ws_client = WSClient(ws_url, self._on_ws_message)
+        self.ws_client = WSClient(ws_url, self._on_ws_message, self.runtime)
         self.ws_client.start()
         self.append_log_preview("WS client iniciado")
 
     def _on_ws_message(self, data: dict):
         try:
             action = data.get("action")
+            engine = None
+            if data.get("tenant") is not None:
+                engine = self.engines.get(data["tenant"])
+                if engine is None:
+                    append_log(f"WS mensagem ignorada: filial desconhecida {data['tenant']!r}")
+                    return
+            elif len(self.engines) == 1:
+                engine = self.engine
             if action == "new_order" and data.get("order_id"):
                 self.append_log_preview(f"WS new_order {data['order_id']}")
-                self.start_sync_background()
+                for e in ([engine] if engine else self.engines.values()):
+                    poller = self.pollers[e.tenant.name]
+                    if poller.is_running():
+                        poller.poke()
+                    else:
+                        self.start_sync_background(engine=e)
             elif action == "order_payload" and data.get("order"):
+                if engine is None:
+                    # With several branches a payload must say whose order it is
+                    append_log("WS order_payload sem 'tenant' ignorado (várias filiais configuradas)")
+                    return
                 self.append_log_preview("WS order_payload recebido")
-                self._process_payload(data["order"])
+                self.runtime.submit(engine.tenant.name, engine.process_payload, data["order"])
         except Exception as e:
             append_log(f"WS on_message error: {e}")
 
-    def start_sync_background(self, auto: bool = False):
-        if self.running_sync:
-            return
-        self.sync_thread = threading.Thread(target=self._sync_db, args=(auto,), daemon=True)
-        self.sync_thread.start()
-
-    def _process_payload(self, payload: dict, offline_retry: bool = False) -> bool:
-        """Process a single order payload (used by offline retry). Returns True if ok."""
-        global ORDER_INDEX
-        try:
-            now = datetime.now(tz=tz.gettz())
-            items = payload.get("items", [])
-            line = format_order_line(payload, items, ORDER_INDEX, now)
-            file_written = write_order_file(line, now.month, now.day, ORDER_INDEX)
-            ORDER_INDEX += 1
-            if self.settings.get("mark_exported_in_db", True) and payload.get("order_id"):
-                try:
-                    conn, cur = connect_db()
-                    ensure_exported_column(cur, conn)
-                    mark_order_exported_in_db(cur, conn, payload["order_id"])
-                    cur.close(); conn.close()
-                except Exception:
-                    if not offline_retry:
-                        enqueue_offline(payload.get("order_id"), payload)
-            notify_native("Novo Pedido", f"Pedido {payload.get('order_number')} processado")
-            self.append_log_preview(f"Processed payload -> {file_written}")
-            return True
-        except Exception as e:
-            log_error(e, "Falha ao processar payload")
-            return False
+    def start_sync_background(self, auto: bool = False, engine: SyncEngine = None):
+        for e in ([engine] if engine else self.engines.values()):
+            future = self.sync_futures.get(e.tenant.name)
+            if e.running_sync or (future is not None and not future.done()):
+                continue
+            self.sync_futures[e.tenant.name] = self.runtime.spawn(self._sync_async(e))
 
-    def _process_single_order_by_id(self, order_id: int):
+    def _reprocess_orders(self, engine: SyncEngine, **selection):
         try:
-            conn, cur = connect_db()
-            cur.execute("SELECT * FROM orders WHERE id = %s", (order_id,))
-            order = cur.fetchone()
-            if not order:
-                self.append_log_preview(f"Pedido {order_id} não encontrado")
-                cur.close(); conn.close()
-                return
-            items = fetch_order_items(cur, order_id)
-            now = datetime.now(tz=tz.gettz())
-            line = format_order_line(order, items, ORDER_INDEX, now)
-            fpath = write_order_file(line, now.month, now.day, ORDER_INDEX)
-            ensure_exported_column(cur, conn)
-            mark_order_exported_in_db(cur, conn, order_id)
-            self.append_log_preview(f"Pedido {order_id} reprocessado -> {fpath}")
-            cur.close(); conn.close()
-        except Exception as e:
-            log_error(e, f"Falha ao reprocessar pedido {order_id}")
+            n = engine.reprocess_orders(**selection)
+            self.runtime.call_ui(self.return_status, f"{n} pedidos reprocessados", True)
+        finally:
+            self.runtime.call_ui(self.progress.set, 0.0)
 
-    def _sync_db(self, auto: bool = False):
-        """Main sync routine (background)."""
-        global ORDER_INDEX
-        if not self.sync_lock.acquire(blocking=False):
-            return
-        self.running_sync = True
-        start_time = time.time()
+    async def _sync_async(self, engine: SyncEngine):
+        """Run one engine cycle on the tenant's executor and reflect it in the UI."""
+        asyncio = asyncio_backend()
         try:
-            conn = cur = None
-            try:
-                conn, cur = connect_db()
-            except Exception as e:
-                log_error(e, "Falha ao conectar DB")
-                self.after(0, lambda: self.return_status("Erro de conexão ao banco", False))
-                return
-
-            try:
-                cur.execute("SELECT is_active, restrict_orders FROM maintenance_mode WHERE id = 1")
-                mm = cur.fetchone()
-                if mm and mm.get("is_active") and mm.get("restrict_orders"):
-                    self.after(0, lambda: self.return_status("Sistema em manutenção (pedidos restritos)", False))
-                    return
-            except Exception:
-                pass
-
-            try:
-                ensure_exported_column(cur, conn)
-                orders = fetch_orders(cur)
-            except Exception as e:
-                log_error(e, "Erro ao buscar pedidos")
-                self.after(0, lambda: self.return_status("Erro ao buscar pedidos", False))
-                return
-
-            new_orders = [o for o in orders if not o.get("exported", False) and o["order_id"] not in self.processed]
-            total = len(new_orders)
-            if total == 0:
-                self.after(0, lambda: self.return_status("Tudo em ordem!\nTotal de 0 pedidos sincronizados", True))
-                return
-
-            processed_local = []
-            for idx, order in enumerate(new_orders, start=1):
-                try:
-                    items = fetch_order_items(cur, order["order_id"])
-                    now = datetime.now(tz=tz.gettz())
-                    line = format_order_line(order, items, ORDER_INDEX, now)
-                    file_written = write_order_file(line, now.month, now.day, ORDER_INDEX)
-                    ORDER_INDEX += 1
-                    if self.settings.get("mark_exported_in_db", True):
-                        ok = mark_order_exported_in_db(cur, conn, order["order_id"])
-                        if not ok:
-                            enqueue_offline(order["order_id"], {**order, "items": items})
-                    processed_local.append(order["order_id"])
-                    notify_native("Novo Pedido", f"Pedido {order.get('order_number')} processado.")
-                    self.append_log_preview(f"Pedido {order.get('order_number')} -> {file_written}")
-                except Exception as e:
-                    log_error(e, f"Erro ao processar pedido {order.get('order_id')}")
-                progress_value = idx / max(total, 1)
-                self.after(0, lambda v=progress_value: self.progress.set(v))
-
-            self.processed.update(processed_local)
-            save_processed(self.processed)
-            elapsed = time.time() - start_time
-            self.stats["processed_today"] += len(processed_local)
-            self.stats["total_processed"] = len(self.processed)
-            self.stats["total_time"] += elapsed
-            self.after(0, lambda: self.return_status(f"Sincronizado com sucesso\nTotal de {len(processed_local)} pedidos", True))
-            self.after(0, lambda: self.btn_refresh_history.invoke())
+            return await self.runtime.run_blocking(engine.tenant.name, engine.sync_once)
         finally:
-            time.sleep(0.4)
-            self.after(0, lambda: self.progress.set(0.0))
-            self.running_sync = False
-            try:
-                self.sync_lock.release()
-            except Exception:
-                pass
-
-            try:
-                if cur: cur.close()
-            except Exception:
-                pass
+            await asyncio.sleep(0.4)
+            self.runtime.call_ui(self.progress.set, 0.0)
+            self.runtime.call_ui(self.update_metrics)
+
+    def _drain_ui(self):
+        self.runtime.drain_ui()
+        self.after(50, self._drain_ui)
+
+    def shutdown(self):
+        """Window close: stop schedulers and workers in order, then tear down Tk."""
+        for poller in self.pollers.values():
+            poller.stop()
+        if self.ws_client is not None:
+            self.ws_client.stop()
+        if self.profiler.is_running():
             try:
-                if conn: conn.close()
-            except Exception:
-                pass
-            self.after(0, lambda: self.update_metrics())
+                self.profiler.stop()
+            except Exception as e:
+                log_error(e, "Falha ao salvar perfil")
+        self.runtime.stop()
+        for tenant in self.tenants:
+            tenant.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.destroy()
 
     def return_status(self, message: str, success: bool):
+        self.status_message = message
+        self.status_success = success
+        self.render_status()
+        append_log(message)
+        self.append_log_preview(message)
+
+    def render_status(self):
         p = THEME_PALETTE[self.theme_mode]
+        text = self.status_message
+        breaker = "\n".join(
+            self._tagged(t, t.breaker.status_text()) for t in self.tenants if t.breaker.status_text()
+        )
+        if breaker:
+            text = f"{text}\n{breaker}" if text else breaker
         try:
-            self.status_label.configure(text=message)
-            color = p["status_success"] if success else p["status_error"]
+            self.status_label.configure(text=text)
+            color = p["status_success"] if self.status_success and not breaker else p["status_error"]
             self.status_label.configure(text_color=color)
         except Exception:
             pass
-        append_log(message)
-        self.append_log_preview(message)
+
+    def _status_tick(self):
+        # Keeps the breaker countdown current; cheap when the breaker is closed
+        open_breakers = any(t.breaker.state != CircuitBreaker.CLOSED for t in self.tenants)
+        if open_breakers or self._breaker_shown:
+            self.render_status()
+        self._breaker_shown = open_breakers
+        self.after(1000, self._status_tick)
 
     def update_metrics(self):
-        avg = (self.stats["total_time"] / max(1, self.stats["total_processed"])) if self.stats["total_processed"] > 0 else 0.0
-        s = f"Hoje: {self.stats['processed_today']} pedidos | Total proces.: {self.stats['total_processed']} | Tempo médio: {avg:.2f}s"
+        stats = self.engine.stats
+        midnight = now_local().replace(hour=0, minute=0, second=0, microsecond=0)
+        today = self.engine.journal.summary(midnight.timestamp())
+        s = (f"Hoje: {today['count']} pedidos | Total proces.: {stats['total_processed']} | "
+             f"Latência méd.: {today['avg_latency']:.1f}s (máx. {today['max_latency']:.0f}s)")
+        if stats["amended"]:
+            s += f" | Alterados: {stats['amended']}"
+        if self.poller.is_running():
+            s += f" | Próx. sync: {self.poller.current_interval:.0f}s ({self.poller.rate:.1f} ped./min)"
+        tenant = self.engine.tenant
+        if len(self.tenants) > 1:
+            s = f"Filial {tenant.label} — " + s
+        if tenant.spool is not None:
+            for d in tenant.spool.stats():
+                state = "ok" if not d["last_error"] else "falhando"
+                s += f"\nDestino {d['target']}: {state} | pend. {d['pending']} | atraso {d['lag']:.0f}s | falhas {d['failures']}"
+        queue = self.engine.scheduler.stats()
+        s += "\nFila: " + " | ".join(
+            f"{k} {q['depth']} (espera méd. {q['avg_wait']:.0f}s, máx. {q['max_wait']:.0f}s)" for k, q in queue.items()
+        )
+        if len(self.tenants) > 1:
+            for t in self.tenants:
+                e = self.engines[t.name]
+                summary = e.journal.summary(midnight.timestamp())
+                db = "ok" if t.breaker.state == CircuitBreaker.CLOSED else "offline"
+                pdv = t.watcher.state() if t.watcher is not None else "-"
+                pool = t.pool.stats()
+                s += (f"\n{t.label}: hoje {summary['count']} | lat. méd. {summary['avg_latency']:.1f}s | "
+                      f"banco {db} (conexões {pool['in_use']}/{pool['size']}) | fila {e.scheduler.depth()} | PDV {pdv}")
         try:
             self.metrics_label.configure(text=s)
         except Exception:
             pass
+        if tenant.watcher is not None:
+            p = THEME_PALETTE[self.theme_mode]
+            w = tenant.watcher.stats()
+            txt = (f"PDV: {w['state']}\nNão consumidos: {w['unconsumed']} (mais antigo {w['oldest_age']:.0f}s)\n"
+                   f"Latência: {w['last_latency']:.1f}s (méd. {w['avg_latency']:.1f}s)")
+            try:
+                self.pdv_label.configure(text=txt, text_color=p["status_success"] if w["state"] == "ok" else p["status_error"])
+            except Exception:
+                pass
+
+    def _metrics_tick(self):
+        self.update_metrics()
+        self.after(5000, self._metrics_tick)
+
+    def toggle_profiler(self):
+        """Liga/desliga o profiler; ao parar, o relatório é salvo em LOGS_DIR fora da thread do Tk."""
+        if not self.profiler.is_running():
+            self.profiler.start()
+            self.btn_profiler.configure(text="Parar perfil (F9)")
+            self.append_log_preview("Perfil iniciado (CPU + memória)")
+            return
+        self.btn_profiler.configure(text="Salvando perfil...", state="disabled")
+
+        def _stop():
+            try:
+                path = self.profiler.stop()
+                self.append_log_preview(f"Perfil salvo em {path}")
+            except Exception as e:
+                log_error(e, "Falha ao salvar perfil")
+            finally:
+                self.runtime.call_ui(lambda: self.btn_profiler.configure(text="Iniciar perfil (F9)", state="normal"))
+
+        self.runtime.background(_stop)
 
     def clear_processed(self):
-        self.processed = set()
-        save_processed(self.processed)
+        self.engine.processed = set()
+        self.engine.save_processed()
         self.append_log_preview("Arquivo processed_orders limpo")
         self.update_metrics()
 
     def export_processed_csv(self):
+        """Stream the export journal for the chosen date range (inclusive, local days) to CSV/JSON."""
         try:
-            fpath = "processed_export.csv"
-            with open(fpath, "w", encoding="utf-8") as f:
-                f.write("order_id\n")
-                for oid in sorted(self.processed):
-                    f.write(f"{oid}\n")
-            self.append_log_preview(f"Exportado processed -> {fpath}")
-        except Exception as e:
-            log_error(e, "Erro ao exportar CSV")
+            start_txt = self.export_from_entry.get().strip()
+            end_txt = self.export_to_entry.get().strip()
+            start = datetime.strptime(start_txt, "%Y-%m-%d").astimezone() if start_txt else None
+            end = (datetime.strptime(end_txt, "%Y-%m-%d") + timedelta(days=1)).astimezone() if end_txt else None
+        except ValueError:
+            self.return_status("Datas inválidas (use AAAA-MM-DD)", False)
+            return
+        fmt = self.export_format.get() if self.export_format.get() in ("csv", "json") else "csv"
+        fpath = f"journal_export_{start_txt or 'inicio'}_{end_txt or 'hoje'}.{fmt}"
+
+        def _run():
+            try:
+                n = self.engine.journal.export(
+                    fpath, fmt, start.timestamp() if start else None, end.timestamp() if end else None
+                )
+                self.append_log_preview(f"Exportado histórico ({n} registros) -> {fpath}")
+            except Exception as e:
+                log_error(e, "Erro ao exportar histórico")
+
+        self.runtime.background(_run)
 
 if __name__ == "__main__":
     ensure_dir(get_path_mei(LOGS_DIR))
-    ensure_dir(get_path_mei(PEDIDOS_DIR))
-    OFFLINE_CONN = init_offline_db()
+    try:
+        ensure_dir(get_path_mei(PEDIDOS_DIR))
+    except OSError as e:
+        print("PEDIDOS_DIR indisponível (pedidos ficam no spool):", e)
     app = main()
-    app.reload_logs()
     app.mainloop()
@@ -0,0 +1,81 @@
+import pytest
+
+import main
+from main import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture(autouse=True)
+def logs_dir(tmp_path, monkeypatch):
+    # State changes are logged; keep them out of the app's logs dir
+    monkeypatch.setattr(main, "LOGS_DIR", str(tmp_path / "logs"))
+
+
+def expire(breaker):
+    """Pretend reset_timeout has elapsed since the breaker opened."""
+    breaker.opened_at -= breaker.reset_timeout + 1
+
+
+def test_opens_after_threshold_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    breaker.record_failure(RuntimeError("timeout"))
+    breaker.record_failure(RuntimeError("timeout"))
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+    breaker.record_failure(RuntimeError("timeout"))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.last_error == "timeout"
+    assert not breaker.allows_request()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_a_single_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    expire(breaker)
+    assert breaker.allows_request()
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_failed_trial_reopens_with_doubled_timeout_up_to_the_max():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, max_reset_timeout=30)
+    breaker.record_failure()
+    timeouts = []
+    for _ in range(3):
+        expire(breaker)
+        breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        timeouts.append(breaker.reset_timeout)
+    assert timeouts == [20, 30, 30]
+
+    expire(breaker)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.reset_timeout == 10
+
+
+def test_retry_in_counts_down_while_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    assert breaker.retry_in() == 0.0
+    breaker.record_failure()
+    assert 9 < breaker.retry_in() <= 10
+    expire(breaker)
+    assert breaker.retry_in() == 0.0
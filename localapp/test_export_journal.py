@@ -0,0 +1,95 @@
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import main
+from main import ExportJournal, Order, OrderItem, order_content_hash
+
+
+@pytest.fixture(autouse=True)
+def logs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOGS_DIR", str(tmp_path / "logs"))
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return ExportJournal(str(tmp_path / "export_journal.db"))
+
+
+def make_order(order_id, created_at, total=None, prices=("10.00", "4.50")):
+    order = Order(order_id, f"BN{order_id}", None, "", created_at, None, "Ana", None, None, None, None,
+                  None, None, None, None, None, False, total)
+    order.items = [OrderItem(1, Decimal(p), "", None, None, 11, Decimal(p)) for p in prices]
+    return order
+
+
+def at(day, hour, minute=0):
+    return datetime(2026, 3, day, hour, minute)
+
+
+def record(journal, order_id, exported, index=1, kind="export", **kwargs):
+    # Created on the hour, so latency is the exported minute
+    order = make_order(order_id, exported.replace(minute=0), **kwargs)
+    path = f"/pdv/pedido_3_{exported.day}_{index}.txt"
+    journal.record(order, path, exported, kind)
+    return order
+
+
+def test_record_stores_latency_items_and_total(journal):
+    record(journal, 1, at(2, 10, 5))
+    record(journal, 2, at(2, 10, 6), total=Decimal("99.90"))
+
+    assert journal.recent() == [
+        (2, "BN2", at(2, 10, 6).isoformat(), 360.0, 2, 99.9, "export"),
+        (1, "BN1", at(2, 10, 5).isoformat(), 300.0, 2, 14.5, "export"),
+    ]
+    assert journal.last_file(1) == "/pdv/pedido_3_2_1.txt"
+    assert journal.last_file(3) is None
+
+
+def test_range_queries_filter_on_export_time(journal):
+    for day, order_id in ((1, 1), (2, 2), (2, 3), (3, 4)):
+        record(journal, order_id, at(day, 12, order_id), index=order_id)
+    start, end = at(2, 0).timestamp(), at(3, 0).timestamp()
+
+    assert [row[0] for row in journal.iter_range(start, end, batch=1)] == [2, 3]
+    assert [row[0] for row in journal.iter_range()] == [1, 2, 3, 4]
+    assert sorted(journal.exported_since(start)) == [2, 3, 4]
+    assert journal.summary(start)["count"] == 3
+    assert journal.max_order_index(start) == 4
+    assert journal.max_order_index(at(4, 0).timestamp()) == 0
+
+
+def test_export_streams_csv_and_json(journal, tmp_path):
+    record(journal, 1, at(2, 10, 5))
+    record(journal, 2, at(2, 11, 5), index=2)
+
+    assert journal.export(str(tmp_path / "out.csv"), "csv") == 2
+    with open(tmp_path / "out.csv", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(main.JOURNAL_COLUMNS)
+    assert [r[0] for r in rows[1:]] == ["1", "2"]
+
+    assert journal.export(str(tmp_path / "out.json"), "json", start_ts=at(2, 11).timestamp()) == 1
+    with open(tmp_path / "out.json", encoding="utf-8") as f:
+        assert [r["order_number"] for r in json.load(f)] == ["BN2"]
+
+
+def test_amendments_and_hashes(journal):
+    order = record(journal, 1, at(2, 10, 5))
+    record(journal, 1, at(2, 10, 30), index=2, kind="amendment", prices=("12.00",))
+
+    assert journal.count_exports(1, "amendment") == 1
+    assert journal.count_exports(1, "export") == 1
+    hashes = journal.hashes([1, 2])
+    assert list(hashes) == [1] and hashes[1] != order_content_hash(order)
+    assert journal.order_ids_for_files(["pedido_3_2_2.txt", "pedido_3_2_9.txt"], 0) == {"pedido_3_2_2.txt": 1}
+
+
+def test_meta_round_trips_json(journal):
+    assert journal.get_meta("change_watermark") is None
+    journal.set_meta("change_watermark", ["2026-03-02T10:00:00", 42])
+    assert journal.get_meta("change_watermark") == ["2026-03-02T10:00:00", 42]
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+from main import ExportScheduler, Order, PRIORITY_ASAP, PRIORITY_SCHEDULED, PRIORITY_TABLE
+
+
+def make_order(order_id, created_at, table_number=None, pickup_time=None):
+    return Order(order_id, f"N{order_id}", table_number, "", created_at, pickup_time,
+                 "Cliente", None, None, None, None, None, None, None, None, None)
+
+
+def at(hour, minute):
+    return datetime(2026, 3, 2, hour, minute)
+
+
+def ids(orders):
+    return [o.order_id for o in orders]
+
+
+def test_orders_come_out_by_due_time():
+    scheduler = ExportScheduler(prep_lead_time=20)
+    scheduler.push(make_order(1, at(10, 5), table_number="7"))                 # due 10:05
+    scheduler.push(make_order(2, at(9, 0), pickup_time=at(10, 30)))            # due 10:10
+    scheduler.push(make_order(3, at(10, 0)))                                   # due 10:00
+    scheduler.push(make_order(4, at(9, 30), pickup_time=at(18, 0)))            # due 17:40
+
+    assert ids(scheduler.pop_batch(10)) == [3, 1, 2, 4]
+
+
+def test_same_due_time_prefers_table_then_scheduled_then_asap():
+    scheduler = ExportScheduler(prep_lead_time=0)
+    scheduler.push(make_order(1, at(10, 0)))
+    scheduler.push(make_order(2, at(9, 0), pickup_time=at(10, 0)))
+    scheduler.push(make_order(3, at(10, 0), table_number="2"))
+
+    assert ids(scheduler.pop_batch(10)) == [3, 2, 1]
+
+
+def test_pop_batch_respects_budget():
+    scheduler = ExportScheduler()
+    scheduler.sync([make_order(i, at(10, i)) for i in range(1, 6)])
+
+    assert ids(scheduler.pop_batch(2)) == [1, 2]
+    assert scheduler.depth() == 3
+    assert ids(scheduler.pop_batch(2)) == [3, 4]
+    assert ids(scheduler.pop_batch(2)) == [5]
+    assert scheduler.pop_batch(2) == []
+    assert scheduler.pop_batch(0) == []
+
+
+def test_sync_counts_arrivals_and_drops_orders_no_longer_pending():
+    scheduler = ExportScheduler()
+    assert scheduler.sync([make_order(1, at(10, 0)), make_order(2, at(10, 1))]) == 2
+    assert scheduler.sync([make_order(2, at(10, 1)), make_order(3, at(10, 2))]) == 1
+
+    assert ids(scheduler.pop_batch(10)) == [2, 3]
+
+
+def test_moved_pickup_time_reorders_the_queue():
+    scheduler = ExportScheduler(prep_lead_time=0)
+    scheduler.push(make_order(1, at(9, 0), pickup_time=at(12, 0)))
+    scheduler.push(make_order(2, at(11, 0)))
+    scheduler.push(make_order(1, at(9, 0), pickup_time=at(10, 0)))
+
+    assert ids(scheduler.pop_batch(10)) == [1, 2]
+    assert scheduler.depth() == 0
+
+
+def test_stats_track_depth_and_exports_per_class():
+    scheduler = ExportScheduler()
+    scheduler.push(make_order(1, at(10, 0), table_number="1"))
+    scheduler.push(make_order(2, at(10, 1)))
+    scheduler.push(make_order(3, at(9, 0), pickup_time=at(23, 0)))
+    scheduler.pop_batch(1)
+
+    stats = scheduler.stats()
+    assert stats[PRIORITY_TABLE]["exported"] == 1 and stats[PRIORITY_TABLE]["depth"] == 0
+    assert stats[PRIORITY_ASAP]["depth"] == 1
+    assert stats[PRIORITY_SCHEDULED]["depth"] == 1
+
+
+def test_scheduled_orders_wait_for_their_lead_window():
+    scheduler = ExportScheduler(prep_lead_time=30)
+    scheduler.push(make_order(1, at(9, 0), pickup_time=at(12, 0)))   # due 11:30
+    scheduler.push(make_order(2, at(10, 0)))
+
+    assert ids(scheduler.pop_batch(10, now=at(10, 5).timestamp())) == [2]
+    assert scheduler.depth() == 1
+    assert scheduler.pop_batch(10, now=at(11, 29).timestamp()) == []
+    assert ids(scheduler.pop_batch(10, now=at(11, 30).timestamp())) == [1]
+
+
+def test_created_at_ahead_of_the_local_clock_is_due_at_once():
+    scheduler = ExportScheduler()
+    scheduler.push(make_order(1, datetime.now() + timedelta(hours=3)))
+
+    assert ids(scheduler.pop_batch(10)) == [1]
@@ -0,0 +1,50 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from main import SyncEngine, Tenant
+
+
+@pytest.fixture(autouse=True)
+def logs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOGS_DIR", str(tmp_path / "logs"))
+
+
+def make_engine(tmp_path, name, pedidos_dirs):
+    settings = dict(main.DEFAULT_SETTINGS)
+    tenant = Tenant(name, settings, pedidos_dirs=pedidos_dirs, data_dir=str(tmp_path / name))
+    return SyncEngine(settings, connect=lambda: None, notify=main._noop, tenant=tenant)
+
+
+def make_app(engines):
+    """Just what main._load_state touches on the app."""
+    return SimpleNamespace(
+        engines={e.tenant.name: e for e in engines},
+        runtime=SimpleNamespace(call_ui=lambda fn, *args: None),
+        reload_logs=lambda tail_lines=None: None,
+        update_metrics=None,
+        report_startup=None,
+    )
+
+
+def test_a_broken_branch_does_not_stop_the_others_from_loading(tmp_path, monkeypatch):
+    pedidos = tmp_path / "pedidos"
+    pedidos.mkdir()
+    broken = make_engine(tmp_path, "centro", [])          # no pedidos dir: start_watcher raises
+    healthy = make_engine(tmp_path, "praia", [str(pedidos)])
+    (tmp_path / "praia" / "processed_orders.json").write_text(json.dumps({"processed": [1, 2]}), encoding="utf-8")
+    errors = []
+    monkeypatch.setattr(main, "log_error", lambda e, message: errors.append(message))
+
+    try:
+        main.main._load_state(make_app([broken, healthy]))
+    finally:
+        if healthy.tenant.watcher is not None:
+            healthy.tenant.watcher.stop()
+
+    assert errors == ["[centro] Falha ao carregar estado local"]
+    assert broken.state_ready.is_set() and healthy.state_ready.is_set()
+    assert healthy.processed == {1, 2}
+    assert healthy.tenant.watcher is not None and healthy.tenant.watcher.thread is not None
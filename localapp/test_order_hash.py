@@ -0,0 +1,43 @@
+from datetime import datetime
+from decimal import Decimal
+
+from main import Order, OrderItem, OrderSnapshotCache, order_content_hash
+
+
+def make_order(notes="sem cebola", exported=False, items=((2, "10.00", 11), (1, "4.50", 12))):
+    order = Order(7, "BN7", None, notes, datetime(2026, 3, 2, 10, 0), datetime(2026, 3, 2, 12, 0),
+                  "Ana", "ana@example.com", "11999990000", "01000-000", "Rua A", "10", None,
+                  "Centro", "São Paulo", "SP", exported, Decimal("24.50"))
+    order.items = [OrderItem(quantity, Decimal(price), "", f"Item {pdv}", "Grupo", pdv, quantity * Decimal(price))
+                   for quantity, price, pdv in items]
+    return order
+
+
+def test_hash_is_stable_across_rebuilds():
+    digest = order_content_hash(make_order())
+    assert order_content_hash(make_order()) == digest
+    assert order_content_hash(Order.from_payload(make_order().to_payload())) == digest
+    assert order_content_hash(OrderSnapshotCache.decode(OrderSnapshotCache.encode(make_order()))) == digest
+
+
+def test_hash_ignores_export_flags_and_totals():
+    order = make_order(exported=True)
+    order.total = Decimal("99.00")
+    order.email = "outro@example.com"
+    assert order_content_hash(order) == order_content_hash(make_order())
+
+
+def test_hash_changes_with_what_the_pdv_sees():
+    digest = order_content_hash(make_order())
+    assert order_content_hash(make_order(notes="com cebola")) != digest
+    assert order_content_hash(make_order(items=((3, "10.00", 11), (1, "4.50", 12)))) != digest
+    assert order_content_hash(make_order(items=((2, "10.00", 11),))) != digest
+
+    moved = make_order()
+    moved.address_number = "12"
+    assert order_content_hash(moved) != digest
+
+
+def test_hash_depends_on_item_order():
+    # fetch_order_items and fetch_orders_with_items both sort by oi.id so this stays stable
+    assert order_content_hash(make_order(items=((1, "4.50", 12), (2, "10.00", 11)))) != order_content_hash(make_order())
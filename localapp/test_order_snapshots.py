@@ -0,0 +1,113 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import main
+from bench_sync import OrderGenerator, SQLiteStandIn
+from main import (Order, OrderItem, OrderSnapshotCache, fetch_order_versions, fetch_orders_with_items,
+                  mark_order_exported_in_db, order_version)
+
+
+@pytest.fixture(autouse=True)
+def logs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOGS_DIR", str(tmp_path / "logs"))
+
+
+def make_order(order_id, notes="", version=None):
+    order = Order(order_id, f"BN{order_id}", None, notes, datetime(2026, 3, 2, 10, 0), None,
+                  "Ana", None, None, None, None, None, None, None, None, None, False, Decimal("4.50"))
+    order.items = [OrderItem(1, Decimal("4.50"), "", "Café", None, 11, Decimal("4.50"))]
+    order.version = version
+    return order
+
+
+def make_cache(tmp_path, max_bytes=10 * 1024 * 1024, max_age=86400):
+    return OrderSnapshotCache(str(tmp_path / "order_snapshots.db"), max_bytes, max_age)
+
+
+def stored_bytes(cache):
+    return cache.conn.execute("SELECT COALESCE(SUM(size), 0) FROM order_snapshots").fetchone()[0]
+
+
+def test_round_trip_keeps_the_version(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put_many([make_order(1, "sem açúcar", version="2026-03-02T10:00:00|7|1")])
+
+    order = cache.get_many([1, 2])[1]
+    assert order.notes == "sem açúcar" and order.items[0].item_pdv == 11
+    assert order.version == "2026-03-02T10:00:00|7|1"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_more_ids_than_one_sqlite_in_list(tmp_path):
+    cache = make_cache(tmp_path)
+    ids = list(range(1, 1201))
+    cache.put_many([make_order(i) for i in ids])
+    # Re-putting replaces rows; the running total must not count them twice
+    cache.put_many([make_order(i, notes="alterado") for i in ids])
+
+    found = cache.get_many(ids + [5000])
+    assert sorted(found) == ids
+    assert found[1200].notes == "alterado"
+    assert cache.total == stored_bytes(cache)
+
+
+def test_eviction_drops_least_recently_used_unpinned_rows(tmp_path):
+    size = len(OrderSnapshotCache.encode(make_order(1)))
+    cache = make_cache(tmp_path, max_bytes=size * 3)
+    cache.put_many([make_order(1)], pinned=True)
+    cache.put_many([make_order(2)])
+    cache.put_many([make_order(3)])
+    cache.get_many([2])
+    cache.put_many([make_order(4)])
+    cache.put_many([make_order(5)])
+
+    assert sorted(cache.get_many([1, 2, 3, 4, 5])) == [1, 4, 5]
+    assert cache.total == stored_bytes(cache) <= size * 3
+
+
+def test_single_query_versions_match_the_grouped_probe(tmp_path):
+    target = SQLiteStandIn(str(tmp_path / "standin.db"))
+    generator = OrderGenerator(target, "BN", 3)
+    generator.seed_catalog(n_groups=2, n_items=5, n_users=5)
+    generator.insert_orders(4)
+    conn, cur = target.connect()
+    try:
+        orders, _ = fetch_orders_with_items(cur, "1 = 1")
+        versions = fetch_order_versions(cur, [o.order_id for o in orders])
+    finally:
+        conn.close()
+
+    assert len(orders) == 4
+    assert {o.order_id: o.version for o in orders} == versions
+
+
+class ReturningCursor:
+    def __init__(self, updated_at):
+        self.updated_at = updated_at
+        self.executed = []
+
+    def execute(self, query, params=()):
+        self.executed.append(query)
+
+    def fetchone(self):
+        return (self.updated_at,)
+
+
+class FakeConn:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_exported_mark_moves_the_version_to_its_own_updated_at():
+    order = make_order(1, version=order_version(datetime(2026, 3, 2, 10, 0), 7, 1))
+    cur = ReturningCursor(datetime(2026, 3, 2, 10, 5))
+
+    assert mark_order_exported_in_db(cur, FakeConn(), 1, order)
+
+    assert "RETURNING updated_at" in cur.executed[0]
+    assert order.version == order_version(datetime(2026, 3, 2, 10, 5), 7, 1)
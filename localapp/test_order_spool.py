@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import main
+from main import OrderSpool, free_pedido_path
+
+
+@pytest.fixture(autouse=True)
+def logs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOGS_DIR", str(tmp_path / "logs"))
+
+
+@pytest.fixture
+def spool(tmp_path):
+    # Threads are never started; tests call deliver() the way SpoolDestination._run does
+    return OrderSpool(str(tmp_path / "spool"), [str(tmp_path / "pdv"), str(tmp_path / "copia")])
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def deliver_all(destination):
+    return [destination.deliver(name) for name in destination.pending_files()]
+
+
+def test_write_fans_out_and_delivers_in_spool_order(spool, tmp_path):
+    assert spool.write("pedido_3_2_1.txt", "PEDIDO|a|") == os.path.join(str(tmp_path / "pdv"), "pedido_3_2_1.txt")
+    spool.write("pedido_3_2_2.txt", "PEDIDO|b|")
+    assert spool.has_pending("pedido_3_2_1.txt")
+
+    for destination in spool.destinations:
+        delivered = deliver_all(destination)
+        assert [os.path.basename(p) for p in delivered] == ["pedido_3_2_1.txt", "pedido_3_2_2.txt"]
+        assert read(delivered[1]) == "PEDIDO|b|\n"
+        assert destination.pending_files() == []
+    assert not spool.has_pending("pedido_3_2_1.txt")
+
+
+def test_delivery_never_overwrites_an_unconsumed_pedido(spool, tmp_path):
+    target = tmp_path / "pdv"
+    target.mkdir()
+    (target / "pedido_3_2_1.txt").write_text("PEDIDO|antes do restart|\n", encoding="utf-8")
+    (target / "pedido_3_2_1_2.txt").write_text("PEDIDO|segundo|\n", encoding="utf-8")
+    spool.write("pedido_3_2_1.txt", "PEDIDO|novo|")
+
+    [dest] = deliver_all(spool.destinations[0])
+
+    assert os.path.basename(dest) == "pedido_3_2_1_3.txt"
+    assert read(dest) == "PEDIDO|novo|\n"
+    assert read(target / "pedido_3_2_1.txt") == "PEDIDO|antes do restart|\n"
+    assert read(target / "pedido_3_2_1_2.txt") == "PEDIDO|segundo|\n"
+    assert not [n for n in os.listdir(target) if n.endswith(".tmp")]
+
+
+def test_free_pedido_path_keeps_a_free_name(tmp_path):
+    path = str(tmp_path / "pedido_1_1_1.txt")
+    assert free_pedido_path(path) == path
+    assert main._PEDIDO_INDEX.search(str(tmp_path / "pedido_1_1_7_2.txt")).group(1) == "7"
@@ -0,0 +1,111 @@
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import main
+from main import ExportJournal, Order, OrderItem, PedidoArchive, format_order_line
+
+NOW = datetime(2026, 3, 20, 12, 0)
+
+
+@pytest.fixture(autouse=True)
+def logs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOGS_DIR", str(tmp_path / "logs"))
+
+
+def make_order(order_id, notes):
+    order = Order(order_id, f"BN{order_id}", None, notes, datetime(2026, 3, 2, 10, 0), None,
+                  "Ana", None, "11999990000", "01000-000", "Rua A | fundos", "10", None,
+                  "Centro", "São Paulo", "SP", False, Decimal("9.90"))
+    order.items = [OrderItem(1, Decimal("9.90"), "", "Bolo", None, 11, Decimal("9.90"))]
+    return order
+
+
+def write_pedido(directory, journal, order, name, age_days):
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(format_order_line(order, order.items, 1, NOW))
+    written = NOW - timedelta(days=age_days)
+    os.utime(path, (written.timestamp(), written.timestamp()))
+    journal.record(order, path, written)
+    return path
+
+
+@pytest.fixture
+def setup(tmp_path):
+    pedidos = tmp_path / "pedidos"
+    pedidos.mkdir()
+    journal = ExportJournal(str(tmp_path / "journal.db"))
+    return str(pedidos), journal, PedidoArchive(str(tmp_path / "archive"))
+
+
+def test_archive_keys_files_by_journaled_order_id(setup):
+    pedidos, journal, archive = setup
+    # "|" in the notes and address would shift any field parsed out of the file
+    old = write_pedido(pedidos, journal, make_order(7, "sem cebola | troco p/ 50"), "pedido_3_5_1.txt", 10)
+    recent = write_pedido(pedidos, journal, make_order(8, "x|y|z"), "pedido_3_19_1.txt", 1)
+
+    assert archive.archive([pedidos], 3, now=NOW.timestamp(), order_ids=journal.order_ids_for_files) == 1
+
+    assert not os.path.exists(old) and os.path.exists(recent)
+    day, name, content = archive.find(7)
+    assert (day, name) == ("2026-03-10", "pedido_3_5_1.txt")
+    assert "sem cebola | troco p/ 50" in content
+    assert archive.find(8) is None
+
+
+def test_archive_keeps_skipped_files_and_files_under_keep_days(setup):
+    pedidos, journal, archive = setup
+    pending = write_pedido(pedidos, journal, make_order(1, ""), "pedido_3_1_1.txt", 10)
+    edge = write_pedido(pedidos, journal, make_order(2, ""), "pedido_3_1_2.txt", 2.9)
+    removed = []
+
+    archived = archive.archive([pedidos], 3, skip={"pedido_3_1_1.txt"}, now=NOW.timestamp(),
+                               on_archived=removed.append, order_ids=journal.order_ids_for_files)
+
+    assert archived == 0 and removed == []
+    assert os.path.exists(pending) and os.path.exists(edge)
+
+
+def test_unjournaled_files_are_archived_under_an_empty_key(setup):
+    pedidos, journal, archive = setup
+    path = os.path.join(pedidos, "pedido_1_1_1.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("PEDIDO|manual|")
+    stamp = (NOW - timedelta(days=30)).timestamp()
+    os.utime(path, (stamp, stamp))
+
+    assert archive.archive([pedidos], 3, now=NOW.timestamp(), order_ids=journal.order_ids_for_files) == 1
+    assert main._load_json(archive.orders_path) == {"": ["2026-02-18"]}
+
+
+def test_prune_drops_days_past_retention(setup):
+    pedidos, journal, archive = setup
+    write_pedido(pedidos, journal, make_order(3, ""), "pedido_1_1_1.txt", 60)
+    archive.archive([pedidos], 3, now=NOW.timestamp(), order_ids=journal.order_ids_for_files)
+    assert archive.find(3) is not None
+
+    archive.prune(30, NOW.timestamp())
+    assert archive.find(3) is None
+    assert main._load_json(archive.orders_path) == {}
+
+
+def test_tenant_logs_archived_files_the_pdv_never_read(tmp_path, setup, monkeypatch):
+    pedidos, journal, _ = setup
+    leftover = write_pedido(pedidos, journal, make_order(4, ""), "pedido_2_1_1.txt", 10)
+    written = write_pedido(pedidos, journal, make_order(5, ""), "pedido_2_1_2.txt", 10)
+    tenant = main.Tenant("loja", dict(main.DEFAULT_SETTINGS), pedidos_dirs=[pedidos], data_dir=str(tmp_path / "loja"))
+    tenant.watcher = main.PdvWatcher(pedidos)
+    tenant.watcher._scan_existing()
+    tenant.watcher.track(written)
+    logged = []
+    monkeypatch.setattr(main, "append_log", logged.append)
+
+    assert tenant.archive_pedidos(3, order_ids=journal.order_ids_for_files) == 1
+
+    assert not os.path.exists(leftover) and os.path.exists(written)
+    assert tenant.watcher.awaiting() == {"pedido_2_1_2.txt"}
+    assert logged == ["[loja] 1 pedidos arquivados sem terem sido lidos pelo PDV: pedido_2_1_1.txt"]
+    assert tenant.read_pedido(4).startswith("PEDIDO|Ana|")
@@ -0,0 +1,70 @@
+import pytest
+
+from main import PollScheduler
+
+
+def make_poller(base=5, low=2, high=60):
+    return PollScheduler(None, None, base, low, high)
+
+
+def run(poller, arrivals, duration, start):
+    """One cycle the way PollScheduler._run records it."""
+    interval = poller.next_interval(arrivals, duration, start)
+    poller.last_cycle_start = start
+    return interval
+
+
+def test_first_cycle_uses_base_interval():
+    assert run(make_poller(), 3, 0.1, 1000.0) == 5
+
+
+def test_interval_follows_arrival_rate():
+    poller = make_poller()
+    run(poller, 0, 0.1, 0.0)
+    # 6 orders in 60s: EWMA rate 0.3 * 6 = 1.8/min -> a third of the 33s mean gap
+    assert run(poller, 6, 0.1, 60.0) == pytest.approx(20.0 / 1.8)
+    assert poller.rate == pytest.approx(1.8)
+
+
+def test_busy_periods_clamp_to_min_interval():
+    poller = make_poller()
+    start = 0.0
+    run(poller, 0, 0.1, start)
+    for _ in range(10):
+        start += 5.0
+        interval = run(poller, 20, 0.1, start)
+    assert interval == 2
+
+
+def test_quiet_periods_decay_to_max_interval():
+    poller = make_poller()
+    start = 0.0
+    run(poller, 0, 0.1, start)
+    start += 10.0
+    busy = run(poller, 10, 0.1, start)
+    for _ in range(30):
+        start += 60.0
+        quiet = run(poller, 0, 0.1, start)
+    assert busy < quiet == 60
+
+
+def test_interval_never_shorter_than_twice_the_cycle():
+    poller = make_poller()
+    run(poller, 0, 0.1, 0.0)
+    assert run(poller, 60, 4.0, 5.0) == pytest.approx(8.0)
+
+
+def test_failures_back_off_exponentially_and_reset_on_success():
+    poller = make_poller()
+    assert [run(poller, None, 0.1, float(t)) for t in range(5)] == [10, 20, 40, 60, 60]
+    assert poller.failures == 5
+    run(poller, 0, 0.1, 100.0)
+    assert poller.failures == 0
+    assert run(poller, None, 0.1, 200.0) == 10
+
+
+def test_configure_clamps_base_interval():
+    poller = make_poller(base=1, low=3, high=30)
+    assert poller.base_interval == 3
+    poller.configure(120, 3, 30)
+    assert poller.base_interval == 30
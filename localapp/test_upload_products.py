@@ -0,0 +1,137 @@
+import json
+
+import pytest
+import requests
+
+from upload_products import (CSVValidationError, FolderWatcher, is_rejection, normalize_price, rejection_details,
+                             validate_csv)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("R$ 1.234,56", "1234.56"),
+    ("45,00", "45.00"),
+    ("45", "45.00"),
+    ("12.5", "12.50"),
+    ("0,5", "0.50"),
+    ("", "0.00"),
+    (None, "0.00"),
+])
+def test_normalize_price(text, expected):
+    assert normalize_price(text) == expected
+
+
+@pytest.mark.parametrize("text", ["1.234", "-5,00", "-0", "1,2,3", "12,345", ".", "5-"])
+def test_normalize_price_rejects(text):
+    with pytest.raises(ValueError):
+        normalize_price(text)
+
+
+def write_csv(tmp_path, text, encoding="utf-8"):
+    path = tmp_path / "PRODUTOS.csv"
+    path.write_bytes(text.encode(encoding))
+    return str(path)
+
+
+def test_validate_csv_normalizes_rows(tmp_path):
+    path = write_csv(tmp_path, '#,Descrição,Grupo,Custo,Venda,Ativo\n'
+                               '10,Pão de queijo,Padaria,"1,20","3,50",Sim\n'
+                               '\n'
+                               '11,Café,,,"R$ 1.005,00",Não\n'
+                               ',,,,,\n')
+    assert validate_csv(path) == [
+        [2, "10", "Pão de queijo", "Padaria", "1.20", "3.50", True],
+        [4, "11", "Café", "Geral", "0.00", "1005.00", False],
+    ]
+
+
+def test_validate_csv_falls_back_to_windows_1252(tmp_path):
+    path = write_csv(tmp_path, 'Descrição,Venda\nCoração,"9,90"\n', encoding="cp1252")
+    assert validate_csv(path) == [[2, "", "Coração", "Geral", "0.00", "9.90", True]]
+
+
+def test_validate_csv_reports_every_bad_row(tmp_path):
+    path = write_csv(tmp_path, '#,Descrição,Venda,Ativo\n'
+                               '1,Bolo,"1.234",Sim\n'
+                               'x,Torta,"5,00",Sim\n'
+                               '1,Suco,"4,00",talvez\n')
+    with pytest.raises(CSVValidationError) as e:
+        validate_csv(path)
+    assert [line for line, _ in e.value.errors] == [2, 3, 4]
+    assert "ambiguous price" in e.value.errors[0][1]
+    assert "invalid code" in e.value.errors[1][1]
+    assert "repeated (first on line 2)" in e.value.errors[2][1]
+    assert "invalid Ativo" in e.value.errors[2][1]
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "empty file"),
+    ("Descrição,Custo\nBolo,1\n", "missing required column(s): Venda"),
+])
+def test_validate_csv_rejects_bad_headers(tmp_path, text, message):
+    with pytest.raises(CSVValidationError) as e:
+        validate_csv(write_csv(tmp_path, text))
+    assert e.value.errors[0][0] == 1
+    assert message in e.value.errors[0][1]
+
+
+def test_validate_csv_rejects_unknown_encoding(tmp_path):
+    path = tmp_path / "PRODUTOS.csv"
+    path.write_bytes(b"Descri\x81\x8d,Venda\nBolo,1\n")
+    with pytest.raises(CSVValidationError) as e:
+        validate_csv(str(path))
+    assert e.value.errors == [(1, "encoding not UTF-8/Windows-1252")]
+
+
+# Body of the 400 api/import_products.php sends for rejected rows
+REJECTED = {
+    "success": False,
+    "error": "2 invalid row(s) in payload",
+    "invalid_rows": [
+        {"row": 3, "name": "Bolo", "error": "Invalid price"},
+        {"row": 5, "name": "Torta", "error": "Invalid code 'x'"},
+    ],
+}
+
+
+def make_response(status, body):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body).encode("utf-8")
+    response.url = "http://example.test/api/import_products.php"
+    return response
+
+
+def test_rejection_details_reads_the_endpoint_invalid_rows():
+    assert rejection_details(make_response(400, REJECTED)) == (2, "line 3: Bolo: Invalid price")
+    assert rejection_details(make_response(401, {"error": "Unauthorized. Valid API key required."})) == (
+        1, "Unauthorized. Valid API key required.")
+
+
+@pytest.mark.parametrize("status, rejected", [(400, True), (401, True), (413, True), (408, False), (429, False),
+                                              (500, False)])
+def test_is_rejection(status, rejected):
+    assert is_rejection(make_response(status, {})) is rejected
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def post(self, *args, **kwargs):
+        return self.response
+
+
+def test_watcher_stops_retrying_a_rejected_file(tmp_path):
+    path = write_csv(tmp_path, 'Descrição,Venda\nBolo,"5,00"\n')
+    config = {"watch_dir": str(tmp_path), "history_file": str(tmp_path / "history.jsonl"),
+              "endpoint_url": "http://example.test", "api_key": None}
+    watcher = FolderWatcher(config, session=FakeSession(make_response(400, REJECTED)))
+    watcher.pending = True
+
+    record = watcher.upload(path, "digest", 0.0)
+
+    assert record["status"] == "invalid"
+    assert record["http_status"] == 400
+    assert (record["errors"], record["error"]) == (2, "line 3: Bolo: Invalid price")
+    assert watcher.pending is False
+    assert json.loads((tmp_path / "history.jsonl").read_text(encoding="utf-8"))["status"] == "invalid"
@@ -6,24 +6,207 @@ Uploads a CSV file to the Portuga import endpoint.
 
 Usage:
     python upload_products.py path/to/PRODUTOS.csv
+    python upload_products.py --watch [path/to/export/folder]
+    python upload_products.py --check path/to/PRODUTOS.csv   (validate only)
+
+Before anything is sent, the CSV is streamed through a local validator that
+applies the same header and price rules as api/import_products.php. Every bad
+row is reported with its line number, and nothing is uploaded. Valid files
+go out as a gzip-compressed JSON payload of normalized rows (prices as
+plain decimals, UTF-8). --raw sends the original file the old way.
+
+Watch mode keeps running and imports automatically whenever the PDV exports
+a new product CSV into the folder: a file is uploaded once it has stopped
+changing for `watch_debounce` seconds, exports landing in quick succession
+are coalesced into one import of the newest file, and a file whose content
+hash matches the last successful import is skipped. Every attempt (latency,
+outcome, counts) is appended to the history file.
 
 Configuration:
-    - Load from localapp/config.json: endpoint_url, api_key
-    - Or use environment variables: UPLOAD_ENDPOINT, IMPORT_API_KEY
+    - Load from localapp/config.json: endpoint_url, api_key,
+      watch_dir, watch_pattern, watch_debounce, watch_retry, history_file
+    - Or use environment variables: UPLOAD_ENDPOINT, IMPORT_API_KEY, UPLOAD_WATCH_DIR
 """
 
 import os
+import re
+import csv
 import sys
+import gzip
 import json
+import time
+import fnmatch
+import hashlib
+import argparse
 import requests
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from pathlib import Path
 
 
+WATCH_POLL_SECONDS = 1.0
+DEFAULT_WATCH_PATTERN = '*.csv'
+DEFAULT_WATCH_DEBOUNCE = 5.0     # seconds a file must be unchanged before it is uploaded
+DEFAULT_WATCH_RETRY = 60.0       # seconds before retrying a failed upload of the same file
+DEFAULT_HISTORY_FILE = 'upload_history.jsonl'
+PAYLOAD_FORMAT = 'normalized-v1'
+CSV_ENCODINGS = ('utf-8-sig', 'cp1252')   # PDV exports are UTF-8 or Windows-1252
+
+# Header aliases, kept in sync with parseCSV() in api/import_products.php
+HEADER_ALIASES = {
+    'pdv_code': ('#', 'código', 'codigo', 'code'),
+    'name': ('descrição', 'descricao', 'description', 'nome', 'name'),
+    'group': ('grupo', 'group', 'categoria', 'category'),
+    'cost': ('custo', 'cost'),
+    'price': ('venda', 'preço', 'preco', 'price'),
+    'active': ('ativo', 'active', 'disponível', 'disponivel', 'available'),
+}
+ACTIVE_TRUE = ('sim', 'yes', 'true', '1', 'ativo')
+ACTIVE_FALSE = ('não', 'nao', 'no', 'false', '0', 'inativo')
+PAYLOAD_COLUMNS = ('line', 'pdv_code', 'name', 'group', 'cost', 'price', 'active')
+
+
+class CSVValidationError(ValueError):
+    """Raised when a product CSV has rows the import endpoint would reject or misread"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} invalid row(s) in CSV")
+
+
+def normalize_price(value):
+    """
+    Brazilian price text to a 2-decimal string, same rules as normalizePrice() in the PHP endpoint
+    (which checks both the CSV and the normalized import paths with them):
+    "R$ 1.234,56" -> "1234.56", "45,00" -> "45.00", "" -> "0.00".
+    Raises ValueError for text that is not a price, negatives, or more than two decimals
+    (e.g. "1.234" with no comma, which could mean 1234 or 1.234).
+    """
+    value = re.sub(r'[^\d,.-]', '', value or '')
+    if not value:
+        return '0.00'
+    if ',' in value and '.' in value:
+        value = value.replace('.', '').replace(',', '.')
+    elif ',' in value:
+        value = value.replace(',', '.')
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"invalid price {value!r}")
+    if number.is_signed():
+        raise ValueError(f"negative price {value!r}")
+    if number != number.quantize(Decimal('0.01')):
+        raise ValueError(f"ambiguous price {value!r} (more than two decimals)")
+    return str(number.quantize(Decimal('0.01')))
+
+
+def map_columns(header):
+    """Column index per field from the header row; -1 when absent"""
+    columns = dict.fromkeys(HEADER_ALIASES, -1)
+    for index, name in enumerate(header):
+        name = name.strip().lower()
+        for field, aliases in HEADER_ALIASES.items():
+            if name in aliases:
+                columns[field] = index
+                break
+    return columns
+
+
+def _read_rows(csv_path, encoding):
+    with open(csv_path, 'r', encoding=encoding, newline='') as f:
+        reader = csv.reader(f, delimiter=',')
+        header = next(reader, None)
+        if header is None:
+            raise CSVValidationError([(1, 'empty file, no header row')])
+        columns = map_columns(header)
+        missing = [label for field, label in (('name', 'Descrição'), ('price', 'Venda')) if columns[field] < 0]
+        if missing:
+            raise CSVValidationError([(1, f"missing required column(s): {', '.join(missing)}")])
+        rows = []
+        errors = []
+        seen_codes = {}
+        for data in reader:
+            line = reader.line_num
+            if not any(cell.strip() for cell in data):
+                continue
+
+            def cell(field, default=''):
+                index = columns[field]
+                return data[index].strip() if 0 <= index < len(data) else default
+
+            name = cell('name')
+            if not name:
+                # The endpoint skips nameless rows; so do we
+                continue
+            row_errors = []
+            code = cell('pdv_code')
+            if code and not code.isdigit():
+                row_errors.append(f"invalid code {code!r}")
+            elif code:
+                if code in seen_codes:
+                    row_errors.append(f"code {code} repeated (first on line {seen_codes[code]})")
+                seen_codes.setdefault(code, line)
+            prices = {}
+            for field in ('cost', 'price'):
+                try:
+                    prices[field] = normalize_price(cell(field, '0'))
+                except ValueError as e:
+                    row_errors.append(f"{field}: {e}")
+            active = cell('active', 'Sim').lower()
+            if active not in ACTIVE_TRUE and active not in ACTIVE_FALSE:
+                row_errors.append(f"invalid Ativo value {active!r}")
+            if row_errors:
+                errors.append((line, f"{name}: " + '; '.join(row_errors)))
+                continue
+            rows.append([line, code, name, cell('group') or 'Geral', prices['cost'], prices['price'],
+                         active in ACTIVE_TRUE])
+        return rows, errors
+
+
+def validate_csv(csv_path):
+    """
+    Stream the CSV once and return its normalized rows.
+
+    Raises CSVValidationError listing every bad row with its line number.
+    Files that are not valid UTF-8 are re-read as Windows-1252; a file that
+    is neither is rejected as a whole.
+    """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"CSV file not found: {csv_path}")
+    for encoding in CSV_ENCODINGS:
+        try:
+            rows, errors = _read_rows(csv_path, encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise CSVValidationError([(1, "encoding not UTF-8/Windows-1252")])
+    if errors:
+        raise CSVValidationError(errors)
+    return rows
+
+
+def build_payload(csv_path, rows):
+    """Compact gzip'd JSON body for the endpoint's normalized import path"""
+    body = {
+        'format': PAYLOAD_FORMAT,
+        'source': os.path.basename(csv_path),
+        'columns': PAYLOAD_COLUMNS,
+        'rows': rows,
+    }
+    return gzip.compress(json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
 def load_config():
     """Load configuration from config.json or environment variables"""
     config = {
         'endpoint_url': None,
-        'api_key': None
+        'api_key': None,
+        'watch_dir': None,
+        'watch_pattern': DEFAULT_WATCH_PATTERN,
+        'watch_debounce': DEFAULT_WATCH_DEBOUNCE,
+        'watch_retry': DEFAULT_WATCH_RETRY,
+        'history_file': str(Path(__file__).parent / DEFAULT_HISTORY_FILE),
     }
     
     # Try to load from config.json
@@ -34,6 +217,9 @@ def load_config():
                 file_config = json.load(f)
                 config['endpoint_url'] = file_config.get('endpoint_url')
                 config['api_key'] = file_config.get('api_key')
+                for key in ('watch_dir', 'watch_pattern', 'watch_debounce', 'watch_retry', 'history_file'):
+                    if file_config.get(key) is not None:
+                        config[key] = file_config[key]
         except Exception as e:
             print(f"Warning: Could not load config.json: {e}")
     
@@ -42,11 +228,13 @@ def load_config():
         config['endpoint_url'] = os.getenv('UPLOAD_ENDPOINT')
     if os.getenv('IMPORT_API_KEY'):
         config['api_key'] = os.getenv('IMPORT_API_KEY')
+    if os.getenv('UPLOAD_WATCH_DIR'):
+        config['watch_dir'] = os.getenv('UPLOAD_WATCH_DIR')
     
     return config
 
 
-def upload_csv(csv_path, endpoint_url, api_key=None):
+def upload_csv(csv_path, endpoint_url, api_key=None, session=None, raw=False):
     """
     Upload CSV file to the import endpoint
     
@@ -54,9 +242,14 @@ def upload_csv(csv_path, endpoint_url, api_key=None):
         csv_path: Path to CSV file
         endpoint_url: URL of the import endpoint
         api_key: Optional API key for authentication
+        session: Optional requests.Session to reuse (keeps the connection alive in watch mode)
+        raw: Send the CSV file as-is instead of the validated, normalized payload
         
     Returns:
         dict: Response from the server
+    
+    Raises:
+        CSVValidationError: the file has invalid rows (nothing is sent)
     """
     if not os.path.exists(csv_path):
         raise FileNotFoundError(f"CSV file not found: {csv_path}")
@@ -66,13 +259,23 @@ def upload_csv(csv_path, endpoint_url, api_key=None):
     if api_key:
         headers['IMPORT_API_KEY'] = api_key
     
+    if not raw:
+        rows = validate_csv(csv_path)
+        payload = build_payload(csv_path, rows)
+        headers['Content-Type'] = 'application/json'
+        headers['Content-Encoding'] = 'gzip'
+        print(f"Uploading {len(rows)} products from {csv_path} to {endpoint_url} ({len(payload)} bytes)...")
+        response = (session or requests).post(endpoint_url, data=payload, headers=headers, timeout=300)
+        response.raise_for_status()
+        return response.json()
+    
     # Prepare files for multipart upload
     with open(csv_path, 'rb') as f:
         files = {'file': (os.path.basename(csv_path), f, 'text/csv')}
         
         # Make POST request
         print(f"Uploading {csv_path} to {endpoint_url}...")
-        response = requests.post(
+        response = (session or requests).post(
             endpoint_url,
             files=files,
             headers=headers,
@@ -85,18 +288,244 @@ def upload_csv(csv_path, endpoint_url, api_key=None):
     return response.json()
 
 
+def file_sha256(path):
+    """Hash a file in chunks so large exports are never loaded whole"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def append_history(history_path, record):
+    """Append one upload attempt to the JSON-lines history file"""
+    try:
+        with open(history_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except OSError as e:
+        print(f"Warning: Could not write history: {e}")
+
+
+def rejection_details(response):
+    """
+    (error count, first error) from a 4xx response of the import endpoint.
+    Bad rows come back as invalid_rows: [{"row", "name", "error"}, ...]; other rejections
+    carry a single error.
+    """
+    try:
+        data = response.json()
+    except ValueError:
+        return 1, (response.text or '').strip()[:200] or f"HTTP {response.status_code}"
+    if not isinstance(data, dict):
+        return 1, f"HTTP {response.status_code}"
+    invalid = data.get('invalid_rows') or []
+    if invalid:
+        first = invalid[0]
+        name = f"{first['name']}: " if first.get('name') else ''
+        return len(invalid), f"line {first.get('row')}: {name}{first.get('error')}"
+    return 1, data.get('error') or f"HTTP {response.status_code}"
+
+
+def is_rejection(response):
+    """4xx the same file would get again; 408 and 429 are worth retrying"""
+    return response is not None and 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+
+
+def last_uploaded_hash(history_path):
+    """Content hash of the last successful import recorded in the history file"""
+    last = None
+    try:
+        with open(history_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('status') == 'ok':
+                    last = record.get('sha256')
+    except OSError:
+        pass
+    return last
+
+
+class FolderWatcher:
+    """
+    Polls a folder for product exports and uploads them once they settle.
+
+    Polling (one stat per matching file per second) instead of OS change
+    notifications keeps this dependency-free and works on network shares.
+    """
+
+    def __init__(self, config, session=None, raw=False):
+        self.raw = raw
+        self.folder = config['watch_dir']
+        self.pattern = config.get('watch_pattern') or DEFAULT_WATCH_PATTERN
+        self.debounce = float(config.get('watch_debounce') or DEFAULT_WATCH_DEBOUNCE)
+        self.retry = float(config.get('watch_retry') or DEFAULT_WATCH_RETRY)
+        self.history_path = config['history_file']
+        self.endpoint_url = config['endpoint_url']
+        self.api_key = config['api_key']
+        self.session = session or requests.Session()
+        self.seen = {}              # path -> (size, mtime) at the last poll
+        self.last_change = None     # monotonic time of the last change observed in the folder
+        self.pending = False
+        self.retry_at = 0.0
+        self.last_hash = last_uploaded_hash(self.history_path)
+
+    def scan(self):
+        """Stat the matching files; returns True if anything appeared or changed"""
+        current = {}
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and fnmatch.fnmatch(entry.name.lower(), self.pattern.lower()):
+                st = entry.stat()
+                current[entry.path] = (st.st_size, st.st_mtime)
+        changed = any(self.seen.get(path) != sig for path, sig in current.items())
+        self.seen = current
+        return changed
+
+    def newest(self):
+        if not self.seen:
+            return None
+        return max(self.seen, key=lambda path: self.seen[path][1])
+
+    def poll(self, now=None):
+        """One watch iteration; returns the history record if an upload was attempted"""
+        now = time.monotonic() if now is None else now
+        if self.scan():
+            # Any write restarts the quiet period, so a burst of exports becomes one import
+            self.last_change = now
+            self.pending = True
+        if not self.pending or now - self.last_change < self.debounce or now < self.retry_at:
+            return None
+        path = self.newest()
+        if path is None:
+            self.pending = False
+            return None
+        try:
+            digest = file_sha256(path)
+        except OSError as e:
+            print(f"⚠️  Could not read {path}: {e}")
+            self.retry_at = now + self.retry
+            return None
+        if digest == self.last_hash:
+            self.pending = False
+            print(f"= {os.path.basename(path)} unchanged since last import, skipped")
+            return None
+        return self.upload(path, digest, now)
+
+    def upload(self, path, digest, now):
+        record = {
+            'ts': datetime.now().astimezone().isoformat(timespec='seconds'),
+            'file': os.path.basename(path),
+            'sha256': digest,
+            'bytes': self.seen.get(path, (0, 0))[0],
+        }
+        t0 = time.perf_counter()
+        try:
+            result = upload_csv(path, self.endpoint_url, self.api_key, session=self.session, raw=self.raw)
+            record['latency'] = round(time.perf_counter() - t0, 3)
+            record['imported'] = result.get('imported', 0)
+            record['updated'] = result.get('updated', 0)
+            record['skipped'] = result.get('skipped', 0)
+            record['errors'] = len(result.get('errors') or [])
+            record['status'] = 'failed' if result.get('success') is False else 'ok'
+        except CSVValidationError as e:
+            record['latency'] = round(time.perf_counter() - t0, 3)
+            record['status'] = 'invalid'
+            record['errors'] = len(e.errors)
+            record['error'] = f"line {e.errors[0][0]}: {e.errors[0][1]}"
+        except requests.exceptions.HTTPError as e:
+            record['latency'] = round(time.perf_counter() - t0, 3)
+            if is_rejection(e.response):
+                record['status'] = 'invalid'
+                record['http_status'] = e.response.status_code
+                record['errors'], record['error'] = rejection_details(e.response)
+            else:
+                record['status'] = 'error'
+                record['error'] = str(e)
+        except Exception as e:
+            record['latency'] = round(time.perf_counter() - t0, 3)
+            record['status'] = 'error'
+            record['error'] = str(e)
+        append_history(self.history_path, record)
+        if record['status'] == 'invalid':
+            # Retrying the same content cannot succeed; wait for the next export
+            self.pending = False
+            if 'http_status' in record:
+                print(f"❌ {record['file']}: rejected by the server (HTTP {record['http_status']}): {record['error']}; "
+                      f"waiting for the next export")
+            else:
+                print(f"❌ {record['file']}: {record['errors']} invalid row(s), not uploaded (first: {record['error']})")
+        elif record['status'] == 'ok':
+            self.last_hash = digest
+            self.pending = False
+            print(f"✅ {record['file']} imported in {record['latency']:.1f}s "
+                  f"(inserted {record['imported']}, updated {record['updated']}, errors {record['errors']})")
+        else:
+            # Leave it pending; a newer export or the retry timer triggers the next attempt
+            self.retry_at = now + self.retry
+            print(f"❌ {record['file']}: {record.get('error') or 'import failed'} (retrying in {self.retry:.0f}s)")
+        return record
+
+    def run(self):
+        print(f"Watching {self.folder} for {self.pattern} (debounce {self.debounce:.0f}s, Ctrl+C to stop)")
+        try:
+            while True:
+                try:
+                    self.poll()
+                except OSError as e:
+                    print(f"⚠️  Watch folder unavailable: {e}")
+                time.sleep(WATCH_POLL_SECONDS)
+        except KeyboardInterrupt:
+            print("\nStopped watching")
+        finally:
+            self.session.close()
+
+
+def print_validation_errors(error):
+    print(f"\n❌ {error}")
+    for line, message in error.errors:
+        print(f"   line {line}: {message}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Upload product CSV exports to the Portuga import endpoint")
+    parser.add_argument("csv_path", nargs="?", help="CSV file to upload once")
+    parser.add_argument("--watch", nargs="?", const="", metavar="DIR",
+                        help="keep running and upload new exports from DIR (default: watch_dir from config)")
+    parser.add_argument("--check", action="store_true", help="validate the CSV locally and exit without uploading")
+    parser.add_argument("--raw", action="store_true", help="send the CSV file as-is (server-side parsing only)")
+    return parser.parse_args()
+
+
 def main():
     """Main entry point"""
-    if len(sys.argv) < 2:
+    args = parse_args()
+    if args.csv_path is None and args.watch is None:
         print("Usage: python upload_products.py path/to/PRODUTOS.csv")
+        print("       python upload_products.py --watch [path/to/export/folder]")
         print("\nConfiguration:")
         print("  Set endpoint_url and api_key in localapp/config.json")
         print("  Or use environment variables:")
-        print("    UPLOAD_ENDPOINT - URL of the import endpoint")
-        print("    IMPORT_API_KEY  - API key for authentication")
+        print("    UPLOAD_ENDPOINT  - URL of the import endpoint")
+        print("    IMPORT_API_KEY   - API key for authentication")
+        print("    UPLOAD_WATCH_DIR - folder watched by --watch")
         sys.exit(1)
     
-    csv_path = sys.argv[1]
+    if args.check:
+        if not args.csv_path:
+            print("Error: --check needs a CSV path")
+            sys.exit(1)
+        try:
+            rows = validate_csv(args.csv_path)
+        except CSVValidationError as e:
+            print_validation_errors(e)
+            sys.exit(1)
+        except FileNotFoundError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ {len(rows)} products OK")
+        return
     
     # Load configuration
     config = load_config()
@@ -106,9 +535,21 @@ def main():
         print("Set it in localapp/config.json or UPLOAD_ENDPOINT environment variable")
         sys.exit(1)
     
+    if args.watch is not None:
+        if args.watch:
+            config['watch_dir'] = args.watch
+        if not config['watch_dir'] or not os.path.isdir(config['watch_dir']):
+            print(f"Error: watch folder not found: {config['watch_dir']}")
+            print("Pass it to --watch or set watch_dir in localapp/config.json")
+            sys.exit(1)
+        FolderWatcher(config, raw=args.raw).run()
+        return
+    
+    csv_path = args.csv_path
+    
     try:
         # Upload CSV
-        result = upload_csv(csv_path, config['endpoint_url'], config['api_key'])
+        result = upload_csv(csv_path, config['endpoint_url'], config['api_key'], raw=args.raw)
         
         # Print result
         print("\n" + "="*60)
@@ -131,9 +572,13 @@ def main():
         print(f"   Updated:  {result.get('updated', 0)}")
         print(f"   Skipped:  {result.get('skipped', 0)}")
         
+    except CSVValidationError as e:
+        print_validation_errors(e)
+        print("Nothing was uploaded.")
+        sys.exit(1)
     except requests.exceptions.HTTPError as e:
         print(f"\n❌ HTTP Error: {e}")
-        if e.response:
+        if e.response is not None:
             try:
                 error_data = e.response.json()
                 print(json.dumps(error_data, indent=2, ensure_ascii=False))